@@ -3,6 +3,7 @@ The actual web crawler
 '''
 
 import time
+import math
 import os
 import random
 import socket
@@ -13,6 +14,7 @@ import traceback
 import concurrent
 import resource
 import ssl
+import functools
 
 import asyncio
 import uvloop
@@ -39,6 +41,15 @@ from . import warc
 from . import dns
 from . import geoip
 from . import memory
+from . import replay
+from . import content_model
+from . import pool
+from . import tls
+from . import bandwidth
+from . import controller as controller_module
+from . import pipeline
+from . import slowhost
+from . import sitemap
 
 LOGGER = logging.getLogger(__name__)
 __title__ = 'cocrawler'
@@ -57,10 +68,22 @@ class Crawler:
         self.next_minute = 0
         self.next_hour = time.time() + 3600
         self.max_page_size = int(config.read('Crawl', 'MaxPageSize'))
+        self.shaper = bandwidth.setup()
+        self.stage_handlers = [(name, getattr(self, 'stage_'+name)) for name in pipeline.stage_names]
+        self.pipeline = None
+        if config.read('Pipeline', 'Enabled'):
+            self.pipeline = pipeline.Pipeline(self.stage_handlers, self.finish_pipeline_job)
+        self.spool_size = config.read('Crawl', 'SpoolSize')
+        if self.spool_size is not None:
+            self.spool_size = int(self.spool_size)
         self.prevent_compression = config.read('Crawl', 'PreventCompression')
         self.upgrade_insecure_requests = config.read('Crawl', 'UpgradeInsecureRequests')
         self.max_workers = int(config.read('Crawl', 'MaxWorkers'))
         self.workers = []
+        self.controller = controller_module.setup(max(1, self.max_workers//2), self.max_workers)
+        self.controller_workers = self.max_workers
+        self.target_workers = 0
+        self.retiring_workers = 0
 
         try:
             # this works for the installed package
@@ -83,10 +106,16 @@ class Crawler:
         if local_addr:
             self.conn_kwargs['local_addr'] = (local_addr, 0)
         self.conn_kwargs['family'] = socket.AF_INET  # XXX config option -- this is ipv4 only
-        self.conn_kwargs['ssl'] = ssl.create_default_context(cafile=certifi.where())
+        tls_session_cache_size = int(config.read('Fetcher', 'TLSSessionCacheSize'))
+        if tls_session_cache_size:
+            self.conn_kwargs['ssl'] = tls.create_default_context(cafile=certifi.where(), size=tls_session_cache_size)
+        else:
+            self.conn_kwargs['ssl'] = ssl.create_default_context(cafile=certifi.where())
         # see https://bugs.python.org/issue27970 for python not handling missing intermediates
 
-        conn = aiohttp.connector.TCPConnector(**self.conn_kwargs)
+        self.conn_kwargs.update(pool.connector_kwargs())
+
+        conn = pool.PolicyConnector(**self.conn_kwargs)
         self.connector = conn
 
         connect_timeout = float(config.read('Crawl', 'ConnectTimeout'))
@@ -98,13 +127,35 @@ class Crawler:
             timeout_kwargs['total'] = page_timeout
         timeout = aiohttp.ClientTimeout(**timeout_kwargs)
 
-        cookie_jar = aiohttp.DummyCookieJar()
-        self.session = aiohttp.ClientSession(connector=conn, cookie_jar=cookie_jar,
-                                             auto_decompress=False, timeout=timeout)
+        replay_directory = config.read('Fetcher', 'ReplayDirectory')
+        if replay_directory:
+            LOGGER.warning('replaying from the warcs in %s instead of fetching', replay_directory)
+            self.session = replay.ReplaySession(os.path.expanduser(replay_directory))
+        else:
+            cookie_jar = aiohttp.DummyCookieJar()
+            self.session = aiohttp.ClientSession(connector=conn, cookie_jar=cookie_jar,
+                                                 auto_decompress=False, timeout=timeout,
+                                                 trace_configs=[pool.add_trace_hooks(fetcher.trace_config())])
 
         self.datalayer = datalayer.Datalayer()
+        self.content_model = None
+        if int(config.read('Crawl', 'ContentTypeModelSize')):
+            self.content_model = content_model.ContentTypeModel()
+            self.content_model_skip = float(config.read('Crawl', 'ContentTypeModelSkip'))
+            self.content_model_demote = float(config.read('Crawl', 'ContentTypeModelDemote'))
+            self.content_model_explore = float(config.read('Crawl', 'ContentTypeModelExplore'))
         self.robots = robots.Robots(self.robotname, self.session, self.datalayer)
-        self.scheduler = scheduler.Scheduler(self.robots, self.resolver)
+        self.robots_prefetcher = None
+        robots_prefetch_concurrency = int(config.read('Robots', 'PrefetchConcurrency'))
+        if robots_prefetch_concurrency:
+            self.robots_prefetcher = robots.RobotsPrefetcher(self.robots, self.prefetch_robots,
+                                                             concurrency=robots_prefetch_concurrency,
+                                                             queue_size=int(config.read('Robots', 'PrefetchQueueSize')))
+        self.slowhosts = slowhost.setup()
+        self.scheduler = scheduler.Scheduler(self.robots, self.resolver, slowhosts=self.slowhosts,
+                                             robots_prefetcher=self.robots_prefetcher)
+        conn.host_has_work = self.scheduler.host_has_work
+        self.sitemaps = sitemap.setup(self)
 
         self.crawllog = config.read('Logging', 'Crawllog')
         if self.crawllog:
@@ -131,6 +182,16 @@ class Crawler:
             self.facetlogfd = None
 
         self.warcwriter = warc.setup(self.version, self.warcheader_version, local_addr)
+        self.warc_revisit = config.read('WARC', 'WARCRevisit')
+        self.warc_non_html = config.read('WARC', 'WARCNonHTML')
+
+        self.header_policy = None
+        if config.read('Crawl', 'AbortNonHTML'):
+            if self.warcwriter is not None and self.warc_non_html:
+                LOGGER.info('not aborting non-html fetches because WARCNonHTML is set')
+            else:
+                max_content_length = config.read('Crawl', 'MaxContentLength')
+                self.header_policy = functools.partial(fetcher.header_policy, max_content_length=max_content_length)
 
         url_allowed.setup()
         stats.init()
@@ -141,6 +202,10 @@ class Crawler:
             LOGGER.info('at time of loading, stats are')
             stats.report()
         else:
+            snapshot = config.read('Fetcher', 'DNSCacheSnapshot')
+            if snapshot:
+                with open(os.path.expanduser(snapshot), 'rb') as f:
+                    self.resolver.load(f)
             self._seeds = seeds.expand_seeds_config(self)
             LOGGER.info('after adding seeds, work queue is %r urls', self.scheduler.qsize())
             stats.stats_max('initial seeds', self.scheduler.qsize())
@@ -194,6 +259,7 @@ class Crawler:
             return
 
         reason = None
+        model_says = None
 
         allowed = url_allowed.url_allowed(url)
         if not allowed:
@@ -210,9 +276,13 @@ class Crawler:
             reason = 'rejected by MaxDepth'
         elif 'skip_crawled' not in ridealong and self.datalayer.seen(url):
             reason = 'rejected by crawled'
-        elif not self.scheduler.check_budgets(url):
-            # the budget is debited here, so it has to be last
-            reason = 'rejected by crawl budgets'
+        else:
+            model_says = self.content_model_says(url, ridealong)
+            if model_says == 'skip':
+                reason = 'rejected by content-type model'
+            elif not self.scheduler.check_budgets(url):
+                # the budget is debited here, so it has to be last
+                reason = 'rejected by crawl budgets'
 
         if 'skip_crawled' in ridealong:
             self.log_frontier(url)
@@ -233,6 +303,10 @@ class Crawler:
         LOGGER.debug('actually adding url %s, surt %s', url.url, url.surt)
         stats.stats_sum('added urls', 1)
 
+        if model_says == 'demote':
+            stats.stats_sum('add_url demoted by content-type model', 1)
+            priority += 1
+
         ridealong['priority'] = priority
 
         # to randomize fetches
@@ -244,10 +318,40 @@ class Crawler:
         self.scheduler.set_ridealong(url.surt, ridealong)
 
         self.scheduler.queue_work((priority, rand, url.surt))
+        if self.robots_prefetcher:
+            self.robots_prefetcher.want(url, seed_host=ridealong.get('seed_host') if ridealong.get('seed') else None)
+        self.maybe_spawn_worker()
 
         self.datalayer.add_seen(url)
         return 1
 
+    def add_urls(self, priority, batch):
+        '''
+        Add a batch of (ridealong, rand) at the same priority. Returns how many were added.
+        '''
+        added = 0
+        with stats.record_burn('add_urls batch'):
+            for ridealong, rand in batch:
+                if self.add_url(priority, ridealong, rand=rand):
+                    added += 1
+        stats.stats_max('add_urls max batch', len(batch))
+        return added
+
+    def content_model_says(self, url, ridealong):
+        if self.content_model is None or 'seed' in ridealong:
+            return
+        p = self.content_model.predict(url)
+        if p is None:
+            return
+        if p >= self.content_model_skip:
+            if random.random() < self.content_model_explore:
+                # without fetching some, the model never finds out if it was wrong
+                stats.stats_sum('content-type model explore', 1)
+                return 'demote'
+            return 'skip'
+        if p >= self.content_model_demote:
+            return 'demote'
+
     def cancel_workers(self):
         for w in self.workers:
             if not w.done():
@@ -255,6 +359,12 @@ class Crawler:
         cw = self.control_limit_worker
         if cw and not cw.done():
             cw.cancel()
+        if self.pipeline:
+            self.pipeline.cancel()
+        if self.robots_prefetcher:
+            self.robots_prefetcher.cancel()
+        if self.sitemaps:
+            self.sitemaps.cancel()
 
     async def close(self):
         stats.report()
@@ -274,12 +384,14 @@ class Crawler:
             del self.warcwriter
             self.warcwriter = None
         if self.robots is not None:
+            self.robots.close()
             del self.robots
             self.robots = None
         if self.scheduler.qsize():
             LOGGER.warning('at exit, non-zero qsize=%d', self.scheduler.qsize())
         await self.session.close()
         await self.connector.close()
+        await self.resolver.close()
 
     def _retry_if_able(self, work, ridealong, json_log, stats_prefix=''):
         priority, rand, surt = work
@@ -292,6 +404,7 @@ class Crawler:
             seeds.fail(ridealong, self, json_log)
             return
         ridealong['retries_left'] = retries_left
+        ridealong['retried'] = True
         self.scheduler.set_ridealong(surt, ridealong)
         # increment random so that we don't immediately retry
         extra = random.uniform(0, 0.2)
@@ -302,9 +415,16 @@ class Crawler:
 
     async def fetch_and_process(self, work):
         '''
-        Fetch and process a single url.
+        Fetch and process a single url, running all of the stages in this coroutine.
         '''
-        priority, rand, surt = work
+        job = pipeline.Job(work)
+        try:
+            await pipeline.run_sequentially(job, self.stage_handlers)
+        finally:
+            self.finish_job(job)
+
+    async def stage_dns(self, job):
+        priority, rand, surt = job.work
 
         # when we're in the dregs of retried urls with high rand, don't exceed priority+1
         stats.stats_set('priority', priority+min(rand, 0.99))
@@ -312,54 +432,73 @@ class Crawler:
         ridealong = self.scheduler.get_ridealong(surt)
         if 'url' not in ridealong:
             raise ValueError('missing ridealong for surt '+surt)
-        url = ridealong['url']
+        job.ridealong = ridealong
+        url = job.url = ridealong['url']
         seed_host = ridealong.get('seed_host')
         if seed_host and ridealong.get('seed'):
-            robots_seed_host = seed_host
-        else:
-            robots_seed_host = None
+            job.robots_seed_host = seed_host
 
-        prefetch_dns, get_kwargs = fetcher.apply_url_policies(url, self)
+        prefetch_dns, job.get_kwargs = fetcher.apply_url_policies(url, self)
 
-        json_log = {'kind': 'get', 'url': url.url, 'priority': priority, 'time': time.time()}
-        if get_kwargs['proxy']:
+        json_log = job.json_log
+        json_log.update({'kind': 'get', 'url': url.url, 'priority': priority, 'time': time.time()})
+        if job.get_kwargs['proxy']:
             json_log['proxy'] = True
         if seed_host:
             json_log['seed_host'] = seed_host
 
-        host_geoip = {}
-        dns_entry = None
         if prefetch_dns:
-            dns_entry = await dns.prefetch(url, self.resolver)
+            dns_entry = job.dns_entry = await dns.prefetch(url, self.resolver, retry=ridealong.get('retried', False))
             if dns_entry:
                 json_log['ip'] = dns.entry_to_as(dns_entry)
             else:
                 # fail out: we don't want to do DNS in the robots or page fetch
-                self._retry_if_able(work, ridealong, json_log)
+                self._retry_if_able(job.work, ridealong, json_log)
                 json_log['fail'] = 'no dns info'
-                if self.crawllogfd:
-                    print(json.dumps(json_log, sort_keys=True), file=self.crawllogfd)
-                return
-            addrs, expires, _, host_geoip = dns_entry
-            if not host_geoip:
+                return False
+            addrs, expires, _, job.host_geoip = dns_entry
+            if not job.host_geoip:
                 with stats.record_burn('geoip lookup'):
-                    geoip.lookup_all(addrs, host_geoip)
+                    geoip.lookup_all(addrs, job.host_geoip)
                 post_fetch.post_dns(addrs, expires, url, self)
+        return True
 
-        r = await self.robots.check(url, dns_entry=dns_entry, seed_host=robots_seed_host,
-                                    crawler=self, get_kwargs=get_kwargs)
+    async def prefetch_robots(self, url, seed_host):
+        '''
+        Called by the robots prefetcher to fetch and cache robots.txt for url's host.
+        '''
+        prefetch_dns, get_kwargs = fetcher.apply_url_policies(url, self)
+        dns_entry = None
+        if prefetch_dns:
+            dns_entry = await dns.prefetch(url, self.resolver)
+            if not dns_entry:
+                return
+        schemenetloc = url.urlsplit.scheme + '://' + url.urlsplit.netloc
+        await self.robots.fetch_robots(schemenetloc, dns_entry, self, seed_host=seed_host, get_kwargs=get_kwargs)
+
+    async def stage_robots(self, job):
+        r = await self.robots.check(job.url, dns_entry=job.dns_entry, seed_host=job.robots_seed_host,
+                                    crawler=self, get_kwargs=job.get_kwargs)
         if r != 'allowed':
             if r == 'no robots':
-                json_log['fail'] = 'no robots'
+                job.json_log['fail'] = 'no robots'
             else:
-                json_log['fail'] = 'robots denied'
-            self._retry_if_able(work, ridealong, json_log, stats_prefix='robots ')
-            if self.crawllogfd:
-                print(json.dumps(json_log, sort_keys=True), file=self.crawllogfd)
-            return
-
-        f = await fetcher.fetch(url, self.session, max_page_size=self.max_page_size,
-                                get_kwargs=get_kwargs)
+                job.json_log['fail'] = 'robots denied'
+            self._retry_if_able(job.work, job.ridealong, job.json_log, stats_prefix='robots ')
+            return False
+        return True
+
+    async def stage_fetch(self, job):
+        url, ridealong, json_log = job.url, job.ridealong, job.json_log
+        priority, rand, surt = job.work
+
+        t0 = time.time()
+        f = job.f = await fetcher.fetch(url, self.session, max_page_size=self.max_page_size,
+                                        get_kwargs=job.get_kwargs, spool_size=self.spool_size,
+                                        header_policy=self.header_policy, shaper=self.shaper)
+        if self.slowhosts:
+            surt_host, _, _ = surt.partition(')')
+            json_log['lane'] = self.slowhosts.fetched(surt, surt_host, f, time.time() - t0, url=url)
 
         if f.is_truncated:
             json_log['truncated'] = f.is_truncated
@@ -369,16 +508,16 @@ class Crawler:
             json_log['exception'] = f.last_exception
         if f.t_first_byte is not None:
             json_log['t_first_byte'] = f.t_first_byte
+        if f.timings:
+            json_log['timings'] = dict((k, round(v, 3)) for k, v in f.timings.items())
         if f.ip is not None:
             json_log['ip'] = f.ip
         elif 'ip' in json_log:
             stats.stats_sum('fetch ip is from dns', 1)
 
         if post_fetch.should_retry(f):
-            self._retry_if_able(work, ridealong, json_log)
-            if self.crawllogfd:
-                print(json.dumps(json_log, sort_keys=True), file=self.crawllogfd)
-            return
+            self._retry_if_able(job.work, ridealong, json_log)
+            return False
 
         self.scheduler.del_ridealong(surt)
 
@@ -396,41 +535,78 @@ class Crawler:
             stats.stats_sum('unretryable_1xx', 1)
 
         if 200 <= f.response.status < 300:
-            await post_fetch.post_2xx(f, url, ridealong, priority, host_geoip, json_log, self)
+            return True
         elif post_fetch.is_redirect(f.response):
-            post_fetch.handle_redirect(f, url, ridealong, priority, host_geoip, json_log, self, rand=rand)
+            post_fetch.handle_redirect(f, url, ridealong, priority, job.host_geoip, json_log, self, rand=rand)
             # meta-http-equiv-redirect will be dealt with in post_fetch
         else:
             seeds.fail(ridealong, self, json_log)
-
-        LOGGER.debug('size of work queue now stands at %r urls', self.scheduler.qsize())
-        LOGGER.debug('size of ridealong now stands at %r urls', self.scheduler.ridealong_size())
-        stats.stats_set('queue size', self.scheduler.qsize())
-        stats.stats_max('max queue size', self.scheduler.qsize())
-        stats.stats_set('ridealong size', self.scheduler.ridealong_size())
-
-        if self.crawllogfd:
-            print(json.dumps(json_log, sort_keys=True), file=self.crawllogfd)
+        return False
+
+    async def stage_post(self, job):
+        job.decoded = post_fetch.post_2xx_decode(job.f, job.url, job.json_log, self)
+        return job.decoded is not None
+
+    async def stage_parse(self, job):
+        job.parsed = await post_fetch.post_2xx_parse(job.decoded, job.f, job.url, self)
+        job.decoded = None  # let go of the body
+        return job.parsed is not None
+
+    async def stage_links(self, job):
+        priority, _, _ = job.work
+        post_fetch.post_2xx_links(job.parsed, job.url, job.ridealong, priority, job.host_geoip, job.json_log, self)
+        return False
+
+    def finish_job(self, job):
+        if self.slowhosts:
+            # if we didn't get as far as the fetch
+            self.slowhosts.release(job.work[2])
+
+        if job.f is not None and job.f.response is not None:
+            # only log the queue sizes for urls that got fetched
+            LOGGER.debug('size of work queue now stands at %r urls', self.scheduler.qsize())
+            LOGGER.debug('size of ridealong now stands at %r urls', self.scheduler.ridealong_size())
+            stats.stats_set('queue size', self.scheduler.qsize())
+            stats.stats_max('max queue size', self.scheduler.qsize())
+            stats.stats_set('ridealong size', self.scheduler.ridealong_size())
+
+        if self.crawllogfd and job.json_log:
+            print(json.dumps(job.json_log, sort_keys=True), file=self.crawllogfd)
+
+    def finish_pipeline_job(self, job):
+        try:
+            self.finish_job(job)
+        finally:
+            self.scheduler.work_done()
 
     async def work(self):
         '''
-        Process queue items until we run out.
+        Process queue items until we run out, or are retired.
         '''
         try:
             while True:
+                if self.retiring_workers > 0:
+                    self.retiring_workers -= 1
+                    stats.stats_sum('workers retired', 1)
+                    return
+
                 work = await self.scheduler.get_work()
 
-                try:
-                    await self.fetch_and_process(work)
-                except concurrent.futures._base.CancelledError:  # seen with ^C
-                    pass
-                except Exception as e:
-                    # this catches any buggy code that executes in the main thread
-                    LOGGER.error('Something bad happened working on %s, it\'s a mystery:\n%s', work[2], e)
-                    traceback.print_exc()
-                    # falling through causes this work item to get marked done, and we continue
-                    # note that this leaks the ridealong
-                self.scheduler.work_done()
+                if self.pipeline:
+                    # the pipeline calls work_done when the job is finished
+                    await self.pipeline.feed(pipeline.Job(work))
+                else:
+                    try:
+                        await self.fetch_and_process(work)
+                    except concurrent.futures._base.CancelledError:  # seen with ^C
+                        pass
+                    except Exception as e:
+                        # this catches any buggy code that executes in the main thread
+                        LOGGER.error('Something bad happened working on %s, it\'s a mystery:\n%s', work[2], e)
+                        traceback.print_exc()
+                        # falling through causes this work item to get marked done, and we continue
+                        # note that this leaks the ridealong
+                    self.scheduler.work_done()
 
                 if self.stopping:
                     raise asyncio.CancelledError
@@ -447,51 +623,39 @@ class Crawler:
         '''
         Worker dedicated to managing how busy we let the network get
         '''
-        last = time.time()
+        controller = self.controller
+        proc = psutil.Process()
         await asyncio.sleep(1.0)
-        limit = self.max_workers//2
-        dominos = 0
-        undominos = 0
+        last = time.monotonic()
+        last_cpu = time.process_time()
+        last_fetches = stats.stat_value('fetch URLs') or 0
         while True:
             await asyncio.sleep(1.0)
-            t = time.time()
+            t = time.monotonic()
             elapsed = t - last
-            old_limit = limit
-
-            if elapsed < 1.03:
-                dominos += 1
-                undominos = 0
-                if dominos > 2:
-                    # one action per 3 seconds of stability
-                    limit += 1
-                    dominos = 0
-            else:
-                dominos = 0
-                if elapsed > 5.0:
-                    # always act on tall spikes
-                    limit -= max((limit * 5) // 100, 1)  # 5%
-                    undominos = 0
-                elif elapsed > 1.1:
-                    undominos += 1
-                    if undominos > 1:
-                        # only act if the medium spike is wider than 1 cycle
-                        # (note: these spikes are caused by garbage collection)
-                        limit -= max(limit // 100, 1)  # 1%
-                        undominos = 0
-                else:
-                    undominos = 0
-            limit = min(limit, self.max_workers)
-            limit = max(limit, 1)
-
-            self.connector._limit = limit  # private instance variable
+            cpu = time.process_time()
+            fetches = stats.stat_value('fetch URLs') or 0
+
+            signals = controller_module.Signals(
+                lag=max(0., elapsed - 1.0),
+                cpu=(cpu - last_cpu) / elapsed,
+                burner_backlog=stats.stat_value('await burner thread parser') or 0,
+                pages_per_sec=(fetches - last_fetches) / elapsed,
+                rss=proc.memory_info().rss)
+            last, last_cpu, last_fetches = t, cpu, fetches
+
+            old_limit = controller.limit
+            limit = controller.update(signals)
+
+            self.connector.set_limit(limit)
+            self.controller_workers = min(self.max_workers, 2 * limit)
             stats.stats_set('network limit', limit)
-            last = t
 
             if limit != old_limit:
-                LOGGER.debug('control_limit: elapsed = %f, adjusting limit by %+d to %d',
-                             elapsed, limit - old_limit, limit)
+                LOGGER.debug('control_limit: %r, adjusting limit by %+d to %d',
+                             signals, limit - old_limit, limit)
             else:
-                LOGGER.debug('control_limit: elapsed = %f', elapsed)
+                LOGGER.debug('control_limit: %r', signals)
 
     def summarize(self):
         self.scheduler.summarize()
@@ -519,12 +683,17 @@ class Crawler:
             self.save(f)
             self.datalayer.save(f)
             stats.save(f)
+        with open(savefile + '.dns', 'wb') as f:
+            self.resolver.save(f)
 
     def load_all(self, filename):
         with open(filename, 'rb') as f:
             self.load(f)
             self.datalayer.load(f)
             stats.load(f)
+        if os.path.exists(filename + '.dns'):
+            with open(filename + '.dns', 'rb') as f:
+                self.resolver.load(f)
 
     def minute(self):
         '''
@@ -550,6 +719,65 @@ class Crawler:
         self.next_hour = time.time() + 3600
         pass
 
+    def resize_workers(self):
+        '''
+        Spawn or retire workers to match the ready work and the controller.
+        Workers sleeping in the scheduler waiting for work are retired
+        first, by cancelling them; busy ones retire after their current work.
+        '''
+        self.workers = [w for w in self.workers if not w.done()]
+        busy = len(self.workers) - self.scheduler.awaiting_work
+        target = min(self.controller_workers, self.scheduler.qsize() + busy)
+        self.target_workers = max(1, target)
+        actual = len(self.workers) - self.retiring_workers
+
+        if actual < self.target_workers:
+            spawn = self.target_workers - actual
+            # un-retire first, it's cheaper
+            unretire = min(spawn, self.retiring_workers)
+            self.retiring_workers -= unretire
+            spawn -= unretire
+            self.workers.extend(asyncio.Task(self.work()) for _ in range(spawn))
+            stats.stats_sum('workers spawned', spawn)
+        elif actual > self.target_workers:
+            # shrink gradually, ready work comes and goes
+            retire = math.ceil((actual - self.target_workers) / 4)
+            for task in self.scheduler.awaiting_tasks():
+                if retire == 0:
+                    break
+                task.cancel()
+                retire -= 1
+                stats.stats_sum('workers retired', 1)
+            self.retiring_workers += retire
+
+        stats.stats_set('workers target', self.target_workers)
+        stats.stats_set('workers actual', len(self.workers) - self.retiring_workers)
+
+    def maybe_spawn_worker(self):
+        '''
+        Called when work is queued, so we don't wait for resize_workers() to notice it
+        '''
+        if not self.workers or self.stopping or self.scheduler.awaiting_work > 0:
+            # not crawling yet, or stopping, or someone is idle
+            return
+        if self.retiring_workers > 0:
+            self.retiring_workers -= 1
+            return
+        if len(self.workers) < self.controller_workers:
+            self.workers.append(asyncio.Task(self.work()))
+            stats.stats_sum('workers spawned', 1)
+
+    def worker_status(self):
+        '''
+        For the REST api
+        '''
+        return {'target': self.target_workers,
+                'actual': len(self.workers) - self.retiring_workers,
+                'max': self.max_workers,
+                'controller': self.controller_workers,
+                'awaiting work': self.scheduler.awaiting_work,
+                'network limit': self.controller.limit}
+
     def update_cpu_stats(self):
         elapsedc = time.process_time()  # should be since process start
         stats.stats_set('main thread cpu time', elapsedc)
@@ -561,7 +789,13 @@ class Crawler:
         self.minute()  # print pre-start stats
 
         self.control_limit_worker = asyncio.Task(self.control_limit())
-        self.workers = [asyncio.Task(self.work()) for _ in range(self.max_workers)]
+        if self.pipeline:
+            self.pipeline.start()
+        if self.robots_prefetcher:
+            self.robots_prefetcher.start()
+        if self.sitemaps:
+            self.sitemaps.start()
+        self.resize_workers()
 
         # this is now the 'main' coroutine
 
@@ -590,6 +824,8 @@ class Crawler:
                 self.paused = False
 
             self.workers = [w for w in self.workers if not w.done()]
+            if not self.stopping:
+                self.resize_workers()
             LOGGER.debug('%d workers remain', len(self.workers))
             if len(self.workers) == 0:
                 # this triggers if we've exhausted our url budget and all workers cancel themselves
@@ -597,7 +833,8 @@ class Crawler:
                 LOGGER.warning('all workers exited, finishing up.')
                 break
 
-            if self.scheduler.done(len(self.workers)):
+            if (self.scheduler.done(len(self.workers)) and not (self.pipeline and self.pipeline.in_flight) and
+                    not (self.sitemaps and self.sitemaps.busy)):
                 # this is a little racy with how awaiting work is set and the queue is read
                 # while we're in this join we aren't looking for STOPCRAWLER etc
                 LOGGER.warning('all workers appear idle, queue appears empty, executing join')
@@ -608,6 +845,10 @@ class Crawler:
             self.minute()
             self.hour()
 
+        if self.stopping and self.pipeline:
+            # let the jobs already taken off the queue finish, so that saving the queue doesn't lose them
+            LOGGER.warning('waiting for %d pipeline jobs to finish', self.pipeline.in_flight)
+            await self.pipeline.join()
         self.cancel_workers()
 
         if self.stopping or config.read('Save', 'SaveAtExit'):
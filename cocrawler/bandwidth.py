@@ -0,0 +1,88 @@
+'''
+Bandwidth shaping with token buckets.
+
+There is a crawl-wide bucket and one per host, and the fetcher's read
+loop charges every block of body bytes to both. When a bucket goes into
+debt, the fetch sleeps until it is paid off, which stops us reading from
+the socket and lets tcp flow control slow the sender down.
+'''
+
+import time
+import asyncio
+import logging
+
+import cachetools
+
+from . import config
+from . import stats
+from . import memory
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    '''
+    rate is bytes/second. burst is how many bytes can be sent at full
+    speed after being idle, default one second's worth.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.last = time.time()
+
+    def charge(self, nbytes, now=None):
+        '''
+        Returns how long to wait before sending more
+        '''
+        now = now or time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= nbytes
+        if self.tokens >= 0:
+            return 0.
+        return -self.tokens / self.rate
+
+
+class Shaper:
+    def __init__(self, rate=None, host_rate=None, max_hosts=10000):
+        self.bucket = TokenBucket(rate) if rate else None
+        self.host_rate = host_rate
+        self.host_buckets = cachetools.LRUCache(max_hosts)
+        memory.register_debug(self.memory)
+
+    def charge(self, host, nbytes):
+        dt = 0.
+        if self.bucket is not None:
+            dt = self.bucket.charge(nbytes)
+        if self.host_rate:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                bucket = self.host_buckets[host] = TokenBucket(self.host_rate)
+            dt = max(dt, bucket.charge(nbytes))
+        return dt
+
+    async def shape(self, host, nbytes, stats_prefix=''):
+        dt = self.charge(host, nbytes)
+        if dt > 0:
+            stats.stats_sum(stats_prefix+'fetcher bandwidth shaping sum', dt)
+            with stats.coroutine_state(stats_prefix+'fetcher bandwidth shaping'):
+                await asyncio.sleep(dt)
+
+    def memory(self):
+        host_buckets = {}
+        host_buckets['bytes'] = memory.total_size(self.host_buckets)
+        host_buckets['len'] = len(self.host_buckets)
+        return {'bandwidth host buckets': host_buckets}
+
+
+def setup():
+    '''
+    Returns a Shaper, or None if there are no bandwidth limits
+    '''
+    rate = config.read('Fetcher', 'MaxBytesPerSecond')
+    host_rate = config.read('Fetcher', 'MaxHostBytesPerSecond')
+    if not rate and not host_rate:
+        return
+    LOGGER.info('bandwidth shaping: %s bytes/sec total, %s bytes/sec per host', rate, host_rate)
+    return Shaper(rate=rate and float(rate), host_rate=host_rate and float(host_rate))
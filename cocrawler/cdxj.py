@@ -0,0 +1,119 @@
+'''
+CDXJ indexes for our WARCs.
+
+Each line is: surt timestamp {json}
+
+The WARC writer appends unsorted lines as it writes records, and sorts
+them into a per-warc index when the warc is closed. The per-warc
+indexes are merged into a crawl-wide index with merge_files(), which
+only holds max_lines lines in memory at a time.
+'''
+
+import os
+import json
+import heapq
+import tempfile
+import itertools
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+def cdxj_line(surt, timestamp, fields):
+    return surt + ' ' + timestamp + ' ' + json.dumps(fields, sort_keys=True) + '\n'
+
+
+def parse_line(line):
+    surt, timestamp, fields = line.rstrip('\n').split(' ', 2)
+    return surt, timestamp, json.loads(fields)
+
+
+def sort_file(infile, outfile):
+    '''
+    Sort a single per-warc index in memory. These are bounded by WARCMaxSize.
+    '''
+    with open(infile, 'r') as f:
+        lines = f.readlines()
+    lines.sort()
+    with open(outfile, 'w') as f:
+        f.writelines(lines)
+    return len(lines)
+
+
+def _write_run(lines, tmpdir):
+    lines.sort()
+    fd, name = tempfile.mkstemp(prefix='cdxj-run-', suffix='.cdxj', dir=tmpdir)
+    with os.fdopen(fd, 'w') as f:
+        f.writelines(lines)
+    return name
+
+
+def make_runs(filenames, max_lines=1000000, tmpdir=None):
+    '''
+    Split possibly-unsorted inputs into sorted runs of at most max_lines lines.
+    '''
+    runs = []
+    lines = []
+    for name in filenames:
+        with open(name, 'r') as f:
+            for line in f:
+                lines.append(line)
+                if len(lines) >= max_lines:
+                    runs.append(_write_run(lines, tmpdir))
+                    lines = []
+    if lines:
+        runs.append(_write_run(lines, tmpdir))
+    return runs
+
+
+def merge_sorted(filenames, out):
+    '''
+    k-way merge of already-sorted files. Memory use is one line per file.
+    '''
+    fds = [open(name, 'r') for name in filenames]
+    count = 0
+    try:
+        for line in heapq.merge(*fds):
+            out.write(line)
+            count += 1
+    finally:
+        for fd in fds:
+            fd.close()
+    return count
+
+
+def merge_files(filenames, out, presorted=True, max_lines=1000000, max_open=500, tmpdir=None):
+    '''
+    Merge cdxj files into out, a file open for writing.
+
+    If the inputs are not known to be sorted, make sorted runs first.
+    If there are more than max_open inputs, merge in several passes.
+    '''
+    if max_open < 2:
+        raise ValueError('max_open must be at least 2, got {}'.format(max_open))
+    temps = []
+    if presorted:
+        names = list(filenames)
+    else:
+        names = make_runs(filenames, max_lines=max_lines, tmpdir=tmpdir)
+        temps.extend(names)
+
+    try:
+        while len(names) > max_open:
+            merged = []
+            it = iter(names)
+            while True:
+                chunk = list(itertools.islice(it, max_open))
+                if not chunk:
+                    break
+                fd, name = tempfile.mkstemp(prefix='cdxj-pass-', suffix='.cdxj', dir=tmpdir)
+                with os.fdopen(fd, 'w') as f:
+                    merge_sorted(chunk, f)
+                temps.append(name)
+                merged.append(name)
+            LOGGER.info('cdxj merge pass reduced %d files to %d', len(names), len(merged))
+            names = merged
+        return merge_sorted(names, out)
+    finally:
+        for name in temps:
+            os.unlink(name)
@@ -43,6 +43,16 @@ Crawl:
   MaxWorkers: 10
   MaxHostQPS: 10
   MaxPageSize: 1000000
+  SpoolSize: 250000  # bodies bigger than this are spooled to an mmap'd temp file
+  AbortNonHTML: True  # close the connection after the headers if we are not going to use the body
+#  MaxContentLength: 10000000  # with AbortNonHTML, also abort if the Content-Length is bigger
+  ContentTypeModelSize: 100000  # host/directory keys remembered by the content-type model, 0=off
+  ContentTypeModelSkip: 0.95  # don't queue urls that are at least this likely to be non-html
+  ContentTypeModelDemote: 0.5  # queue them 1 priority lower if at least this likely
+  ContentTypeModelExplore: 0.05  # fraction of would-be skips queued anyway (demoted), so the model can learn it was wrong
+  SlowHostLane: 10  # max fetches in flight to hosts classified as slow, 0=no slow lane
+  SlowHostFirstByte: 2.  # seconds, moving average, to be classified as slow
+  SlowHostLastByte: 10.  # seconds, ditto
   PreventCompression: False
   UpgradeInsecureRequests: 1  # send this http header
 #  GlobalBudget: None
@@ -51,6 +61,24 @@ Crawl:
   QueueEmbeds: False
   DebugMemory: False
 
+Controller:
+  Algorithm: pid  # or domino, the old lag-only heuristic
+  LagTarget: 0.1  # seconds of event loop lag
+  CPUTarget: 0.9  # fraction of a cpu for the main thread
+  BurnerBacklogTarget: 20  # coroutines waiting for the burner threads
+#  RSSTarget_gigabytes: 8
+
+Pipeline:
+  Enabled: False  # run fetch_and_process as separate stages, each with its own queue and coroutines
+  QueueSize: 100  # per stage
+  Concurrency:  # coroutines per stage
+    dns: 10
+    robots: 10
+    fetch: 50
+    post: 5
+    parse: 5
+    links: 2
+
 UserAgent:
   Style: laptopplus
   MyPrefix: test
@@ -61,6 +89,18 @@ Robots:
   RobotsCacheSize: 100000  # 40mb-ish
   RobotsCacheTimeout: 86400
   MaxRobotsPageSize: 500000
+  DecisionCacheSize: 16  # per host, memoized robots decisions for recent paths
+  PrefetchConcurrency: 10  # background robots.txt fetchers for new hosts, 0 to fetch inline
+  PrefetchQueueSize: 10000
+
+Sitemaps:
+  Enabled: False  # fetch the sitemaps listed in robots.txt, and add their urls
+  Concurrency: 2
+  Priority: 2  # crawl priority of sitemap urls, must be <= Crawl.MaxDepth
+  MaxDepth: 2  # how deep to follow sitemap index files
+  MaxSize: 52428800  # decompressed bytes, the sitemap protocol limit
+  MaxUrlsPerHost: 10000
+  BatchSize: 100
 
 Fetcher:
   Nameservers:
@@ -71,7 +111,16 @@ Fetcher:
   CrawlLocalhost: False  # crawl ips that resolve to localhost
   CrawlPrivate: False  # crawl ips that resolve to private networks (e.g. 10.*/8)
   DNSCacheMaxSize: 1000000
+  DNSNegativeTTL: 3600  # seconds to remember NXDOMAIN/no A records, or the SOA minimum if less. 0=off
+  DNSNegativeTransientTTL: 60  # seconds to remember SERVFAIL, timeouts, etc.
+#  DNSCacheSnapshot: cocrawler-save-1234.dns  # warm the DNS cache of a fresh crawl from a saved snapshot
+#  MaxHostConnections: 2  # default is MaxHostQPS, rounded up
+  KeepAliveTimeout: 15.  # seconds, for hosts that still have queued work
+  TLSSessionCacheSize: 10000  # hosts whose tls sessions we remember for resumption, 0=off
+#  MaxBytesPerSecond: 10000000  # crawl-wide bandwidth cap on response bodies
+#  MaxHostBytesPerSecond: 1000000  # per-host bandwidth cap
 #  ProxyAll: http://127.0.0.1:8080
+#  ReplayDirectory: warcs/  # fetch from these warcs instead of the network
 
 GeoIP:
   ProxyGeoIP: True
@@ -98,6 +147,13 @@ WARC:
   WARCAll: False
   WARCMaxSize: 1000000000
   WARCPrefix: Testing
+  WARCRevisit: False  # write revisit records for duplicate payloads
+  WARCDigestCacheSize: 1000000  # payload digests remembered for revisits
+  WARCIndex: False  # write a sorted .cdxj index next to each warc
+  WARCNonHTML: True  # warc non-html responses, too; this disables AbortNonHTML
+  WARCCompression: gzip  # gzip, zstd (needs the zstandard package), or none
+  WARCZstdLevel: 3
+#  WARCZstdDictionary: warc.zstd-dict  # trained with scripts/bench_warc_compression.py --train
 #  WARCSubPrefix: SubTest2
   WARCDescription: A WARC generated by CoCrawler's automated tests
 #  WARCCreator: person, org, service
@@ -8,6 +8,7 @@ import brotli
 import cgi
 
 from . import stats
+from . import spool
 
 try:
     import cchardet as chardet
@@ -22,6 +23,9 @@ def get_accept_encoding():
 
 
 def decompress(body_bytes, content_encoding, url=None):
+    '''
+    body_bytes can be bytes or a memoryview of a spooled body
+    '''
     content_encoding = content_encoding.lower()
     if content_encoding == 'deflate':
         try:
@@ -44,7 +48,7 @@ def decompress(body_bytes, content_encoding, url=None):
             return body_bytes
     elif content_encoding == 'br':
         try:
-            return brotli.decompress(body_bytes)
+            return brotli.decompress(spool.tobytes(body_bytes))  # brotlipy does not take memoryviews
         except Exception as e:
             LOGGER.debug('bz fail for url %s: %s', url, str(e))
             stats.stats_sum('content-encoding brotli fail', 1)
@@ -55,11 +59,20 @@ def decompress(body_bytes, content_encoding, url=None):
         return body_bytes
 
 
-def parse_headers(resp_headers, json_log):
+html_types = set(('text/html', '', 'application/xhtml+xml'))
+html_types.add('')  # no content type
+html_types.add('*/*')  # mildly common in the wild, whatwg says we should sniff in this case
+
+
+def get_content_type(resp_headers):
     content_type = resp_headers.get('content-type', '')
     # sometimes content_type comes back multiline. whack it with a wrench.
     content_type = content_type.replace('\r', '\n').partition('\n')[0].lower()
-    content_type, options = cgi.parse_header(content_type)
+    return cgi.parse_header(content_type)
+
+
+def parse_headers(resp_headers, json_log):
+    content_type, options = get_content_type(resp_headers)
 
     json_log['content_type'] = content_type
     stats.stats_sum('content-type=' + content_type, 1)
@@ -92,7 +105,7 @@ def parse_headers(resp_headers, json_log):
 #   iso9958-1 to windows-1252 since 1252 a supserset, and a common problem on the actual web
 # https://encoding.spec.whatwg.org/encodings.json
 def my_get_charset(charset, body_bytes):
-    detect = chardet.detect(body_bytes)
+    detect = chardet.detect(spool.tobytes(body_bytes))  # cchardet does not take memoryviews
     if detect['encoding']:
         detect['encoding'] = detect['encoding'].lower()
     if detect['confidence']:
@@ -117,7 +130,7 @@ def my_decode(body_bytes, charset, detect):
             # encoding or detect may be None
             continue
         try:
-            body = body_bytes.decode(encoding=cset)
+            body = str(body_bytes, encoding=cset)  # works for memoryviews, too
             break
         except UnicodeDecodeError:
             # if we truncated the body, we could have caused the error:
@@ -129,6 +142,6 @@ def my_decode(body_bytes, charset, detect):
                 stats.stats_sum('content-encoding unknown: '+cset, 1)
                 pass
     else:
-        body = body_bytes.decode(encoding='utf-8', errors='replace')
+        body = str(body_bytes, encoding='utf-8', errors='replace')
         cset = 'utf-8 replace'
     return body, cset
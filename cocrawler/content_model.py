@@ -0,0 +1,105 @@
+'''
+A learned model of which urls turn out to be html.
+
+Counts of html and non-html responses are kept per (host, first
+directory, extension) and per (host, extension). The model predicts
+the chance that a not-yet-fetched url is non-html from the most
+specific key with enough observations, so that add_url can demote or
+skip urls that are very likely to be images, pdfs, downloads, etc.
+even when they don't have a telltale extension.
+
+State is an LRU of small count tuples, bounded by ContentTypeModelSize.
+Counts are halved when they get large, so the model follows sites that
+change.
+'''
+
+import logging
+
+import cachetools
+
+from . import config
+from . import content
+from . import stats
+from . import memory
+
+LOGGER = logging.getLogger(__name__)
+
+MIN_COUNT = 5  # observations needed before we make a prediction
+MAX_COUNT = 64  # halve counts past this, to stay adaptive
+
+
+def keys(url):
+    '''
+    Returns the model keys for a url, most specific first.
+    '''
+    host = url.hostname_without_www
+    path = url.urlsplit.path or '/'
+
+    directory = '/'
+    if path.count('/') > 1:
+        directory = path[:path.index('/', 1)+1]
+
+    extension = ''
+    _, _, last_part = path.rpartition('/')
+    if '.' in last_part:
+        _, _, extension = last_part.rpartition('.')
+        extension = extension.lower()
+        if len(extension) > 5:
+            # people use dots in random ways
+            extension = ''
+
+    return [(host, directory, extension), (host, '*', extension)]
+
+
+class ContentTypeModel:
+    def __init__(self, size=None):
+        if size is None:
+            size = config.read('Crawl', 'ContentTypeModelSize')
+        self.counts = cachetools.LRUCache(int(size))
+        memory.register_debug(self.memory)
+
+    def update(self, url, content_type):
+        '''
+        Called with the content_type from content.parse_headers()
+        '''
+        is_html = content_type in content.html_types
+
+        prediction = self.predict(url, quiet=True)
+        if prediction is not None:
+            predicted_html = prediction < 0.5
+            if predicted_html == is_html:
+                stats.stats_sum('content-type model right', 1)
+            else:
+                stats.stats_sum('content-type model wrong', 1)
+
+        for key in keys(url):
+            html, non_html = self.counts.get(key, (0, 0))
+            if is_html:
+                html += 1
+            else:
+                non_html += 1
+            if html + non_html > MAX_COUNT:
+                html, non_html = html // 2, non_html // 2
+            self.counts[key] = (html, non_html)
+
+    def predict(self, url, quiet=False):
+        '''
+        Returns the probability that url is not html, or None if we don't know.
+        '''
+        for key in keys(url):
+            if key in self.counts:
+                html, non_html = self.counts[key]
+                if html + non_html >= MIN_COUNT:
+                    # add-one smoothing so we never quite reach certainty
+                    p = (non_html + 1) / (html + non_html + 2)
+                    if not quiet:
+                        stats.stats_sum('content-type model predictions', 1)
+                    return p
+        if not quiet:
+            stats.stats_sum('content-type model no prediction', 1)
+
+    def memory(self):
+        counts = {}
+        counts['bytes'] = memory.total_size(self.counts)
+        counts['len'] = len(self.counts)
+        return {'content-type model': counts}
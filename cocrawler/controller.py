@@ -0,0 +1,200 @@
+'''
+Concurrency controllers.
+
+Once a second the crawler measures some signals and asks the controller
+for a new concurrency limit, which is used as the connection limit, and
+twice it as the number of active workers (up to MaxWorkers.)
+
+Signals:
+  lag -- how late a 1 second sleep woke up, in seconds
+  cpu -- fraction of a cpu used by the main thread
+  burner_backlog -- coroutines waiting on the burner threads
+  pages_per_sec -- fetches completed per second
+  rss -- resident set size, in bytes
+
+DominoController is the original lag-only heuristic. PIDController
+normalizes each signal by its target, and runs a PID loop to keep the
+biggest one (the current bottleneck) just under 1.
+
+SimulatedCrawler is a toy model of a crawler, used by
+scripts/sim_controller.py and the unit tests to check convergence.
+'''
+
+from collections import namedtuple
+import logging
+
+from . import config
+
+LOGGER = logging.getLogger(__name__)
+
+Signals = namedtuple('Signals', ['lag', 'cpu', 'burner_backlog', 'pages_per_sec', 'rss'])
+
+
+class Controller:
+    def __init__(self, limit, min_limit=1, max_limit=None):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = self.clamp(limit)
+
+    def clamp(self, limit):
+        if self.max_limit is not None:
+            limit = min(limit, self.max_limit)
+        return max(int(limit), self.min_limit)
+
+    def update(self, signals):
+        '''
+        Returns the new limit
+        '''
+        raise NotImplementedError
+
+
+class DominoController(Controller):
+    def __init__(self, limit, **kwargs):
+        super().__init__(limit, **kwargs)
+        self.dominos = 0
+        self.undominos = 0
+
+    def update(self, signals):
+        elapsed = 1.0 + signals.lag
+        limit = self.limit
+
+        if elapsed < 1.03:
+            self.dominos += 1
+            self.undominos = 0
+            if self.dominos > 2:
+                # one action per 3 seconds of stability
+                limit += 1
+                self.dominos = 0
+        else:
+            self.dominos = 0
+            if elapsed > 5.0:
+                # always act on tall spikes
+                limit -= max((limit * 5) // 100, 1)  # 5%
+                self.undominos = 0
+            elif elapsed > 1.1:
+                self.undominos += 1
+                if self.undominos > 1:
+                    # only act if the medium spike is wider than 1 cycle
+                    # (note: these spikes are caused by garbage collection)
+                    limit -= max(limit // 100, 1)  # 1%
+                    self.undominos = 0
+            else:
+                self.undominos = 0
+
+        self.limit = self.clamp(limit)
+        return self.limit
+
+
+class PIDController(Controller):
+    def __init__(self, limit, lag_target=0.1, cpu_target=0.9, burner_backlog_target=20,
+                 rss_target=None, kp=0.2, ki=0.05, kd=0.1, max_step=0.25, **kwargs):
+        super().__init__(limit, **kwargs)
+        self.targets = Signals(lag_target, cpu_target, burner_backlog_target, None, rss_target)
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.max_step = max_step
+        self.integral = 0.
+        self.last_error = None
+        self.last = None  # (limit, pages_per_sec)
+        self.bottleneck = None
+
+    def pressure(self, signals):
+        '''
+        The biggest signal/target ratio, and its name
+        '''
+        worst = 0., None
+        for name, target in self.targets._asdict().items():
+            value = getattr(signals, name)
+            if target and value is not None:
+                worst = max(worst, (value / target, name), key=lambda w: w[0])
+        return worst
+
+    def update(self, signals):
+        pressure, self.bottleneck = self.pressure(signals)
+
+        if self.last is not None:
+            last_limit, last_pps = self.last
+            if self.limit > last_limit and signals.pages_per_sec < 0.95 * last_pps:
+                # more concurrency bought less throughput: treat as saturated
+                pressure = max(pressure, 1.0)
+                self.bottleneck = 'throughput'
+        self.last = (self.limit, signals.pages_per_sec)
+
+        error = max(-1., min(1., 1.0 - pressure))
+        self.integral = max(-1., min(1., self.integral + error))  # anti-windup
+        derivative = 0. if self.last_error is None else error - self.last_error
+        self.last_error = error
+
+        step = self.kp * error + self.ki * self.integral + self.kd * derivative
+        step = max(-self.max_step, min(self.max_step, step))
+        limit = self.limit * (1. + step)
+        if step > 0:
+            limit = max(limit, self.limit + 1)  # make progress at small limits
+        self.limit = self.clamp(round(limit))
+        return self.limit
+
+
+controllers = {'domino': DominoController, 'pid': PIDController}
+
+
+def setup(limit, max_limit):
+    name = config.read('Controller', 'Algorithm')
+    if name not in controllers:
+        raise ValueError('unknown Controller Algorithm '+str(name))
+    kwargs = {'max_limit': max_limit}
+    if name == 'pid':
+        kwargs['lag_target'] = float(config.read('Controller', 'LagTarget'))
+        kwargs['cpu_target'] = float(config.read('Controller', 'CPUTarget'))
+        kwargs['burner_backlog_target'] = float(config.read('Controller', 'BurnerBacklogTarget'))
+        rss = config.read('Controller', 'RSSTarget_gigabytes')
+        if rss:
+            kwargs['rss_target'] = float(rss) * 1024 * 1024 * 1024
+    LOGGER.info('concurrency controller is %s', name)
+    return controllers[name](limit, **kwargs)
+
+
+class SimulatedCrawler:
+    '''
+    Each page takes latency seconds of network time, cpu_per_page
+    seconds of main thread cpu, and a burner thread that can parse
+    burner_pages_per_sec. The main thread saturating shows up as lag and
+    as fewer pages per second; the burner falling behind shows up as
+    backlog. Every connection costs rss_per_connection bytes.
+    '''
+    def __init__(self, latency=0.5, cpu_per_page=0.002, burner_pages_per_sec=1000.,
+                 rss_per_connection=0, base_rss=100*1024*1024):
+        self.latency = latency
+        self.cpu_per_page = cpu_per_page
+        self.burner_pages_per_sec = burner_pages_per_sec
+        self.rss_per_connection = rss_per_connection
+        self.base_rss = base_rss
+        self.backlog = 0.
+
+    def step(self, limit):
+        demand = limit / self.latency
+        cpu = demand * self.cpu_per_page
+        if cpu > 1.0:
+            # the event loop is saturated: lag grows, throughput doesn't
+            lag = cpu - 1.0
+            pages_per_sec = 1.0 / self.cpu_per_page / cpu  # overhead of thrashing
+            cpu = 1.0
+        else:
+            lag = 0.005
+            pages_per_sec = demand
+        self.backlog = max(0., self.backlog + pages_per_sec - self.burner_pages_per_sec)
+        rss = self.base_rss + limit * self.rss_per_connection
+        return Signals(lag, cpu, self.backlog, pages_per_sec, rss)
+
+
+def simulate(controller, plant, steps=300):
+    '''
+    Returns the list of limits
+    '''
+    limits = []
+    signals = plant.step(controller.limit)
+    for _ in range(steps):
+        limit = controller.update(signals)
+        limits.append(limit)
+        signals = plant.step(limit)
+    return limits
@@ -7,6 +7,7 @@ from . import memory
 
 LOGGER = logging.getLogger(__name__)
 __NAME__ = 'datalayer seen memory'
+__VERSION__ = 2  # 2 added the payload digests
 
 
 class Datalayer:
@@ -17,6 +18,9 @@ class Datalayer:
         robots_ttl = config.read('Robots', 'RobotsCacheTimeout')
         self.robots = cachetools.TTLCache(robots_size, robots_ttl)
 
+        digest_size = config.read('WARC', 'WARCDigestCacheSize')
+        self.digests = cachetools.LRUCache(int(digest_size))
+
         memory.register_debug(self.memory)
 
     def add_seen(self, url):
@@ -33,9 +37,19 @@ class Datalayer:
     def read_robots_cache(self, schemenetloc):
         return self.robots[schemenetloc]
 
+    def add_digest(self, digest, url, date):
+        '''Remember the first url and WARC-Date that we warced a payload digest for.'''
+        self.digests[digest] = (url, date)
+
+    def read_digest(self, digest):
+        '''Returns (url, date) or None'''
+        return self.digests.get(digest)
+
     def save(self, f):
         pickle.dump(__NAME__, f)
+        pickle.dump(__VERSION__, f)
         pickle.dump(self.seen_set, f)
+        pickle.dump(list(self.digests.items()), f)
         # don't save robots cache
 
     def load(self, f):
@@ -43,11 +57,25 @@ class Datalayer:
         if name != __NAME__:
             LOGGER.error('save file name does not match datalayer name: %s != %s', name, __NAME__)
             raise ValueError
-        self.seen_set = pickle.load(f)
+        version = pickle.load(f)
+        if isinstance(version, int):
+            self.seen_set = pickle.load(f)
+        else:
+            # version 1 savefiles have no version, this is the seen set
+            self.seen_set = version
+            version = 1
+        if version > __VERSION__:
+            LOGGER.error('save file datalayer version %d is newer than %d', version, __VERSION__)
+            raise ValueError
+        self.digests.clear()
+        if version >= 2:
+            for digest, value in pickle.load(f):
+                self.digests[digest] = value
 
     def summarize(self):
         '''Print a human-readable sumary of what's in the datalayer'''
         print('{} seen'.format(len(self.seen_set)))
+        print('{} payload digests'.format(len(self.digests)))
 
     def memory(self):
         '''Return a dict summarizing the datalayer's memory usage'''
@@ -57,4 +85,7 @@ class Datalayer:
         robots = {}
         robots['bytes'] = memory.total_size(self.robots)
         robots['len'] = len(self.robots)
-        return {'seen_set': seen_set, 'robots': robots}
+        digests = {}
+        digests['bytes'] = memory.total_size(self.digests)
+        digests['len'] = len(self.digests)
+        return {'seen_set': seen_set, 'robots': robots, 'digests': digests}
@@ -3,20 +3,42 @@ DNS-related code
 '''
 
 import time
+import heapq
+import asyncio
+import functools
+import json
 import logging
 import ipaddress
+import socket
+import struct
 
 import cachetools
 import aiohttp
+import aiodns
 
 from . import stats
 from . import config
 from . import memory
+from . import urls
 
 LOGGER = logging.getLogger(__name__)
 
 
-async def prefetch(url, resolver):
+async def prefetch(url, resolver, retry=False):
+    '''
+    Resolve url's hostname into the cache. Returns the cache entry, or None.
+
+    A retry ignores a negative entry for a transient failure, because
+    retries come around sooner than DNSNegativeTransientTTL and would
+    otherwise all be used up by one failed lookup.
+    '''
+    negative = resolver.get_negative_entry(url.hostname)
+    if negative and retry and negative[1] not in _permanent_failures:
+        stats.stats_sum('prefetch DNS negative cache skipped for retry', 1)
+        resolver.del_negative_entry(url.hostname)
+    elif negative:
+        stats.stats_sum('prefetch DNS negative cache hit', 1)
+        return None
     with stats.coroutine_state('DNS prefetch'):
         with stats.record_latency('DNS prefetch', url=url.hostname):
             try:
@@ -34,12 +56,56 @@ async def prefetch(url, resolver):
     return resolver.get_cache_entry(url.hostname)
 
 
+class DNSFilteredError(ValueError):
+    '''
+    All of the addresses were ones we don't crawl, e.g. private
+    '''
+    pass
+
+
+_dns_error_types = {
+    aiodns.error.ARES_ENOTFOUND: 'nxdomain',
+    aiodns.error.ARES_ENONAME: 'nxdomain',
+    aiodns.error.ARES_ENODATA: 'no A records',
+    aiodns.error.ARES_ESERVFAIL: 'servfail',
+    aiodns.error.ARES_ECONNREFUSED: 'servfail',  # what c-ares says when every nameserver SERVFAILs
+    aiodns.error.ARES_ETIMEOUT: 'timeout',
+    aiodns.error.ARES_EREFUSED: 'refused',
+}
+
+# these say something about the name, not about the nameservers being unhappy right now
+_permanent_failures = set(('nxdomain', 'no A records', 'filtered-private'))
+
+
+def failure_type(e):
+    if isinstance(e, DNSFilteredError):
+        return 'filtered-private'
+    if isinstance(e, ValueError):
+        return 'no A records'
+    cause = e.__cause__  # aiohttp turns aiodns.error.DNSError into OSError
+    if isinstance(cause, aiodns.error.DNSError) and cause.args:
+        return _dns_error_types.get(cause.args[0], 'other')
+    return 'other'
+
+
 class CoCrawler_Caching_AsyncResolver(aiohttp.resolver.AsyncResolver):
     '''
     A caching dns wrapper that lets us subvert aiohttp's built-in dns policies
 
     Use a LRU cache which respects TTL and is bounded in size.
-    Refetch dns (once!) when the TTL is 3/4ths expired.
+    When the TTL is 3/4ths expired, keep answering from the cache and
+    refresh the entry in a background task (once at a time per host.)
+    If the refresh fails, the stale entry is kept until it expires.
+
+    Concurrent cache misses for the same host share a single lookup.
+
+    A min-heap of (expires, host) next to the LRU lets us drop expired
+    entries as they expire, instead of waiting for LRU pressure.
+
+    Failed lookups go into a negative cache. NXDOMAIN, no A records, and
+    all-addresses-filtered are remembered for the SOA minimum of the
+    domain, up to DNSNegativeTTL; SERVFAIL, timeouts, etc. are
+    remembered for DNSNegativeTransientTTL.
 
     TODO: Warc the answer
     '''
@@ -49,42 +115,151 @@ class CoCrawler_Caching_AsyncResolver(aiohttp.resolver.AsyncResolver):
         self._crawlprivate = config.read('Fetcher', 'CrawlPrivate') or False
         self._cachemaxsize = config.read('Fetcher', 'DNSCacheMaxSize')
         self._cache = cachetools.LRUCache(int(self._cachemaxsize))
-        self._refresh_in_progress = set()
+        self._expiry_heap = []  # (expires, host), can have stale items for replaced or evicted entries
+        self._refresh_in_progress = {}  # host -> task
+        self._lookups_in_flight = {}  # host -> task
+        self._negative_ttl = float(config.read('Fetcher', 'DNSNegativeTTL'))
+        self._negative_transient_ttl = float(config.read('Fetcher', 'DNSNegativeTransientTTL'))
+        self._negative = cachetools.LRUCache(int(self._cachemaxsize))  # host -> (expires, failure type, exception)
+        self._soa_minimum = cachetools.LRUCache(10000)  # domain -> seconds or None
 
         memory.register_debug(self.memory)
 
     async def resolve(self, host, port=0, stats_prefix='fetch ', **kwargs):
         t = time.time()
+        self.expire(t)
+        negative = self.get_negative_entry(host)
+        if negative:
+            stats.stats_sum(stats_prefix+'DNS negative cache hit', 1)
+            _, _, (exc_class, args) = negative
+            raise exc_class(*args)
+
         if host in self._cache:
             stats.stats_sum(stats_prefix+'DNS cache hit', 1)
             addrs, expires, refresh, host_geoip = self._cache[host]
-            if expires < t:
-                stats.stats_sum(stats_prefix+'DNS cache hit expired entry', 1)
-                del self._cache[host]
-                expire_some(t, self._cache, 100, stats_prefix=stats_prefix)
-            elif refresh < t and host not in self._refresh_in_progress:
+            if refresh < t and host not in self._refresh_in_progress:
                 stats.stats_sum(stats_prefix+'DNS cache hit entry refresh', 1)
-                # TODO: spawn a thread to await this while I continue on
-                self._refresh_in_progress.add(host)
-                stats.stats_sum(stats_prefix+'DNS refresh lookup', 1)
-                stats.stats_sum('DNS external queries', 1)
-                self._cache[host] = await self.actual_async_lookup(host, port=port, **kwargs)
-                self._refresh_in_progress.remove(host)
+                task = asyncio.ensure_future(self._refresh(host, port=port, stats_prefix=stats_prefix, **kwargs))
+                self._refresh_in_progress[host] = task
+                self._refresh_backlog()
 
-        if host not in self._cache:
-            stats.stats_sum(stats_prefix+'DNS lookup after cache miss begun', 1)
-            stats.stats_sum('DNS external queries', 1)
-            self._cache[host] = await self.actual_async_lookup(host, port=port, **kwargs)
-            # no A's is a ValueError so we do not cache them
-            stats.stats_sum(stats_prefix+'DNS lookup after cache miss success', 1)
+        if host in self._cache:
+            addrs = self._cache[host][0]
+        else:
+            task = self._lookups_in_flight.get(host)
+            if task is not None:
+                stats.stats_sum(stats_prefix+'DNS lookup coalesced', 1)
+                stats.stats_sum('DNS external queries saved', 1)
+            else:
+                stats.stats_sum(stats_prefix+'DNS lookup after cache miss begun', 1)
+                stats.stats_sum('DNS external queries', 1)
+                task = asyncio.ensure_future(self._lookup(host, port=port, stats_prefix=stats_prefix, **kwargs))
+                self._lookups_in_flight[host] = task
+                task.add_done_callback(functools.partial(self._lookup_done, host))
+            # shielded so that a cancelled waiter doesn't cancel the lookup for everyone else
+            addrs = (await asyncio.shield(task))[0]
 
-        addrs = self._cache[host][0]
         # if the cached entry was made with a different port, lie about it
         for a in addrs:
             if 'port' in a:
                 a['port'] = port
         return addrs
 
+    async def _lookup(self, host, port=0, stats_prefix='', **kwargs):
+        try:
+            entry = await self.actual_async_lookup(host, port=port, **kwargs)
+        except (OSError, ValueError) as e:
+            await self._add_negative_entry(host, e)
+            raise
+        # no A's is a ValueError so we do not cache them
+        self._set_entry(host, entry)
+        stats.stats_sum(stats_prefix+'DNS lookup after cache miss success', 1)
+        return entry
+
+    async def _add_negative_entry(self, host, e):
+        kind = failure_type(e)
+        stats.stats_sum('DNS failure '+kind, 1)
+        if not self._negative_ttl:
+            return
+        if kind in _permanent_failures:
+            ttl = self._negative_ttl
+            soa_minimum = await self.get_soa_minimum(host)
+            if soa_minimum is not None:
+                ttl = max(self._negative_transient_ttl, min(ttl, soa_minimum))
+        else:
+            ttl = self._negative_transient_ttl
+        self._negative[host] = time.time() + ttl, kind, (type(e), e.args)
+
+    def get_negative_entry(self, host):
+        negative = self._negative.get(host)
+        if negative is not None:
+            if negative[0] > time.time():
+                return negative
+            del self._negative[host]
+
+    def del_negative_entry(self, host):
+        self._negative.pop(host, None)
+
+    async def get_soa_minimum(self, host):
+        '''
+        The negative caching ttl of the host's registered domain, from its SOA. Cached.
+        '''
+        try:
+            domain = urls.get_domain(host)
+        except (IndexError, ValueError):
+            return
+        if domain not in self._soa_minimum:
+            self._soa_minimum[domain] = await self.actual_soa_lookup(domain)
+        return self._soa_minimum[domain]
+
+    async def actual_soa_lookup(self, domain):
+        stats.stats_sum('DNS SOA lookups', 1)
+        stats.stats_sum('DNS external queries', 1)
+        try:
+            soa = await self._resolver.query(domain, 'SOA')
+        except aiodns.error.DNSError:
+            stats.stats_sum('DNS SOA lookup failed', 1)
+            return
+        if soa.ttl < 0:  # pycares doesn't always know the ttl
+            return soa.minttl
+        return min(soa.minttl, soa.ttl)  # RFC 2308
+
+    def _lookup_done(self, host, task):
+        del self._lookups_in_flight[host]
+        if not task.cancelled():
+            task.exception()  # if every waiter was cancelled, nobody else will look at it
+
+    async def _refresh(self, host, port=0, stats_prefix='', **kwargs):
+        try:
+            stats.stats_sum(stats_prefix+'DNS refresh lookup', 1)
+            stats.stats_sum('DNS external queries', 1)
+            with stats.record_latency('DNS refresh', url=host):
+                entry = await self.actual_async_lookup(host, port=port, **kwargs)
+            self._set_entry(host, entry)
+            stats.stats_sum('DNS refresh success', 1)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # keep serving the stale entry, and don't try again for a while
+            stats.stats_sum('DNS refresh failed', 1)
+            LOGGER.debug('DNS refresh of %s failed: %r', host, e)
+            old = self._cache.get(host)
+            if old is not None:
+                addrs, expires, refresh, host_geoip = old
+                self._cache[host] = addrs, expires, refresh + (expires - refresh) / 2, host_geoip
+        finally:
+            del self._refresh_in_progress[host]
+            self._refresh_backlog()
+
+    def _refresh_backlog(self):
+        stats.stats_set('DNS refresh backlog', len(self._refresh_in_progress))
+        stats.stats_max('DNS refresh max backlog', len(self._refresh_in_progress))
+
+    async def close(self):
+        for task in list(self._refresh_in_progress.values()) + list(self._lookups_in_flight.values()):
+            task.cancel()
+        await super().close()
+
     async def actual_async_lookup(self, host, port=0, **kwargs):
         '''
         Do an actual lookup. Always raise if it fails.
@@ -120,6 +295,8 @@ class CoCrawler_Caching_AsyncResolver(aiohttp.resolver.AsyncResolver):
             LOGGER.info('threw out some ip addresses for %s', host)
         if len(ret) == 0:
             stats.stats_sum('DNS lookup no A records found', 1)
+            if addrs:
+                raise DNSFilteredError('no A records found after filtering')
             raise ValueError('no A records found')
 
         ttl = max(3600*8, min(3600, ttl))  # force ttl into a range of time
@@ -130,30 +307,128 @@ class CoCrawler_Caching_AsyncResolver(aiohttp.resolver.AsyncResolver):
 
         return ret, expires, refresh, host_geoip
 
+    def save(self, f):
+        '''
+        Write the unexpired cache entries to a binary file: a table of the
+        distinct geoip values, then for each host its expires and refresh
+        times and its addresses, each with an index into the geoip table.
+        '''
+        t = time.time()
+        geoips = {}
+        entries = []
+        for host, (addrs, expires, refresh, host_geoip) in self._cache.items():
+            if expires < t:
+                continue
+            packed = []
+            for a in addrs:
+                value = host_geoip.get(a['host'])
+                if value is None:
+                    index = _NO_GEOIP
+                else:
+                    index = geoips.setdefault(json.dumps(value, sort_keys=True), len(geoips))
+                packed.append((ipaddress.ip_address(a['host']).packed, index))
+            entries.append((host.encode('utf8'), expires, refresh, packed))
+
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(struct.pack('<I', len(geoips)))
+        for value in sorted(geoips, key=geoips.get):
+            value = value.encode('utf8')
+            f.write(struct.pack('<H', len(value)) + value)
+        f.write(struct.pack('<I', len(entries)))
+        for host, expires, refresh, packed in entries:
+            f.write(struct.pack('<H', len(host)) + host + struct.pack('<ddB', expires, refresh, len(packed)))
+            for ip, index in packed:
+                f.write(struct.pack('<BI', len(ip), index) + ip)
+        stats.stats_sum('DNS snapshot entries saved', len(entries))
+        return len(entries)
+
+    def load(self, f):
+        '''
+        Read a file written by save(), skipping entries that have expired since
+        '''
+        if f.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+            raise ValueError('not a DNS cache snapshot')
+        geoips = []
+        count, = struct.unpack('<I', f.read(4))
+        for _ in range(count):
+            length, = struct.unpack('<H', f.read(2))
+            geoips.append(f.read(length).decode('utf8'))
+
+        t = time.time()
+        loaded = 0
+        count, = struct.unpack('<I', f.read(4))
+        for _ in range(count):
+            length, = struct.unpack('<H', f.read(2))
+            host = f.read(length).decode('utf8')
+            expires, refresh, naddrs = struct.unpack('<ddB', f.read(17))
+            addrs = []
+            host_geoip = {}
+            for _ in range(naddrs):
+                length, index = struct.unpack('<BI', f.read(5))
+                ip = ipaddress.ip_address(f.read(length))
+                family = socket.AF_INET if ip.version == 4 else socket.AF_INET6
+                addrs.append({'hostname': host, 'host': str(ip), 'port': 0, 'family': family, 'proto': 0,
+                              'flags': socket.AI_NUMERICHOST | socket.AI_NUMERICSERV})
+                if index != _NO_GEOIP:
+                    host_geoip[str(ip)] = json.loads(geoips[index])
+            if expires < t:
+                stats.stats_sum('DNS snapshot expired entries skipped', 1)
+                continue
+            self._set_entry(host, (addrs, expires, refresh, host_geoip))
+            loaded += 1
+        stats.stats_sum('DNS snapshot entries loaded', loaded)
+        LOGGER.info('loaded %d DNS cache entries from snapshot', loaded)
+        return loaded
+
+    def _set_entry(self, host, entry):
+        self._cache[host] = entry
+        heapq.heappush(self._expiry_heap, (entry[1], host))
+        if len(self._expiry_heap) > 2 * len(self._cache) + 1000:
+            # too many stale items
+            self._expiry_heap = [(e[1], h) for h, e in self._cache.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def expire(self, t=None, limit=None):
+        '''
+        Remove expired entries. Each one costs O(log n).
+        '''
+        t = t or time.time()
+        heap = self._expiry_heap
+        expired = 0
+        while heap and heap[0][0] < t:
+            if limit is not None and expired >= limit:
+                break
+            expires, host = heapq.heappop(heap)
+            # peek without making the entry most-recently-used
+            entry = cachetools.Cache.__getitem__(self._cache, host) if host in self._cache else None
+            if entry is not None and entry[1] == expires:
+                del self._cache[host]
+                expired += 1
+        if expired:
+            stats.stats_sum('DNS cache expired entries', expired)
+        return expired
+
     def get_cache_entry(self, host):
         if host in self._cache:
             return self._cache[host]
 
     def size(self):
+        self.expire()
         return len(self._cache)
 
     def memory(self):
         resolver_cache = {}
-        resolver_cache['bytes'] = memory.total_size(self._cache)
+        self.expire()
+        resolver_cache['bytes'] = memory.total_size(self._cache) + memory.total_size(self._expiry_heap)
         resolver_cache['len'] = len(self._cache)
-        return {'resolver_cache': resolver_cache}
-
-
-def expire_some(t, lru, some, stats_prefix=''):
-    # examine a few of the oldest entries to see if they're expired
-    # this keeps deadwood from building up in the cache
-    for i in range(some):
-        host, entry = lru.popitem()
-        if entry[1] > t:
-            LOGGER.debug('expire_some expired %d entries', i)
-            stats.stats_sum(stats_prefix+'DNS cache expire_some', i)
-            lru[host] = entry
-            break
+        negative_cache = {}
+        negative_cache['bytes'] = memory.total_size(self._negative) + memory.total_size(self._soa_minimum)
+        negative_cache['len'] = len(self._negative)
+        return {'resolver_cache': resolver_cache, 'resolver_negative_cache': negative_cache}
+
+
+_SNAPSHOT_MAGIC = b'cocrawler dns snapshot 1\n'
+_NO_GEOIP = 0xffffffff
 
 
 def get_resolver(**kwargs):
@@ -25,6 +25,7 @@ import aiohttp
 from . import stats
 from . import config
 from . import content
+from . import spool
 from .urls import URL
 
 LOGGER = logging.getLogger(__name__)
@@ -87,18 +88,112 @@ def apply_url_policies(url, crawler):
 def global_policies():
     proxy = config.read('Fetcher', 'ProxyAll')
     prefetch_dns = not proxy or config.read('GeoIP', 'ProxyGeoIP')
+    if config.read('Fetcher', 'ReplayDirectory'):
+        prefetch_dns = False  # replay never touches the network
 
     return proxy, prefetch_dns
 
 
+def header_policy(response, max_content_length=None):
+    '''
+    Called after the response headers arrive. Returns a reason to close
+    the connection without reading the body, or None.
+    '''
+    if response.status < 200 or response.status >= 300:
+        # redirs and errors: small bodies, and we want them
+        return None
+    content_type, _ = content.get_content_type(response.headers)
+    if content_type not in content.html_types:
+        return 'content type'
+    if max_content_length:
+        content_length = response.headers.get('content-length', '')
+        if content_length.isdigit() and int(content_length) > max_content_length:
+            return 'content length'
+
+
+class _TraceContext:
+    def __init__(self, trace_request_ctx=None):
+        self.trace_request_ctx = trace_request_ctx
+        self.starts = {}
+        self.dns_in_connect = 0.
+        self.scheme = None
+
+
+def _trace_phase(name, start_or_end):
+    async def on_signal(session, ctx, params):
+        if start_or_end == 'start':
+            ctx.starts[name] = time.time()
+            return
+        if name not in ctx.starts:
+            return
+        elapsed = time.time() - ctx.starts.pop(name)
+        timings = ctx.trace_request_ctx
+        if timings is None:
+            return
+        phase = name
+        if name == 'dns' and 'connect' in ctx.starts:
+            # the resolver is called from inside connection creation
+            ctx.dns_in_connect += elapsed
+        elif name == 'connect':
+            elapsed -= ctx.dns_in_connect
+            ctx.dns_in_connect = 0.
+            if ctx.scheme == 'https':
+                phase = 'connect tls'
+        timings[phase] = timings.get(phase, 0.) + elapsed
+    return on_signal
+
+
+async def _trace_request_start(session, ctx, params):
+    ctx.scheme = params.url.scheme
+
+
+def trace_config():
+    '''
+    An aiohttp.TraceConfig that times the phases of each fetch: waiting
+    for a connection from the pool, dns, tcp connect (plus the tls
+    handshake for https, which aiohttp does not report separately), and
+    the wait for the response headers after the request is sent.
+
+    The timings dict is passed to session.get() as trace_request_ctx, and
+    the phases of each redirect hop are summed into it.
+    '''
+    tc = aiohttp.TraceConfig(trace_config_ctx_factory=_TraceContext)
+    tc.on_request_start.append(_trace_request_start)
+    tc.on_connection_queued_start.append(_trace_phase('pool wait', 'start'))
+    tc.on_connection_queued_end.append(_trace_phase('pool wait', 'end'))
+    tc.on_dns_resolvehost_start.append(_trace_phase('dns', 'start'))
+    tc.on_dns_resolvehost_end.append(_trace_phase('dns', 'end'))
+    tc.on_connection_create_start.append(_trace_phase('connect', 'start'))
+    tc.on_connection_create_end.append(_trace_phase('connect', 'end'))
+    tc.on_request_headers_sent.append(_trace_phase('first byte', 'start'))
+    tc.on_request_end.append(_trace_phase('first byte', 'end'))
+    tc.on_request_redirect.append(_trace_phase('first byte', 'end'))  # instead of request_end, for each hop
+    return tc
+
+
+def record_timings(timings, stats_prefix='', url=None):
+    for name, elapsed in timings.items():
+        stats.record_a_latency_value(stats_prefix+'fetcher '+name, elapsed, url=url)
+
+
 FetcherResponse = namedtuple('FetcherResponse', ['response', 'body_bytes', 'ip', 'req_headers',
                                                  't_first_byte', 't_last_byte', 'is_truncated',
-                                                 'last_exception'])
+                                                 'last_exception', 'timings'])
 
 
 async def fetch(url, session,
                 allow_redirects=None, max_redirects=None,
-                stats_prefix='', max_page_size=-1, get_kwargs={}):
+                stats_prefix='', max_page_size=-1, get_kwargs={}, spool_size=None, header_policy=None,
+                shaper=None):
+    '''
+    body_bytes is bytes, or a memoryview of an mmap'd temporary file if
+    the body was bigger than spool_size. See spool.py.
+
+    header_policy(response) can return a reason to skip reading the body,
+    in which case is_truncated is 'policy' and body_bytes is empty.
+
+    shaper is an optional bandwidth.Shaper that the body bytes are charged to.
+    '''
 
     last_exception = None
     is_truncated = False
@@ -108,15 +203,17 @@ async def fetch(url, session,
         t0 = time.time()
         last_exception = None
         body_bytes = b''
-        blocks = []
+        spooled = spool.SpooledBody(spool_size=spool_size, stats_prefix=stats_prefix)
         left = max_page_size
         ip = None
+        timings = {}
 
         with stats.coroutine_state(stats_prefix+'fetcher fetching'):
             with stats.record_latency(stats_prefix+'fetcher fetching', url=url.url):
                 response = await session.get(url.url,
                                              allow_redirects=allow_redirects,
                                              max_redirects=max_redirects,
+                                             trace_request_ctx=timings,
                                              **get_kwargs)
 
                 t_first_byte = '{:.3f}'.format(time.time() - t0)
@@ -128,19 +225,36 @@ async def fetch(url, session,
                         stats.stats_sum(stats_prefix+'fetch ip from connection', 1)
                         ip = [addr[0]]  # ipv4 or ipv6
 
+                if header_policy is not None:
+                    abort = header_policy(response)
+                    if abort:
+                        stats.stats_sum(stats_prefix+'fetch aborted by policy', 1)
+                        stats.stats_sum(stats_prefix+'fetch aborted by policy: '+abort, 1)
+                        content_length = response.headers.get('content-length', '')
+                        if content_length.isdigit():
+                            saved = int(content_length)
+                            if max_page_size >= 0:
+                                saved = min(saved, max_page_size)
+                            stats.stats_sum(stats_prefix+'fetch aborted by policy bytes saved', saved)
+                        response.close()  # this does interrupt the network transfer
+                        is_truncated = 'policy'
+                        left = 0
+
                 while left > 0:
                     # reading stream directly to dodge decompression and limit size.
                     # this means that aiohttp tracing on_response_chunk_receive doesn't work
                     block = await response.content.read(left)
                     if not block:
-                        body_bytes = b''.join(blocks)
+                        body_bytes = spooled.getbuffer()
                         break
-                    blocks.append(block)
+                    spooled.write(block)
                     left -= len(block)
+                    if shaper is not None:
+                        await shaper.shape(url.hostname_without_www, len(block), stats_prefix=stats_prefix)
                 else:
-                    body_bytes = b''.join(blocks)
+                    body_bytes = spooled.getbuffer()
 
-                if not response.content.at_eof():
+                if not is_truncated and not response.content.at_eof():
                     stats.stats_sum(stats_prefix+'fetch truncated length', 1)
                     response.close()  # this does interrupt the network transfer
                     is_truncated = 'length'
@@ -149,7 +263,7 @@ async def fetch(url, session,
     except asyncio.TimeoutError:
         stats.stats_sum(stats_prefix+'fetch timeout', 1)
         last_exception = 'TimeoutError'
-        body_bytes = b''.join(blocks)
+        body_bytes = spooled.getbuffer()
         if len(body_bytes):
             # these body_bytes are currently dropped because last_exception is set
             is_truncated = 'time'
@@ -166,7 +280,7 @@ async def fetch(url, session,
         stats.stats_sum(stats_prefix+'fetch ClientError', 1)
         detailed_name = str(type(e).__name__)
         last_exception = 'ClientError: ' + detailed_name + ': ' + str(e)
-        body_bytes = b''.join(blocks)
+        body_bytes = spooled.getbuffer()
         if len(body_bytes):
             # these body_bytes are currently dropped because last_exception is set
             is_truncated = 'disconnect'
@@ -198,6 +312,8 @@ async def fetch(url, session,
         LOGGER.info('Saw surprising exception in fetcher working on %s:\n%s', url.url, last_exception)
         traceback.print_exc()
 
+    record_timings(timings, stats_prefix=stats_prefix, url=url)
+
     # if redirs are allowed the url must be set to the final url
     if response and str(response.url) != url.url:
         if allow_redirects:
@@ -211,10 +327,10 @@ async def fetch(url, session,
             LOGGER.info('we failed working on %s, the last exception is %s, dropped %d body bytes', url.url, last_exception, len(body_bytes))
         else:
             LOGGER.info('we failed working on %s, the last exception is %s', url.url, last_exception)
-        return FetcherResponse(None, None, None, None, None, None, False, last_exception)
+        return FetcherResponse(None, None, None, None, None, None, False, last_exception, timings)
 
     fr = FetcherResponse(response, body_bytes, ip, response.request_info.headers,
-                         t_first_byte, t_last_byte, is_truncated, None)
+                         t_first_byte, t_last_byte, is_truncated, None, timings)
 
     if response.status >= 500:
         LOGGER.debug('server returned http status %d', response.status)
@@ -16,6 +16,7 @@ from . import stats
 from .urls import URL
 from . import facet
 from . import config
+from . import spool
 
 LOGGER = logging.getLogger(__name__)
 
@@ -26,6 +27,8 @@ async def do_parser(body, body_bytes, resp_headers, url, crawler):
         # headers is a multidict.CIMultiDictProxy case-blind dict
         # and the Proxy form of it doesn't pickle, so convert to one that does
         resp_headers = multidict.CIMultiDict(resp_headers)
+        # and a memoryview of a spooled body doesn't pickle either
+        body_bytes = spool.tobytes(body_bytes)
         links, embeds, sha1, facets, base = await crawler.burner.burn(
             partial(do_burner_work_html, body, body_bytes, resp_headers,
                     burn_prefix='burner ', url=url),
@@ -0,0 +1,145 @@
+'''
+A staged pipeline for fetch_and_process.
+
+Each url goes through the stages dns, robots, fetch, post, parse and
+links. Without a pipeline, one worker runs all of the stages for a url
+in turn, and a slow stage ties up the whole worker. With one, each
+stage has its own bounded queue and its own number of coroutines,
+workers only feed urls into the first stage, and the per-stage queue
+depths and service times in stats show which stage is the bottleneck.
+
+A stage handler is an async function that takes a Job and returns True
+to pass it along to the next stage, or False if the job is finished.
+'''
+
+import time
+import asyncio
+import logging
+import traceback
+
+from . import config
+from . import stats
+
+LOGGER = logging.getLogger(__name__)
+
+stage_names = ('dns', 'robots', 'fetch', 'post', 'parse', 'links')
+
+
+class Job:
+    '''
+    Everything about one url that is passed from stage to stage
+    '''
+    def __init__(self, work):
+        self.work = work
+        self.ridealong = None
+        self.url = None
+        self.json_log = {}
+        self.get_kwargs = None
+        self.dns_entry = None
+        self.host_geoip = {}
+        self.robots_seed_host = None
+        self.f = None
+        self.decoded = None
+        self.parsed = None
+
+
+async def run_sequentially(job, handlers):
+    for _, handler in handlers:
+        if not await handler(job):
+            return
+
+
+class Stage:
+    def __init__(self, name, handler, concurrency, queue_size, pipeline):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.q = asyncio.Queue(maxsize=queue_size)
+        self.pipeline = pipeline
+        self.next = None
+        self.tasks = []
+
+    async def put(self, job):
+        if self.q.full():
+            with stats.coroutine_state('stage {} full'.format(self.name)):
+                await self.q.put(job)
+        else:
+            self.q.put_nowait(job)
+        depth = self.q.qsize()
+        stats.stats_set('stage {} queue depth'.format(self.name), depth)
+        stats.stats_max('stage {} max queue depth'.format(self.name), depth)
+
+    async def run(self):
+        while True:
+            with stats.coroutine_state('stage {} idle'.format(self.name)):
+                job = await self.q.get()
+            keep_going = False
+            try:
+                t0 = time.time()
+                keep_going = await self.handler(job)
+                stats.record_a_latency('stage {} service time'.format(self.name), t0, url=job.url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # same as Crawler.work(): log buggy code and finish the job
+                LOGGER.error('Something bad happened in stage %s working on %s, it\'s a mystery:\n%s',
+                             self.name, job.work[2], e)
+                traceback.print_exc()
+            self.q.task_done()
+
+            if keep_going and self.next is not None:
+                await self.next.put(job)
+            else:
+                self.pipeline.finish(job)
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(self.run()) for _ in range(self.concurrency)]
+
+    def cancel(self):
+        for t in self.tasks:
+            if not t.done():
+                t.cancel()
+
+
+class Pipeline:
+    def __init__(self, handlers, finish):
+        '''
+        handlers is a list of (name, async handler) in stage order,
+        finish(job) is called once for every job, at whatever stage it ends
+        '''
+        self._finish = finish
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.stages = []
+        for name, handler in handlers:
+            concurrency = int(config.read('Pipeline', 'Concurrency')[name])
+            queue_size = int(config.read('Pipeline', 'QueueSize'))
+            self.stages.append(Stage(name, handler, concurrency, queue_size, self))
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next = next_stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    async def feed(self, job):
+        self.in_flight += 1
+        self.idle.clear()
+        stats.stats_set('pipeline in flight', self.in_flight)
+        await self.stages[0].put(job)
+
+    def finish(self, job):
+        try:
+            self._finish(job)
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.idle.set()
+
+    async def join(self):
+        await self.idle.wait()
+
+    def cancel(self):
+        for stage in self.stages:
+            stage.cancel()
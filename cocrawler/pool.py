@@ -0,0 +1,104 @@
+'''
+Connection pool policy.
+
+aiohttp's TCPConnector keeps every released connection alive for
+keepalive_timeout seconds, whether or not we'll ever talk to that host
+again. In a big crawl most hosts have nothing else queued, so those
+idle sockets (and their tls state) are pure overhead, while for a
+site crawl we want to reuse connections as much as possible.
+
+PolicyConnector asks the scheduler whether a host has queued work when
+a connection is released: if yes, the connection is kept alive for the
+next fetch, if no, it is closed right away. It also caps connections
+per host, tied to the politeness limit MaxHostQPS.
+'''
+
+import math
+import functools
+import logging
+
+import aiohttp
+
+from . import config
+from . import stats
+from . import surt
+
+LOGGER = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=10000)
+def key_to_surt_host(host, port, is_ssl):
+    scheme = 'https' if is_ssl else 'http'
+    url = '{}://{}:{}/'.format(scheme, host, port)
+    surt_host, _, _ = surt.surt(url).partition(')')
+    return surt_host
+
+
+def connector_kwargs():
+    '''
+    Config-driven kwargs for PolicyConnector
+    '''
+    kwargs = {}
+    per_host = config.read('Fetcher', 'MaxHostConnections')
+    if per_host is None:
+        # at MaxHostQPS, fetches shorter than 1 second need at most this many
+        per_host = max(1, math.ceil(float(config.read('Crawl', 'MaxHostQPS'))))
+    kwargs['limit_per_host'] = int(per_host)
+    kwargs['keepalive_timeout'] = float(config.read('Fetcher', 'KeepAliveTimeout'))
+    return kwargs
+
+
+class PolicyConnector(aiohttp.TCPConnector):
+    def __init__(self, *args, host_has_work=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host_has_work = host_has_work
+
+    def set_limit(self, limit):
+        self._limit = limit  # there is no public api for this
+        # if the limit went up, waiters might be able to go
+        self._release_waiter()
+
+    def _release(self, key, protocol, *, should_close=False):
+        if not should_close and not protocol.should_close and self.host_has_work is not None and not key.proxy:
+            if self.host_has_work(key_to_surt_host(key.host, key.port, key.is_ssl)):
+                stats.stats_sum('pool keep-alive retained', 1)
+            else:
+                stats.stats_sum('pool eager close', 1)
+                should_close = True
+        super()._release(key, protocol, should_close=should_close)
+
+
+def _connect_mean(is_ssl):
+    name = 'fetcher connect tls' if is_ssl else 'fetcher connect'
+    latency = stats.latencies.get(name)
+    if latency and latency['count']:
+        return latency['time'] / latency['count']
+    return 0.
+
+
+async def _on_reuseconn(session, trace_config_ctx, params):
+    stats.stats_sum('pool connection reused', 1)
+    is_ssl = getattr(trace_config_ctx, 'scheme', None) == 'https'
+    stats.stats_sum('pool handshake seconds saved', _connect_mean(is_ssl))
+    _set_reuse_ratio()
+
+
+async def _on_create_end(session, trace_config_ctx, params):
+    stats.stats_sum('pool connection created', 1)
+    _set_reuse_ratio()
+
+
+def _set_reuse_ratio():
+    reused = stats.stat_value('pool connection reused') or 0
+    created = stats.stat_value('pool connection created') or 0
+    stats.stats_set('pool reuse ratio', round(reused / (reused + created), 3))
+
+
+def add_trace_hooks(tc):
+    '''
+    Count connection reuse on an existing TraceConfig; we use the
+    fetcher's, which records the url scheme.
+    '''
+    tc.on_connection_reuseconn.append(_on_reuseconn)
+    tc.on_connection_create_end.append(_on_create_end)
+    return tc
@@ -22,6 +22,7 @@ from . import seeds
 from . import facet
 from . import geoip
 from . import content
+from . import warc
 
 LOGGER = logging.getLogger(__name__)
 
@@ -197,100 +198,151 @@ def handle_redirect(f, url, ridealong, priority, host_geoip, json_log, crawler,
     # after we return, json_log will get logged
 
 
+def warc_2xx(f, url, json_log, crawler):
+    '''
+    Warc a response, or a revisit record if we have already warced an identical payload.
+    The payload digest is computed once here and handed to warcio.
+    '''
+    with stats.record_burn('warc payload digest', url=url):
+        digest = warc.payload_digest(f.body_bytes)
+
+    if crawler.warc_revisit and not f.is_truncated:
+        original = crawler.datalayer.read_digest(digest)
+        if original is not None:
+            refers_to_url, refers_to_date = original
+            crawler.warcwriter.write_request_revisit_pair(url.url, f.ip, f.req_headers,
+                                                          f.response.raw_headers, len(f.body_bytes), digest,
+                                                          refers_to_url, refers_to_date, decompressed=False)
+            json_log['revisit'] = refers_to_url
+            return
+
+    date = crawler.warcwriter.write_request_response_pair(url.url, f.ip, f.req_headers,
+                                                          f.response.raw_headers, f.is_truncated, f.body_bytes,
+                                                          digest=digest, decompressed=False)
+    if crawler.warc_revisit and not f.is_truncated:
+        crawler.datalayer.add_digest(digest, url.url, date)
+
+
 async def post_2xx(f, url, ridealong, priority, host_geoip, json_log, crawler):
+    decoded = post_2xx_decode(f, url, json_log, crawler)
+    if decoded is None:
+        return
+    parsed = await post_2xx_parse(decoded, f, url, crawler)
+    if parsed is None:
+        return
+    post_2xx_links(parsed, url, ridealong, priority, host_geoip, json_log, crawler)
 
-    if crawler.warcwriter is not None:
-        # needs to use the same algo as post_dns for choosing what to warc
-        # insert the digest instead of computing it twice? see sha1 below
-        # we delayed decompression so that we could warc the compressed body
-        crawler.warcwriter.write_request_response_pair(url.url, f.ip, f.req_headers,
-                                                       f.response.raw_headers, f.is_truncated, f.body_bytes,
-                                                       decompressed=False)
 
+def post_2xx_decode(f, url, json_log, crawler):
+    '''
+    Look at the headers, warc, decompress and decode. Returns (body, body_bytes),
+    or None if this isn't html.
+    '''
     resp_headers = f.response.headers
     content_type, content_encoding, charset = content.parse_headers(resp_headers, json_log)
+    is_html = content_type in content.html_types
+    if crawler.content_model is not None:
+        crawler.content_model.update(url, content_type)
+
+    if crawler.warcwriter is not None and f.is_truncated != 'policy':
+        # needs to use the same algo as post_dns for choosing what to warc
+        # we delayed decompression so that we could warc the compressed body
+        if is_html or crawler.warc_non_html:
+            warc_2xx(f, url, json_log, crawler)
 
-    html_types = set(('text/html', '', 'application/xhtml+xml'))
-    html_types.add('')  # no content type
-    html_types.add('*/*')  # mildly common in the wild, whatwg says we should sniff in this case
+    if f.is_truncated == 'policy':
+        # the header policy didn't read the body, e.g. MaxContentLength
+        json_log['comment'] = 'body not fetched by header policy'
+        return
 
-    if content_type not in html_types:
+    if not is_html:
         # XXX sniff the type https://mimesniff.spec.whatwg.org/
         json_log['comment'] = 'not an html content type'
         #json_log['checksum'] = sha1  # XXX would like to log this
+        return
+
+    if content_encoding != 'identity':
+        with stats.record_burn('response body decompress', url=url):
+            body_bytes = content.decompress(f.body_bytes, content_encoding, url=url)
+        stats.stats_sum('response body decompress bytes', len(body_bytes))
     else:
-        if content_encoding != 'identity':
-            with stats.record_burn('response body decompress', url=url):
-                body_bytes = content.decompress(f.body_bytes, content_encoding, url=url)
-            stats.stats_sum('response body decompress bytes', len(body_bytes))
-        else:
-            body_bytes = f.body_bytes
+        body_bytes = f.body_bytes
 
-        with stats.record_burn('response body get_charset', url=url):
-            charset, detect = content.my_get_charset(charset, body_bytes)
-        with stats.record_burn('response body decode', url=url):
-            body, charset_used = content.my_decode(body_bytes, charset, detect)
+    with stats.record_burn('response body get_charset', url=url):
+        charset, detect = content.my_get_charset(charset, body_bytes)
+    with stats.record_burn('response body decode', url=url):
+        body, charset_used = content.my_decode(body_bytes, charset, detect)
 
-        charset_log(json_log, charset, detect, charset_used)
+    charset_log(json_log, charset, detect, charset_used)
+    return body, body_bytes
+
+
+async def post_2xx_parse(decoded, f, url, crawler):
+    '''
+    Returns (links, embeds, sha1, facets, base), or None if the parser raised.
+    '''
+    body, body_bytes = decoded
+    try:
+        return await parse.do_parser(body, body_bytes, f.response.headers, url, crawler)
+    except ValueError as e:
+        stats.stats_sum('parser raised', 1)
+        LOGGER.info('parser raised %r', e)
+        # XXX jsonlog
 
-        try:
-            links, embeds, sha1, facets, base = await parse.do_parser(body, body_bytes, resp_headers, url, crawler)
-        except ValueError as e:
-            stats.stats_sum('parser raised', 1)
-            LOGGER.info('parser raised %r', e)
-            # XXX jsonlog
-            return
 
-        json_log['checksum'] = sha1
+def post_2xx_links(parsed, url, ridealong, priority, host_geoip, json_log, crawler):
+    links, embeds, sha1, facets, base = parsed
 
-        geoip.add_facets(facets, host_geoip)
+    json_log['checksum'] = sha1
+
+    geoip.add_facets(facets, host_geoip)
 
-        facet_log = {'url': url.url, 'facets': facets, 'kind': 'get'}
-        if base is not None:
-            facet_log['base'] = base
-        facet_log['checksum'] = sha1
-        facet_log['time'] = json_log['time']
+    facet_log = {'url': url.url, 'facets': facets, 'kind': 'get'}
+    if base is not None:
+        facet_log['base'] = base
+    facet_log['checksum'] = sha1
+    facet_log['time'] = json_log['time']
 
-        seed_host = ridealong.get('seed_host')
-        if seed_host:
-            facet_log['seed_host'] = seed_host
+    seed_host = ridealong.get('seed_host')
+    if seed_host:
+        facet_log['seed_host'] = seed_host
 
-        if crawler.facetlogfd:
-            print(json.dumps(facet_log, sort_keys=True), file=crawler.facetlogfd)
+    if crawler.facetlogfd:
+        print(json.dumps(facet_log, sort_keys=True), file=crawler.facetlogfd)
 
-        LOGGER.debug('parsing content of url %r returned %d links, %d embeds, %d facets',
-                     url.url, len(links), len(embeds), len(facets))
-        json_log['found_links'] = len(links) + len(embeds)
-        stats.stats_max('max urls found on a page', len(links) + len(embeds))
+    LOGGER.debug('parsing content of url %r returned %d links, %d embeds, %d facets',
+                 url.url, len(links), len(embeds), len(facets))
+    json_log['found_links'] = len(links) + len(embeds)
+    stats.stats_max('max urls found on a page', len(links) + len(embeds))
 
-        max_tries = config.read('Crawl', 'MaxTries')
-        queue_embeds = config.read('Crawl', 'QueueEmbeds')
+    max_tries = config.read('Crawl', 'MaxTries')
+    queue_embeds = config.read('Crawl', 'QueueEmbeds')
 
-        new_links = 0
-        ridealong_skeleton = {'priority': priority+1, 'retries_left': max_tries}
-        if seed_host:
-            ridealong_skeleton['seed_host'] = seed_host
-        for u in links:
+    new_links = 0
+    ridealong_skeleton = {'priority': priority+1, 'retries_left': max_tries}
+    if seed_host:
+        ridealong_skeleton['seed_host'] = seed_host
+    for u in links:
+        ridealong = {'url': u}
+        ridealong.update(ridealong_skeleton)
+        if crawler.add_url(priority + 1, ridealong):
+            new_links += 1
+    if queue_embeds:
+        for u in embeds:
             ridealong = {'url': u}
             ridealong.update(ridealong_skeleton)
-            if crawler.add_url(priority + 1, ridealong):
+            if crawler.add_url(priority - 1, ridealong):
                 new_links += 1
-        if queue_embeds:
-            for u in embeds:
-                ridealong = {'url': u}
-                ridealong.update(ridealong_skeleton)
-                if crawler.add_url(priority - 1, ridealong):
-                    new_links += 1
 
-        if new_links:
-            json_log['found_new_links'] = new_links
+    if new_links:
+        json_log['found_new_links'] = new_links
 
-        # XXX process meta-http-equiv-refresh
+    # XXX process meta-http-equiv-refresh
 
-        # XXX plugin for links and new links - post to Kafka, etc
-        # neah stick that in add_url!
+    # XXX plugin for links and new links - post to Kafka, etc
+    # neah stick that in add_url!
 
-        # actual jsonlog is emitted after the return
+    # actual jsonlog is emitted after the return
 
 
 def post_dns(dns, expires, url, crawler):
@@ -0,0 +1,236 @@
+'''
+Offline replay: serve fetches out of a directory of WARCs instead of the network.
+
+ReplaySession stands in for the aiohttp ClientSession, so fetcher.fetch()
+and everything after it -- robots, post_fetch, parsing, the frontier -- run
+unchanged, at full cpu speed and deterministically.
+
+The url index is read from the .cdxj files written by WARC.WARCIndex if
+they are present, else built by scanning the WARCs.
+'''
+
+import os
+import io
+import struct
+import logging
+import urllib.parse
+
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL as YURL
+from warcio.archiveiterator import ArchiveIterator
+
+from . import stats
+from . import cdxj
+from . import memory
+from . import warc
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+LOGGER = logging.getLogger(__name__)
+
+warc_suffixes = ('.warc', '.warc.gz', '.warc.zst')
+
+
+class ReplayStream:
+    def __init__(self, body):
+        self.body = body
+        self.pos = 0
+
+    async def read(self, n=-1):
+        if n < 0:
+            n = len(self.body) - self.pos
+        block = self.body[self.pos:self.pos+n]
+        self.pos += len(block)
+        return block
+
+    def at_eof(self):
+        return self.pos >= len(self.body)
+
+
+class ReplayRequestInfo:
+    def __init__(self, url, headers):
+        self.url = url
+        self.method = 'GET'
+        self.headers = headers
+
+
+class ReplayResponse:
+    '''
+    The parts of aiohttp.ClientResponse that the crawler uses
+    '''
+    def __init__(self, url, status, raw_headers, body, req_headers, history=()):
+        self.url = YURL(url, encoded=True)
+        self.status = status
+        self.raw_headers = tuple(raw_headers)
+        self.headers = CIMultiDictProxy(CIMultiDict((h.decode('latin-1'), v.decode('latin-1'))
+                                                    for h, v in raw_headers))
+        self.content = ReplayStream(body)
+        self.connection = None
+        self.history = tuple(history)
+        self.request_info = ReplayRequestInfo(self.url, CIMultiDictProxy(CIMultiDict(req_headers or {})))
+
+    def close(self):
+        pass
+
+    def release(self):
+        pass
+
+
+def _zstd_decompressor(f):
+    '''
+    Read the optional dictionary frame at the start of a .warc.zst, leaving f after it
+    '''
+    kwargs = {}
+    head = f.read(8)
+    if len(head) == 8 and struct.unpack('<I', head[:4])[0] == warc.ZSTD_SKIPPABLE_FRAME_DICTIONARY:
+        length = struct.unpack('<I', head[4:])[0]
+        kwargs['dict_data'] = zstandard.ZstdCompressionDict(f.read(length))
+    else:
+        f.seek(0)
+    return zstandard.ZstdDecompressor(**kwargs)
+
+
+def _zstd_frame(f, dctx):
+    '''
+    Decompress the frame (one warc record) at the current position of f, leaving f at the next frame
+    '''
+    obj = dctx.decompressobj()
+    blocks = []
+    while not obj.eof:
+        block = f.read(65536)
+        if not block:
+            break
+        blocks.append(obj.decompress(block))
+    if obj.eof and obj.unused_data:
+        f.seek(-len(obj.unused_data), io.SEEK_CUR)
+    return b''.join(blocks)
+
+
+class ReplayIndex:
+    '''
+    url -> (filename, offset) of the most recent response or revisit record for that url
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.filenames = []
+        self.index = {}
+        memory.register_debug(self.memory)
+
+        names = sorted(n for n in os.listdir(directory) if n.endswith(warc_suffixes))
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.exists(path + '.cdxj'):
+                self.load_cdxj(path)
+            else:
+                self.scan(path)
+        LOGGER.info('replay index has %d urls from %d warcs', len(self.index), len(names))
+        stats.stats_set('replay index urls', len(self.index))
+
+    def _fileno(self, path):
+        if not self.filenames or self.filenames[-1] != path:
+            self.filenames.append(path)
+        return len(self.filenames) - 1
+
+    def load_cdxj(self, path):
+        fileno = self._fileno(path)
+        with open(path + '.cdxj', 'r') as f:
+            for line in f:
+                _, _, fields = cdxj.parse_line(line)
+                self.index[fields['url']] = (fileno, int(fields['offset']))
+
+    def scan(self, path):
+        fileno = self._fileno(path)
+        with open(path, 'rb') as f:
+            if path.endswith('.zst'):
+                dctx = _zstd_decompressor(f)
+                while True:
+                    offset = f.tell()
+                    data = _zstd_frame(f, dctx)
+                    if not data:
+                        break
+                    for record in ArchiveIterator(io.BytesIO(data)):
+                        self._add(record, fileno, offset)
+            else:
+                it = ArchiveIterator(f)
+                for record in it:
+                    self._add(record, fileno, it.get_record_offset())
+
+    def _add(self, record, fileno, offset):
+        if record.rec_type in ('response', 'revisit'):
+            self.index[record.rec_headers.get_header('WARC-Target-URI')] = (fileno, offset)
+
+    def lookup(self, url):
+        return self.index.get(url)
+
+    def read(self, fileno, offset):
+        '''
+        Returns (rec_type, warc headers, http headers, payload bytes)
+        '''
+        path = self.filenames[fileno]
+        with open(path, 'rb') as f:
+            if path.endswith('.zst'):
+                dctx = _zstd_decompressor(f)
+                f.seek(offset)
+                f = io.BytesIO(_zstd_frame(f, dctx))
+            else:
+                f.seek(offset)
+            record = next(iter(ArchiveIterator(f)))
+            return record.rec_type, record.rec_headers, record.http_headers, record.raw_stream.read()
+
+    def memory(self):
+        index = {}
+        index['bytes'] = memory.total_size(self.index)
+        index['len'] = len(self.index)
+        return {'replay index': index}
+
+
+class ReplaySession:
+    '''
+    Stands in for aiohttp.ClientSession
+    '''
+    def __init__(self, directory):
+        self.index = ReplayIndex(directory)
+
+    def _response(self, url, req_headers, history):
+        entry = self.index.lookup(url)
+        if entry is None:
+            stats.stats_sum('replay miss', 1)
+            LOGGER.debug('replay miss for %s', url)
+            return ReplayResponse(url, 404, [], b'', req_headers, history=history)
+
+        rec_type, rec_headers, http_headers, payload = self.index.read(*entry)
+        if rec_type == 'revisit':
+            stats.stats_sum('replay revisit', 1)
+            original = self.index.lookup(rec_headers.get_header('WARC-Refers-To-Target-URI'))
+            if original is None:
+                stats.stats_sum('replay revisit original missing', 1)
+                return ReplayResponse(url, 404, [], b'', req_headers, history=history)
+            _, _, _, payload = self.index.read(*original)
+
+        stats.stats_sum('replay hit', 1)
+        status = int(http_headers.get_statuscode())
+        raw_headers = []
+        for h, v in http_headers.headers:
+            if h.lower().startswith('x-crawler-'):
+                # undo CCWARCWriter._fake_resp_headers
+                continue
+            raw_headers.append((h.encode('latin-1'), v.encode('latin-1')))
+        return ReplayResponse(url, status, raw_headers, payload, req_headers, history=history)
+
+    async def get(self, url, allow_redirects=True, max_redirects=10, headers=None, **kwargs):
+        history = []
+        response = self._response(url, headers, history)
+        while allow_redirects and response.status in {301, 302, 303, 307, 308}:
+            location = response.headers.get('location')
+            if location is None or len(history) >= (max_redirects or 10):
+                break
+            history.append(response)
+            url = urllib.parse.urljoin(url, location)
+            response = self._response(url, headers, history)
+        return response
+
+    async def close(self):
+        pass
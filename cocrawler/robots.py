@@ -5,14 +5,15 @@ Stuff related to robots.txt processing
 import asyncio
 
 import time
-import random
 import json
+import functools
 import logging
 import urllib.parse
 import hashlib
 import re
+from collections import defaultdict
 
-import reppy.robots
+import cachetools
 #import magic
 
 from .urls import URL
@@ -21,6 +22,8 @@ from . import fetcher
 from . import config
 from . import post_fetch
 from . import content
+from . import memory
+from . import robots_matcher
 
 LOGGER = logging.getLogger(__name__)
 
@@ -73,7 +76,9 @@ class Robots:
         self.datalayer = datalayer
         self.max_tries = config.read('Robots', 'MaxTries')
         self.max_robots_page_size = int(config.read('Robots', 'MaxRobotsPageSize'))
-        self.in_progress = set()
+        self.agents = (robotname, 'googlebot', '*')  # the ones _check asks about
+        self.decision_cache_size = int(config.read('Robots', 'DecisionCacheSize'))
+        self.in_progress = {}  # schemenetloc -> task fetching its robots.txt
         # magic is 3 milliseconds per call, too expensive to use
         #self.magic = magic.Magic(flags=magic.MAGIC_MIME_TYPE)
         self.robotslog = config.read('Logging', 'Robotslog')
@@ -88,6 +93,11 @@ class Robots:
         if self.robotslogfd:
             self.robotslogfd.close()
 
+    def close(self):
+        for task in list(self.in_progress.values()):
+            if not task.done():
+                task.cancel()
+
     def check_cached(self, url, quiet=False):
         schemenetloc = url.urlsplit.scheme + '://' + url.urlsplit.netloc
 
@@ -132,8 +142,6 @@ class Robots:
         me = self.robotname
 
         with stats.record_burn('robots is_allowed', url=schemenetloc):
-            if pathplus.startswith('//') and ':' in pathplus:
-                pathplus = 'htp://' + pathplus
             check = robots.allowed(pathplus, me)
             if check:
                 check = 'allowed'
@@ -170,17 +178,45 @@ class Robots:
         self.jsonlog(schemenetloc, json_log)
         return check
 
+    def parse(self, body):
+        return robots_matcher.CompiledRobots(body, agents=self.agents, cache_size=self.decision_cache_size)
+
     def _cache_empty_robots(self, schemenetloc, final_schemenetloc):
-        parsed = reppy.robots.Robots.parse('', '')
+        parsed = self.parse('')
         self.datalayer.cache_robots(schemenetloc, parsed)
         if final_schemenetloc:
             self.datalayer.cache_robots(final_schemenetloc, parsed)
-        self.in_progress.discard(schemenetloc)
         return parsed
 
     async def fetch_robots(self, schemenetloc, dns_entry, crawler,
                            seed_host=None, get_kwargs={}):
         '''
+        Only one fetch per schemenetloc at a time: later callers await the
+        first caller's fetch, and get its result, which is None if it failed.
+        '''
+        task = self.in_progress.get(schemenetloc)
+        if task is not None:
+            LOGGER.debug('someone beat me to the robots punch, waiting for their fetch')
+            stats.stats_sum('robots fetch coalesced', 1)
+            with stats.coroutine_state('robots fetch coalesced wait'):
+                robots = await asyncio.shield(task)
+            if robots is None:
+                stats.stats_sum('robots fetch coalesced then failed', 1)
+            return robots
+
+        task = asyncio.ensure_future(self._fetch_robots(schemenetloc, dns_entry, crawler,
+                                                        seed_host=seed_host, get_kwargs=get_kwargs))
+        self.in_progress[schemenetloc] = task
+        task.add_done_callback(functools.partial(self._fetch_done, schemenetloc))
+        # shielded so that a cancelled caller doesn't cancel the fetch for everyone waiting on it
+        return await asyncio.shield(task)
+
+    def _fetch_done(self, schemenetloc, task):
+        del self.in_progress[schemenetloc]
+
+    async def _fetch_robots(self, schemenetloc, dns_entry, crawler,
+                            seed_host=None, get_kwargs={}):
+        '''
         https://developers.google.com/search/reference/robots_txt
         3xx redir == follow up to 5 hops, then consider it a 404.
         4xx errors == no crawl restrictions
@@ -189,32 +225,6 @@ class Robots:
         '''
         url = URL(schemenetloc + '/robots.txt')
 
-        # We might enter this routine multiple times, so, sleep if we aren't the first
-        if schemenetloc in self.in_progress:
-            while schemenetloc in self.in_progress:
-                LOGGER.debug('sleeping because someone beat me to the robots punch')
-                stats.stats_sum('robots sleep for collision', 1)
-                with stats.coroutine_state('robots collision sleep'):
-                    interval = random.uniform(0.2, 0.3)
-                    await asyncio.sleep(interval)
-
-            # at this point robots might be in the cache... or not.
-            try:
-                robots = self.datalayer.read_robots_cache(schemenetloc)
-            except KeyError:
-                robots = None
-            if robots is not None:
-                return robots
-
-            # ok, so it's not in the cache -- and the other guy's fetch failed.
-            # if we just fell through, there would be a big race.
-            # treat this as a "no data" failure.
-            LOGGER.debug('some other fetch of robots has failed.')
-            stats.stats_sum('robots sleep then cache miss', 1)
-            return None
-
-        self.in_progress.add(schemenetloc)
-
         f = await fetcher.fetch(url, self.session, max_page_size=self.max_robots_page_size,
                                 allow_redirects=True, max_redirects=5, stats_prefix='robots ',
                                 get_kwargs=get_kwargs)
@@ -232,7 +242,6 @@ class Robots:
             else:
                 json_log['error'] = 'max tries exceeded, final exception is: ' + f.last_exception
                 self.jsonlog(schemenetloc, json_log)
-                self.in_progress.discard(schemenetloc)
                 return None
 
         if f.response.history:
@@ -267,7 +276,6 @@ class Robots:
         if str(status).startswith('5'):
             json_log['error'] = 'got a 5xx, treating as deny'  # same as google
             self.jsonlog(schemenetloc, json_log)
-            self.in_progress.discard(schemenetloc)
             return None
 
         # we got a 2xx, so let's use the final headers to facet the final server
@@ -310,30 +318,26 @@ class Robots:
             # log as surprising, also treat like a fetch error
             json_log['error'] = 'robots body decode threw a surprising exception: ' + repr(e)
             self.jsonlog(schemenetloc, json_log)
-            self.in_progress.discard(schemenetloc)
             return None
 
         robots_facets(body, self.robotname, json_log)
 
         with stats.record_burn('robots parse', url=schemenetloc):
-            robots = reppy.robots.Robots.parse('', body)
+            robots = self.parse(body)
 
         with stats.record_burn('robots is_allowed', url=schemenetloc):
-            check = robots.allowed('/', '*')
-            if check == 'denied':
+            if not robots.allowed('/', '*'):
                 json_log['generic_deny_slash'] = True
-                check = robots.allowed('/', 'googlebot')
-                json_log['google_deny_slash'] = check == 'denied'
+                json_log['google_deny_slash'] = not robots.allowed('/', 'googlebot')
 
         self.datalayer.cache_robots(schemenetloc, robots)
-        self.in_progress.discard(schemenetloc)
         if final_schemenetloc:
             self.datalayer.cache_robots(final_schemenetloc, robots)
-            # we did not set this but we'll discard it anyway
-            self.in_progress.discard(final_schemenetloc)
         sitemaps = list(robots.sitemaps)
         if sitemaps:
             json_log['sitemap_lines'] = len(sitemaps)
+            if crawler and crawler.sitemaps:
+                crawler.sitemaps.discovered(sitemaps, base=schemenetloc + '/robots.txt', seed_host=seed_host)
 
         self.jsonlog(schemenetloc, json_log)
         return robots
@@ -342,3 +346,103 @@ class Robots:
         if self.robotslogfd:
             json_log['host'] = schemenetloc
             print(json.dumps(json_log, sort_keys=True), file=self.robotslogfd)
+
+
+class RobotsPrefetcher:
+    '''
+    Fetches robots.txt for hosts as they enter the frontier, with its own
+    pool of coroutines, so that workers rarely have to wait for robots.
+
+    fetch(url, seed_host) is an async function that fetches and caches
+    the robots.txt for url. A host is pending from the time it is queued
+    until its fetch finishes; the scheduler parks the work of pending
+    hosts until then, see notify(). A host is only tried once, if the fetch fails the workers
+    fall back to fetching robots themselves.
+    '''
+    def __init__(self, robots, fetch, concurrency=10, queue_size=10000, size=100000):
+        self.robots = robots
+        self.fetch = fetch
+        self.concurrency = concurrency
+        self.q = asyncio.Queue(maxsize=queue_size)
+        self.queued = set()
+        self.tried = cachetools.LRUCache(size)
+        self.waiters = defaultdict(list)  # schemenetloc -> callbacks for when it's no longer pending
+        self.tasks = []
+        memory.register_debug(self.memory)
+
+    def known(self, schemenetloc):
+        try:
+            self.robots.datalayer.read_robots_cache(schemenetloc)
+            return True
+        except KeyError:
+            return False
+
+    def pending(self, schemenetloc):
+        return schemenetloc in self.queued or schemenetloc in self.robots.in_progress
+
+    def notify(self, schemenetloc, callback):
+        '''
+        Call callback() when schemenetloc is no longer pending.
+        '''
+        task = self.robots.in_progress.get(schemenetloc)
+        if task is not None and schemenetloc not in self.queued:
+            # a worker is fetching it
+            task.add_done_callback(lambda t: callback())
+        else:
+            self.waiters[schemenetloc].append(callback)
+
+    def want(self, url, seed_host=None):
+        '''
+        Queue a prefetch of the robots.txt for url if needed. Returns True
+        if the robots for url are not known yet, but soon will be.
+        '''
+        schemenetloc = url.urlsplit.scheme + '://' + url.urlsplit.netloc
+        if self.pending(schemenetloc):
+            return True
+        if schemenetloc in self.tried or self.known(schemenetloc):
+            return False
+        try:
+            self.q.put_nowait((schemenetloc, url, seed_host))
+        except asyncio.QueueFull:
+            stats.stats_sum('robots prefetch queue full', 1)
+            return False
+        self.queued.add(schemenetloc)
+        self.tried[schemenetloc] = True
+        stats.stats_sum('robots prefetch queued', 1)
+        stats.stats_set('robots prefetch queue depth', self.q.qsize())
+        stats.stats_max('robots prefetch max queue depth', self.q.qsize())
+        return True
+
+    async def run(self):
+        while True:
+            with stats.coroutine_state('robots prefetch idle'):
+                schemenetloc, url, seed_host = await self.q.get()
+            stats.stats_set('robots prefetch queue depth', self.q.qsize())
+            try:
+                await self.fetch(url, seed_host)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error('robots prefetch of %s threw a surprising exception: %r', schemenetloc, e)
+            finally:
+                self.queued.discard(schemenetloc)
+                for callback in self.waiters.pop(schemenetloc, ()):
+                    callback()
+            if self.known(schemenetloc):
+                stats.stats_sum('robots prefetch success', 1)
+            else:
+                stats.stats_sum('robots prefetch failed', 1)
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(self.run()) for _ in range(self.concurrency)]
+
+    def cancel(self):
+        for t in self.tasks:
+            if not t.done():
+                t.cancel()
+
+    def memory(self):
+        tried = {}
+        tried['bytes'] = memory.total_size(self.tried)
+        tried['len'] = len(self.tried)
+        return {'robots prefetch tried': tried}
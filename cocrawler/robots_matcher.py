@@ -0,0 +1,208 @@
+'''
+A compiled robots.txt matcher.
+
+Robots._check asks about every url, for our agent and sometimes for
+googlebot and '*' too, and add_url and the scheduler call it for every
+outlink. So robots.txt is parsed once into a RuleSet per agent, and a
+check is a handful of dict lookups instead of a walk over all of the
+directives.
+
+Matching follows reppy, which we used before:
+
+ - agents are matched exactly, case insensitive, else '*' is used
+ - groups for the same agent are merged, and directives before the
+   first User-agent line belong to '*'
+ - the longest pattern wins, and if two are the same length, the one
+   listed first wins
+ - '*' matches anything, '$' at the end anchors the pattern at the end
+   of path+query, and trailing '*'s are dropped
+ - %-escapes are normalized in both patterns and paths
+ - /robots.txt is always allowed
+
+Plain patterns live in a dict keyed by prefix, and a check looks up the
+prefixes of the path, longest first. Wildcard patterns are compiled to
+regexes, and only tried if they are longer than the best plain match.
+Decisions for recent paths are memoized in a small LRU for each agent:
+with no wildcards, the decision only depends on the path up to the
+longest pattern, so that prefix is the key.
+'''
+
+import re
+import bisect
+import urllib.parse
+from collections import OrderedDict
+
+_safe = "/?=&;:@+,$!*'()[]~-._"
+_needs_normalizing = re.compile(r'[^A-Za-z0-9' + re.escape(_safe) + ']')
+
+
+def normalize(s):
+    '''
+    Canonical %-escaping, so that e.g. /%7e, /%7E and /~ compare equal.
+    '''
+    if _needs_normalizing.search(s) is None:
+        return s
+    return urllib.parse.quote(urllib.parse.unquote(s), safe=_safe)
+
+
+def parse(text):
+    '''
+    Returns a dict of agent name -> list of (order, allow, pattern), and a list of sitemaps
+    '''
+    groups = {}
+    sitemaps = []
+    current = ['*']
+    in_agents = False
+    order = 0
+
+    for line in text.lstrip('\ufeff').splitlines():
+        line = line.partition('#')[0]
+        key, sep, value = line.partition(':')
+        if not sep:
+            continue
+        key = key.strip().lower()
+        value = value.strip()
+
+        if key in ('user-agent', 'useragent'):
+            if not in_agents:
+                current = []
+                in_agents = True
+            current.append(value.lower())
+            groups.setdefault(value.lower(), [])  # an agent with no rules is allowed everything
+            continue
+        in_agents = False
+
+        if key in ('allow', 'disallow'):
+            if not value:
+                continue  # an empty Disallow: allows everything, which is the default anyway
+            for agent in current:
+                groups.setdefault(agent, []).append((order, key == 'allow', value))
+            order += 1
+        elif key == 'sitemap':
+            sitemaps.append(value)
+
+    return groups, sitemaps
+
+
+class RuleSet:
+    '''
+    The compiled directives for one group of agents
+    '''
+    def __init__(self, directives, cache_size=32):
+        prefixes = {}  # normalized prefix -> (order, allow)
+        wildcards = []
+        for order, allow, pattern in directives:
+            anchored = pattern.endswith('$')
+            if anchored:
+                pattern = pattern[:-1]
+            if '**' in pattern:
+                pattern = re.sub(r'\*+', '*', pattern)
+            if not anchored:
+                pattern = pattern.rstrip('*')
+            parts = [normalize(p) for p in pattern.split('*')]
+            if len(parts) == 1 and not anchored:
+                # first one listed wins ties, so don't overwrite
+                prefixes.setdefault(parts[0], (order, allow))
+                continue
+            priority = len('*'.join(parts)) + anchored
+            regex = '.*'.join(re.escape(p) for p in parts) + ('$' if anchored else '')
+            wildcards.append((priority, order, allow, regex))
+
+        # sorted, so the prefixes of a path that are rules are all ancestors of
+        # the biggest rule <= path. parents[i] is the longest rule that is a prefix of rule i.
+        self.keys = sorted(prefixes)
+        self.values = [prefixes[k] for k in self.keys]
+        self.parents = []
+        stack = []
+        for i, key in enumerate(self.keys):
+            while stack and not key.startswith(self.keys[stack[-1]]):
+                stack.pop()
+            self.parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+        # one regex, alternatives in priority order, so the first one that matches is the best
+        self.wildcards = sorted(wildcards, key=lambda w: (-w[0], w[1]))
+        self.wildcard_regex = None
+
+        if self.wildcards:
+            self.key_length = None
+        else:
+            self.key_length = max((len(k) for k in self.keys), default=0)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def allowed(self, path):
+        cache = self.cache
+        key = path if self.key_length is None else path[:self.key_length]
+        decision = cache.get(key)
+        if decision is None and self.key_length is not None and _needs_normalizing.search(key) is not None:
+            # normalizing can pull in characters past the prefix, so this is cached by the whole path
+            key = (path,)
+            decision = cache.get(key)
+        if decision is not None:
+            cache.move_to_end(key)
+            return decision
+
+        decision = self._allowed(normalize(path))
+
+        if self.cache_size:
+            cache[key] = decision
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return decision
+
+    def _allowed(self, path):
+        best_priority, best_order, best_allow = -1, None, True
+        keys = self.keys
+        i = bisect.bisect_right(keys, path) - 1
+        while i >= 0:
+            key = keys[i]
+            if path.startswith(key):
+                best_priority = len(key)
+                best_order, best_allow = self.values[i]
+                break
+            i = self.parents[i]
+
+        if not self.wildcards or self.wildcards[0][0] < best_priority:
+            return best_allow
+        if self.wildcard_regex is None:
+            self.wildcard_regex = re.compile('|'.join('('+w[3]+')' for w in self.wildcards), re.S)
+        m = self.wildcard_regex.match(path)
+        if m:
+            priority, order, allow, _ = self.wildcards[m.lastindex - 1]
+            if priority > best_priority or (priority == best_priority and order < best_order):
+                return allow
+        return best_allow
+
+
+class CompiledRobots:
+    '''
+    A parsed robots.txt. Rules for the agents in agents are selected and
+    compiled up front, other agents are compiled when first asked about.
+    '''
+    def __init__(self, text, agents=(), cache_size=32):
+        self.groups, self.sitemaps = parse(text)
+        self.cache_size = cache_size
+        self.rulesets = {}  # agent -> RuleSet, agents in the same group share one
+        for agent in agents:
+            self.ruleset(agent)
+
+    def ruleset(self, agent):
+        lowered = agent.lower()
+        ruleset = self.rulesets.get(lowered)
+        if ruleset is None:
+            group = lowered if lowered in self.groups else '*'
+            ruleset = self.rulesets.get(group)
+            if ruleset is None:
+                ruleset = self.rulesets[group] = RuleSet(self.groups.get(group, ()), cache_size=self.cache_size)
+            self.rulesets[lowered] = ruleset
+        self.rulesets[agent] = ruleset
+        return ruleset
+
+    def allowed(self, path, agent):
+        if not path:
+            path = '/'
+        elif path == '/robots.txt':
+            return True
+        ruleset = self.rulesets.get(agent) or self.ruleset(agent)
+        return ruleset.allowed(path)
@@ -11,7 +11,8 @@ hand out work in order, increment deadlines
 import time
 import asyncio
 import pickle
-from collections import defaultdict
+import functools
+from collections import defaultdict, deque
 from operator import itemgetter
 import logging
 import cachetools
@@ -27,13 +28,21 @@ LOGGER = logging.getLogger(__name__)
 
 
 class Scheduler:
-    def __init__(self, robots, resolver):
+    def __init__(self, robots, resolver, slowhosts=None, robots_prefetcher=None):
         self.robots = robots
         self.resolver = resolver
+        self.slowhosts = slowhosts
+        self.robots_prefetcher = robots_prefetcher
+        if slowhosts:
+            slowhosts.released = self.unpark_slow_lane
 
         self.q = asyncio.PriorityQueue()
         self.ridealong = {}
+        self.host_queued = defaultdict(int)  # surt_host -> count of work in self.q
         self.awaiting_work = 0
+        self.awaiting = set()  # tasks sleeping in self.q.get()
+        self.parked = {}  # key -> deque of work waiting for something, see park()
+        self.parked_count = 0
         self.maxhostqps = None
         self.delta_t = None
         self.next_fetch = cachetools.TTLCache(10000, 10)  # 10 seconds good enough for QPS=0.1 and up
@@ -100,9 +109,15 @@ class Scheduler:
                 # putting it in an except clause makes sure the race is only run when
                 # the queue is actually empty.
                 self.awaiting_work += 1
-                with stats.coroutine_state('awaiting work'):
-                    work = await self.q.get()
-                self.awaiting_work -= 1
+                task = asyncio.current_task()
+                self.awaiting.add(task)
+                try:
+                    with stats.coroutine_state('awaiting work'):
+                        work = await self.q.get()
+                finally:
+                    # we can be cancelled here, see Crawler.resize_workers()
+                    self.awaiting_work -= 1
+                    self.awaiting.discard(task)
 
             if self.max_crawled_urls_exceeded():
                 self.q.put_nowait(work)
@@ -113,7 +128,15 @@ class Scheduler:
             surt_host, _, _ = surt.partition(')')
             ridealong = self.get_ridealong(surt)
 
+            key = self.parking(surt_host, ridealong)
+            if key:
+                self.park(key, work)
+                continue
+
             recycle, why, dt = await self.schedule_work(surt, surt_host, ridealong)
+            if self.slowhosts:
+                # this work might not have taken a slow lane slot after all
+                self.unpark_slow_lane()
 
             if recycle:
                 # sleep then requeue
@@ -130,6 +153,7 @@ class Scheduler:
                 with stats.coroutine_state(why):
                     await asyncio.sleep(dt)
 
+            self._host_dequeued(surt_host)
             return work
 
     def next_slot(self, now, keys):
@@ -139,6 +163,74 @@ class Scheduler:
                 times.append(self.next_fetch[key] - now)
         return max(times)
 
+    def parking(self, surt_host, ridealong):
+        '''
+        Returns a key if this work can't be done until something else
+        happens, so it should be parked instead of tying up a worker.
+        '''
+        if self.robots_prefetcher:
+            url = ridealong['url']
+            seed_host = ridealong.get('seed_host') if ridealong.get('seed') else None
+            if self.robots_prefetcher.want(url, seed_host=seed_host):
+                # robots is being fetched in the background, do some other work meanwhile
+                return ('robots prefetch', url.urlsplit.scheme + '://' + url.urlsplit.netloc)
+
+        if self.slowhosts and not self.slowhosts.has_room(surt_host):
+            # don't let slow hosts tie up more than their lane's worth of workers
+            return ('slow host lane',)
+
+    def park(self, key, work):
+        '''
+        Set work aside until unpark(key). The worker goes on to other work.
+        '''
+        first = key not in self.parked
+        if first:
+            self.parked[key] = deque()
+        self.parked[key].append(work)
+        self.parked_count += 1
+        self.q.task_done()
+        stats.stats_sum('scheduler '+key[0]+' parked', 1)
+        stats.stats_set('scheduler parked', self.parked_count)
+        stats.stats_max('scheduler max parked', self.parked_count)
+        if first and key[0] == 'robots prefetch':
+            self.robots_prefetcher.notify(key[1], functools.partial(self.unpark, key))
+
+    def unpark(self, key, count=None):
+        '''
+        Put count (default all) of the work parked under key back on the queue.
+        '''
+        parked = self.parked.get(key)
+        if not parked:
+            return
+        if count is None:
+            count = len(parked)
+        for _ in range(min(count, len(parked))):
+            self.q.put_nowait(parked.popleft())
+            self.parked_count -= 1
+        if not parked:
+            del self.parked[key]
+        stats.stats_set('scheduler parked', self.parked_count)
+
+    def unpark_slow_lane(self):
+        '''
+        Let as much parked slow host work try again as the slow lane has
+        room for. Called when a slot is released and after scheduling
+        anything, because parked work that turns out not to need a slot
+        (robots denied, or the host is fast now) never releases one.
+        '''
+        key = ('slow host lane',)
+        if key not in self.parked:
+            return
+        room = self.slowhosts.room()
+        if room >= self.slowhosts.lane_size:
+            self.unpark(key)  # the lane is empty, nothing is going to release a slot
+        elif room > 0:
+            self.unpark(key, count=room)
+
+    def unpark_all(self):
+        for key in list(self.parked):
+            self.unpark(key)
+
     async def schedule_work(self, surt, surt_host, ridealong):
         recycle, why, dt = False, None, 0
 
@@ -173,6 +265,9 @@ class Scheduler:
             for k in keys:
                 self.next_fetch[k] = now + self.delta_t
 
+        if self.slowhosts and not recycle:
+            self.slowhosts.admit(surt, surt_host)
+
         return recycle, why, dt
 
     def work_done(self):
@@ -183,13 +278,29 @@ class Scheduler:
         When we requeue work after a failure, we add 0.5 to the rand;
         eventually do that in here
         '''
-        self.q.put_nowait(work)
+        self.queue_work(work)
 
     def queue_work(self, work):
+        self._host_queued(work)
         self.q.put_nowait(work)
 
+    def _host_queued(self, work):
+        surt_host, _, _ = work[2].partition(')')
+        self.host_queued[surt_host] += 1
+
+    def _host_dequeued(self, surt_host):
+        self.host_queued[surt_host] -= 1
+        if self.host_queued[surt_host] <= 0:
+            del self.host_queued[surt_host]
+
+    def host_has_work(self, surt_host):
+        '''
+        Used by the connection pool to decide if a connection is worth keeping alive
+        '''
+        return surt_host in self.host_queued
+
     def qsize(self):
-        return self.q.qsize()
+        return self.q.qsize() + self.parked_count
 
     def set_ridealong(self, ridealongid, work):
         self.ridealong[ridealongid] = work
@@ -208,8 +319,11 @@ class Scheduler:
     def ridealong_size(self):
         return len(self.ridealong)
 
+    def awaiting_tasks(self):
+        return list(self.awaiting)
+
     def done(self, worker_count):
-        return self.awaiting_work == worker_count and self.q.qsize() == 0
+        return self.awaiting_work == worker_count and self.q.qsize() == 0 and not self.parked_count
 
     async def close(self):
         # we got here in a sligthly racy fashion, which occasionally results in hangs
@@ -225,6 +339,7 @@ class Scheduler:
         pickle.dump('Put the XXX header here', f)  # XXX date, conf file name, conf file checksum
         pickle.dump(self.ridealong, f)
         pickle.dump(crawler._seeds, f)
+        self.unpark_all()
         count = self.q.qsize()
         pickle.dump(count, f)
         for _ in range(0, count):
@@ -236,12 +351,14 @@ class Scheduler:
         self.ridealong = pickle.load(f)
         crawler._seeds = pickle.load(f)
         self.q = asyncio.PriorityQueue()
+        self.host_queued = defaultdict(int)
         count = pickle.load(f)
         for _ in range(0, count):
             work = pickle.load(f)
-            self.q.put_nowait(work)
+            self.queue_work(work)
 
     def dump_frontier(self):
+        self.unpark_all()
         while True:
             try:
                 work = self.q.get_nowait()
@@ -255,6 +372,7 @@ class Scheduler:
         '''
         Print a human-readable summary of what's in the queues
         '''
+        self.unpark_all()
         print('{} items in the crawl queue'.format(self.q.qsize()))
         print('{} items in the ridealong dict'.format(len(self.ridealong)))
 
@@ -326,5 +444,12 @@ class Scheduler:
         frozen_until = {}
         frozen_until['bytes'] = memory.total_size(self.frozen_until)
         frozen_until['len'] = len(self.frozen_until)
+        host_queued = {}
+        host_queued['bytes'] = memory.total_size(self.host_queued)
+        host_queued['len'] = len(self.host_queued)
+        parked = {}
+        parked['bytes'] = memory.total_size(self.parked)
+        parked['len'] = self.parked_count
         return {'q': q, 'ridealong': ridealong,
-                'next_fetch': next_fetch, 'frozen_until': frozen_until}
+                'next_fetch': next_fetch, 'frozen_until': frozen_until,
+                'host_queued': host_queued, 'parked': parked}
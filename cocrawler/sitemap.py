@@ -0,0 +1,421 @@
+'''
+Sitemaps.
+
+When Sitemaps.Enabled is set, the sitemaps listed in a robots.txt are
+fetched in the background, and the urls in them are added to the
+frontier. Sitemap index files are followed up to Sitemaps.MaxDepth
+deep.
+
+Sitemaps can be 50 megabytes of xml, and more than that gzipped, so
+they are never parsed whole: the body comes back from the fetcher
+(spooled to disk if it's big), and SitemapParser is fed a block at a
+time. It decompresses gzip and deflate a bounded chunk at a time, pulls
+<url> and <sitemap> elements out of the xml as they end and then throws
+them away, and splits text sitemaps into lines.
+
+The sitemap priority and lastmod hints become the rand of the url,
+which orders it within its crawl priority: a high priority or recently
+modified url is crawled before a low priority or stale one. Urls are
+added a batch at a time, with a cap per host.
+'''
+
+import time
+import zlib
+import asyncio
+import calendar
+import logging
+from collections import namedtuple
+import xml.etree.ElementTree as ET
+
+import cachetools
+
+from .urls import URL
+from . import config
+from . import stats
+from . import fetcher
+from . import dns
+from . import memory
+
+LOGGER = logging.getLogger(__name__)
+
+SitemapEntry = namedtuple('SitemapEntry', ['kind', 'loc', 'lastmod', 'priority'])
+
+_CHUNK = 64 * 1024
+
+
+def parse_lastmod(s):
+    '''
+    W3C datetime, e.g. 2019, 2019-05-01, 2019-05-01T12:00:00+02:00, to a unix time. None if unparseable.
+    '''
+    s = s.strip()
+    date, _, clock = s.partition('T')
+    try:
+        parts = [int(p) for p in date.split('-')]
+        if not 1 <= len(parts) <= 3:
+            return
+        year, month, day = (parts + [1, 1])[:3]
+        hour = minute = second = 0
+        offset = 0
+        if clock:
+            if clock.endswith('Z'):
+                clock = clock[:-1]
+            elif len(clock) > 6 and clock[-6] in '+-' and clock[-3] == ':':
+                sign = 1 if clock[-6] == '+' else -1
+                offset = sign * (int(clock[-5:-3]) * 3600 + int(clock[-2:]) * 60)
+                clock = clock[:-6]
+            hms = clock.split(':')
+            hour, minute = int(hms[0]), int(hms[1])
+            if len(hms) > 2:
+                second = int(float(hms[2]))
+        return calendar.timegm((year, month, day, hour, minute, second)) - offset
+    except (ValueError, IndexError, OverflowError):
+        return
+
+
+def parse_priority(s):
+    try:
+        p = float(s)
+    except ValueError:
+        return
+    return min(max(p, 0.), 1.)
+
+
+def hints_to_rand(priority=None, lastmod=None, now=None):
+    '''
+    Lower rand is crawled first. Half of it is the sitemap priority (default 0.5),
+    half is how stale lastmod is, up to a year (default half a year.)
+    '''
+    if priority is None:
+        priority = 0.5
+    if lastmod is None:
+        staleness = 0.5
+    else:
+        age = (now or time.time()) - lastmod
+        staleness = min(max(age / (365 * 86400), 0.), 1.)
+    return min(0.5 * (1. - priority) + 0.5 * staleness, 0.99999)
+
+
+class SitemapParser:
+    '''
+    feed() it blocks of the body, it returns the SitemapEntrys found so far.
+
+    content_encoding is the http Content-Encoding. A gzip file inside of
+    that (sitemap.xml.gz) is noticed by its magic number.
+    '''
+    def __init__(self, base_url=None, content_encoding='identity', max_size=50*1024*1024):
+        self.base_url = base_url
+        self.max_size = max_size
+        self.size = 0  # decompressed bytes
+        self.truncated = False
+        self.error = None
+        self.kind = None  # 'xml' or 'text', once we've seen enough to tell
+        self.decoders = []
+        content_encoding = content_encoding.lower()
+        if content_encoding in ('gzip', 'x-gzip'):
+            self.decoders.append(zlib.decompressobj(16 + zlib.MAX_WBITS))
+        elif content_encoding == 'deflate':
+            self.decoders.append(zlib.decompressobj(zlib.MAX_WBITS))
+        self.sniffed_gzip = False
+        self.head = b''
+        self.xml = None
+        self.root = None
+        self.tail = b''
+        self.entries = []
+
+    @property
+    def done(self):
+        return self.truncated or self.error is not None
+
+    def feed(self, data):
+        self.entries = []
+        if not self.done:
+            self._decode(0, bytes(data))
+        return self.entries
+
+    def close(self):
+        self.entries = []
+        if not self.done:
+            if self.kind is None and self.head:
+                self._sniff(b'', final=True)
+            if self.kind == 'xml':
+                try:
+                    self.xml.close()
+                except ET.ParseError as e:
+                    self.error = str(e)
+                self._xml_events()
+            elif self.kind == 'text' and self.tail:
+                self._text_line(self.tail)
+        return self.entries
+
+    def _decode(self, i, data):
+        if i == len(self.decoders):
+            return self._body(data)
+        d = self.decoders[i]
+        while data and not self.done:
+            try:
+                out = d.decompress(data, _CHUNK)  # bounded, the rest waits in unconsumed_tail
+            except zlib.error as e:
+                self.error = 'decompress: ' + str(e)
+                return
+            data = d.unconsumed_tail
+            if out:
+                self._decode(i+1, out)
+
+    def _body(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.truncated = True
+            return
+        if self.kind is None:
+            self._sniff(data)
+        elif self.kind == 'xml':
+            self._xml(data)
+        else:
+            self._text(data)
+
+    def _sniff(self, data, final=False):
+        head = self.head + data
+        if not self.sniffed_gzip:
+            if len(head) < 2 and not final:
+                self.head = head
+                return
+            self.sniffed_gzip = True
+            if head.startswith(b'\x1f\x8b'):
+                self.head = b''
+                self.size = 0  # count the decompressed size instead
+                self.decoders.append(zlib.decompressobj(16 + zlib.MAX_WBITS))
+                return self._decode(len(self.decoders) - 1, head)
+
+        start = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+        if not start and not final and len(head) < _CHUNK:
+            self.head = head
+            return
+        self.head = b''
+        if start.startswith(b'<'):
+            self.kind = 'xml'
+            self.xml = ET.XMLPullParser(events=('start', 'end'))
+            self._xml(head)
+        else:
+            self.kind = 'text'
+            self._text(head)
+
+    def _xml(self, data):
+        try:
+            self.xml.feed(data)
+        except ET.ParseError as e:
+            self.error = str(e)
+        self._xml_events()
+
+    def _xml_events(self):
+        try:
+            for event, elem in self.xml.read_events():
+                if self.root is None:
+                    self.root = elem
+                if event == 'end':
+                    self._xml_element(elem)
+        except ET.ParseError as e:
+            # the events before the error were fine
+            self.error = str(e)
+
+    def _xml_element(self, elem):
+        kind = elem.tag.rpartition('}')[2]
+        if kind not in ('url', 'sitemap'):
+            return
+        fields = {}
+        for child in elem:
+            fields[child.tag.rpartition('}')[2]] = (child.text or '').strip()
+        self._entry(kind, fields.get('loc'), fields.get('lastmod'), fields.get('priority'))
+        # we're done with it, and everything before it
+        self.root.clear()
+
+    def _text(self, data):
+        lines = (self.tail + data).split(b'\n')
+        self.tail = lines.pop()
+        if len(self.tail) > _CHUNK:
+            self.tail = b''  # not a sitemap, or a very strange one
+        for line in lines:
+            self._text_line(line)
+
+    def _text_line(self, line):
+        line = line.strip().decode('utf8', errors='replace')
+        if line.startswith('http://') or line.startswith('https://'):
+            self._entry('url', line, None, None)
+
+    def _entry(self, kind, loc, lastmod, priority):
+        if not loc:
+            return
+        try:
+            url = URL(loc, urljoin=self.base_url)
+        except (ValueError, UnicodeError):
+            return
+        if url.urlsplit.scheme not in ('http', 'https') or not url.hostname:
+            return
+        self.entries.append(SitemapEntry(kind, url,
+                                         parse_lastmod(lastmod) if lastmod else None,
+                                         parse_priority(priority) if priority else None))
+
+
+class Sitemaps:
+    '''
+    Fetches and ingests sitemaps with its own pool of coroutines.
+    '''
+    def __init__(self, crawler, concurrency=2, max_depth=2, max_size=50*1024*1024,
+                 max_urls_per_host=10000, batch_size=100, priority=2, size=100000):
+        self.crawler = crawler
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.max_urls_per_host = max_urls_per_host
+        self.batch_size = batch_size
+        self.priority = priority
+        self.q = asyncio.Queue()
+        self.seen = cachetools.LRUCache(size)  # sitemap urls
+        self.host_urls = cachetools.LRUCache(size)  # host -> urls added from sitemaps
+        self.tasks = []
+        self.in_flight = 0
+        memory.register_debug(self.memory)
+
+    def discovered(self, sitemaps, base=None, seed_host=None, depth=0):
+        '''
+        Queue sitemaps, from a robots.txt or a sitemap index, unless we've seen them already.
+        '''
+        for s in sitemaps:
+            try:
+                url = s if isinstance(s, URL) else URL(s, urljoin=base)
+            except (ValueError, UnicodeError):
+                stats.stats_sum('sitemap bad url', 1)
+                continue
+            if url.url in self.seen:
+                continue
+            self.seen[url.url] = True
+            stats.stats_sum('sitemap queued', 1)
+            self.q.put_nowait((url, seed_host, depth))
+            stats.stats_set('sitemap queue depth', self.q.qsize())
+
+    async def run(self):
+        while True:
+            with stats.coroutine_state('sitemap idle'):
+                url, seed_host, depth = await self.q.get()
+            stats.stats_set('sitemap queue depth', self.q.qsize())
+            self.in_flight += 1
+            try:
+                with stats.record_latency('sitemap ingest', url=url.url):
+                    await self.ingest(url, seed_host, depth)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error('sitemap %s threw a surprising exception: %r', url.url, e)
+            finally:
+                self.in_flight -= 1
+
+    @property
+    def busy(self):
+        '''
+        True while there are sitemaps queued or being ingested, so the crawl isn't done yet.
+        '''
+        return bool(self.in_flight or self.q.qsize())
+
+    async def ingest(self, url, seed_host, depth):
+        crawler = self.crawler
+        prefetch_dns, get_kwargs = fetcher.apply_url_policies(url, crawler)
+        if prefetch_dns and not await dns.prefetch(url, crawler.resolver):
+            stats.stats_sum('sitemap fetch failed', 1)
+            return
+        get_kwargs['headers'] = dict(get_kwargs['headers'], **{'Accept-Encoding': 'gzip, deflate'})
+        f = await fetcher.fetch(url, crawler.session, max_page_size=self.max_size,
+                                allow_redirects=True, max_redirects=5, stats_prefix='sitemap ',
+                                get_kwargs=get_kwargs, spool_size=crawler.spool_size)
+        if f.last_exception or f.response.status != 200:
+            stats.stats_sum('sitemap fetch failed', 1)
+            return
+        stats.stats_sum('sitemap fetched', 1)
+
+        parser = SitemapParser(base_url=str(f.response.url),
+                               content_encoding=f.response.headers.get('content-encoding', 'identity'),
+                               max_size=self.max_size)
+        body = f.body_bytes
+        batch = []
+        counts = {'url': 0, 'sitemap': 0}
+        added = 0
+        blocks = (body[start:start+_CHUNK] for start in range(0, len(body), _CHUNK))
+        for block in blocks:
+            for entry in parser.feed(block):
+                self.entry(entry, batch, counts, seed_host, depth)
+            if len(batch) >= self.batch_size:
+                added += crawler.add_urls(self.priority, batch)
+                batch = []
+                await asyncio.sleep(0)  # let the rest of the crawler run
+            if parser.done:
+                break
+        for entry in parser.close():
+            self.entry(entry, batch, counts, seed_host, depth)
+        if batch:
+            added += crawler.add_urls(self.priority, batch)
+
+        if parser.truncated:
+            stats.stats_sum('sitemap truncated', 1)
+        if parser.error:
+            stats.stats_sum('sitemap parse error', 1)
+            LOGGER.debug('sitemap %s parse error: %s', url.url, parser.error)
+        stats.stats_sum('sitemap urls found', counts['url'])
+        stats.stats_sum('sitemap urls added', added)
+        stats.stats_sum('sitemap index entries found', counts['sitemap'])
+        stats.stats_max('sitemap max decompressed bytes', parser.size)
+
+    def entry(self, entry, batch, counts, seed_host, depth):
+        counts[entry.kind] += 1
+        if entry.kind == 'sitemap':
+            if depth < self.max_depth:
+                self.discovered([entry.loc], seed_host=seed_host, depth=depth+1)
+            else:
+                stats.stats_sum('sitemap index too deep', 1)
+        elif self.host_room(entry.loc):
+            batch.append((self.ridealong(entry, seed_host), hints_to_rand(entry.priority, entry.lastmod)))
+
+    def host_room(self, url):
+        host = url.hostname_without_www
+        count = self.host_urls.get(host, 0)
+        if count >= self.max_urls_per_host:
+            stats.stats_sum('sitemap urls over host cap', 1)
+            return False
+        self.host_urls[host] = count + 1
+        return True
+
+    def ridealong(self, entry, seed_host):
+        ridealong = {'url': entry.loc, 'priority': self.priority,
+                     'retries_left': config.read('Crawl', 'MaxTries')}
+        if seed_host:
+            ridealong['seed_host'] = seed_host
+        return ridealong
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(self.run()) for _ in range(self.concurrency)]
+
+    def cancel(self):
+        for t in self.tasks:
+            if not t.done():
+                t.cancel()
+
+    def memory(self):
+        seen = {}
+        seen['bytes'] = memory.total_size(self.seen)
+        seen['len'] = len(self.seen)
+        host_urls = {}
+        host_urls['bytes'] = memory.total_size(self.host_urls)
+        host_urls['len'] = len(self.host_urls)
+        return {'sitemap seen': seen, 'sitemap host urls': host_urls}
+
+
+def setup(crawler):
+    '''
+    Returns a Sitemaps, or None if sitemaps are not enabled
+    '''
+    if not config.read('Sitemaps', 'Enabled'):
+        return
+    return Sitemaps(crawler,
+                    concurrency=int(config.read('Sitemaps', 'Concurrency')),
+                    max_depth=int(config.read('Sitemaps', 'MaxDepth')),
+                    max_size=int(config.read('Sitemaps', 'MaxSize')),
+                    max_urls_per_host=int(config.read('Sitemaps', 'MaxUrlsPerHost')),
+                    batch_size=int(config.read('Sitemaps', 'BatchSize')),
+                    priority=int(config.read('Sitemaps', 'Priority')))
@@ -0,0 +1,129 @@
+'''
+Slow-host isolation.
+
+With a PageTimeout of 30 seconds, a crawl that runs into a lot of slow
+or tarpitting servers ends up with most of its workers waiting on
+trickling responses, and throughput collapses. SlowHosts keeps a
+moving average of time to first byte, time to last byte, and the
+timeout rate for each host, and classifies hosts as fast or slow.
+
+Fetches to slow hosts run in a separate lane with a capped number of
+slots. The scheduler only hands out slow-host work when the slow lane
+has room, and parks it otherwise, so slow hosts can't starve fast
+ones. A slot is taken when the scheduler hands out the work and
+released when the fetch is done, which calls released() to let parked
+work try again.
+'''
+
+import logging
+
+import cachetools
+
+from . import config
+from . import stats
+from . import memory
+
+LOGGER = logging.getLogger(__name__)
+
+lanes = ('fast', 'slow')
+
+
+class SlowHosts:
+    def __init__(self, lane_size=10, first_byte=2.0, last_byte=10.0, timeout_rate=0.5,
+                 alpha=0.3, size=100000):
+        self.lane_size = lane_size
+        self.first_byte = first_byte
+        self.last_byte = last_byte
+        self.timeout_rate = timeout_rate
+        self.alpha = alpha
+        self.hosts = cachetools.LRUCache(size)  # surt_host -> [first byte, last byte, timeout rate, is slow]
+        self.admitted = {}  # surt -> lane
+        self.occupancy = dict((lane, 0) for lane in lanes)
+        self.released = None  # called when a slow lane slot frees up, set by the scheduler
+        memory.register_debug(self.memory)
+
+    def is_slow(self, surt_host):
+        speed = self.hosts.get(surt_host)
+        return speed is not None and speed[3]
+
+    def has_room(self, surt_host):
+        if self.is_slow(surt_host):
+            return self.occupancy['slow'] < self.lane_size
+        return True
+
+    def room(self):
+        '''
+        Free slots in the slow lane
+        '''
+        return self.lane_size - self.occupancy['slow']
+
+    def admit(self, surt, surt_host):
+        lane = 'slow' if self.is_slow(surt_host) else 'fast'
+        self.admitted[surt] = lane
+        self._occupy(lane, 1)
+
+    def release(self, surt):
+        lane = self.admitted.pop(surt, None)
+        if lane is not None:
+            self._occupy(lane, -1)
+            if lane == 'slow' and self.released:
+                self.released()
+        return lane
+
+    def _occupy(self, lane, delta):
+        self.occupancy[lane] += delta
+        stats.stats_set(lane+' host lane occupancy', self.occupancy[lane])
+        stats.stats_max(lane+' host lane max occupancy', self.occupancy[lane])
+
+    def fetched(self, surt, surt_host, f, elapsed, url=None):
+        '''
+        Called after every fetch, with the FetcherResponse and the clock
+        seconds it took. Releases the lane slot, and returns the lane.
+        '''
+        lane = self.release(surt) or 'fast'
+        stats.stats_sum(lane+' host lane fetches', 1)
+        stats.record_a_latency_value(lane+' host lane fetch time', elapsed, url, 10.)
+        if f.body_bytes:
+            stats.stats_sum(lane+' host lane bytes', len(f.body_bytes))
+
+        if f.last_exception == 'TimeoutError':
+            self.record(surt_host, elapsed, elapsed, timeout=True)
+        elif f.t_last_byte is not None:
+            self.record(surt_host, float(f.t_first_byte), float(f.t_last_byte))
+        return lane
+
+    def record(self, surt_host, t_first_byte, t_last_byte, timeout=False):
+        sample = (t_first_byte, t_last_byte, 1. if timeout else 0.)
+        speed = self.hosts.get(surt_host)
+        if speed is None:
+            speed = list(sample) + [False]
+        else:
+            speed[:3] = [old + self.alpha * (new - old) for old, new in zip(speed, sample)]
+
+        slow = (speed[0] > self.first_byte or speed[1] > self.last_byte or
+                speed[2] > self.timeout_rate)
+        if slow and not speed[3]:
+            LOGGER.debug('host %s is now slow: %r', surt_host, speed)
+            stats.stats_sum('slow host classified slow', 1)
+        elif speed[3] and not slow:
+            stats.stats_sum('slow host classified fast', 1)
+        speed[3] = slow
+        self.hosts[surt_host] = speed
+
+    def memory(self):
+        hosts = {}
+        hosts['bytes'] = memory.total_size(self.hosts)
+        hosts['len'] = len(self.hosts)
+        return {'slow host speeds': hosts}
+
+
+def setup():
+    '''
+    Returns a SlowHosts, or None if there is no slow lane
+    '''
+    lane_size = int(config.read('Crawl', 'SlowHostLane'))
+    if not lane_size:
+        return
+    return SlowHosts(lane_size=lane_size,
+                     first_byte=float(config.read('Crawl', 'SlowHostFirstByte')),
+                     last_byte=float(config.read('Crawl', 'SlowHostLastByte')))
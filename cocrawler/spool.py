@@ -0,0 +1,85 @@
+'''
+Spooled response bodies: kept in memory when small, in an mmap'd
+temporary file when large, so that many workers fetching big pages at
+the same time don't all hold them in the Python heap.
+
+getbuffer() returns bytes for an in-memory body and a read-only
+memoryview of the mmap for a spooled one. hashlib, zlib, str(buf, charset)
+and slicing all work on either without a copy.
+'''
+
+import mmap
+import tempfile
+
+from . import stats
+
+
+class SpooledBody:
+    def __init__(self, spool_size=None, stats_prefix=''):
+        self.spool_size = spool_size
+        self.stats_prefix = stats_prefix
+        self.blocks = []
+        self.size = 0
+        self.f = None
+        self.mm = None
+
+    def __len__(self):
+        return self.size
+
+    def write(self, block):
+        self.size += len(block)
+        if self.f is not None:
+            self.f.write(block)
+            return
+        self.blocks.append(block)
+        if self.spool_size is not None and self.size > self.spool_size:
+            self.f = tempfile.TemporaryFile(prefix='cocrawler-spool-')
+            self.f.writelines(self.blocks)
+            self.blocks = []
+            stats.stats_sum(self.stats_prefix+'fetch spooled to disk', 1)
+
+    def getbuffer(self):
+        if self.f is None:
+            return b''.join(self.blocks)
+        if self.mm is None:
+            self.f.flush()
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            stats.stats_sum(self.stats_prefix+'fetch spooled to disk bytes', self.size)
+        return memoryview(self.mm)
+
+
+def tobytes(body_bytes):
+    '''
+    For the few consumers that insist on bytes: pickle, cchardet, .startswith()
+    '''
+    if isinstance(body_bytes, memoryview):
+        return body_bytes.tobytes()
+    return body_bytes
+
+
+class BufferReader:
+    '''
+    A read()-able stream over a buffer that only copies one block at a
+    time, unlike io.BytesIO which copies the whole buffer up front.
+    '''
+    def __init__(self, buf):
+        self.buf = memoryview(buf)
+        self.pos = 0
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = len(self.buf) - self.pos
+        block = self.buf[self.pos:self.pos+n].tobytes()
+        self.pos += len(block)
+        return block
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.buf)
+        self.pos = pos
+        return pos
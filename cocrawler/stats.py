@@ -75,9 +75,12 @@ def record_a_burn(name, start, url=None):
 
 
 def record_a_latency(name, start, url=None, elapsedmin=10.0):
+    record_a_latency_value(name, time.time() - start, url=url, elapsedmin=elapsedmin)
+
+
+def record_a_latency_value(name, elapsed, url=None, elapsedmin=10.0):
     if isinstance(url, URL):
         url = url.url
-    elapsed = time.time() - start
     latency = latencies.get(name, {})
     latency['count'] = latency.get('count', 0) + 1
     latency['time'] = latency.get('time', 0.0) + elapsed
@@ -0,0 +1,189 @@
+'''
+A stub DNS server, for tests and benchmarks.
+
+It answers UDP queries from a synthetic zone: every name gets an A
+record (a stable, public-looking address derived from the name), unless
+it is picked to be NXDOMAIN, and some answers are SERVFAIL. Latency,
+TTLs and the NXDOMAIN and SERVFAIL rates are configurable. SOA queries
+always get an SOA whose minimum is negative_ttl.
+
+Point a resolver at it with nameservers=['127.0.0.1'] and udp_port=port:
+
+    server = await stubdns.start(nxdomain_rate=0.1)
+    resolver = dns.CoCrawler_Caching_AsyncResolver(nameservers=['127.0.0.1'], udp_port=server.port)
+'''
+
+import time
+import random
+import socket
+import struct
+import hashlib
+import asyncio
+import ipaddress
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+QTYPE_A = 1
+QTYPE_SOA = 6
+QTYPE_AAAA = 28
+QCLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_NOTIMP = 4
+
+
+def _hash(name, salt=b''):
+    return hashlib.md5(salt + name.lower().encode('utf8')).digest()
+
+
+def address_for(name):
+    '''
+    A stable address for name, not loopback, private, multicast, etc.
+    '''
+    digest = _hash(name)
+    while True:
+        ip = ipaddress.IPv4Address(digest[:4])
+        if ip.is_global and not ip.is_multicast:
+            return str(ip)
+        digest = hashlib.md5(digest).digest()
+
+
+def encode_name(name):
+    out = b''
+    for label in name.rstrip('.').split('.'):
+        if label:
+            label = label.encode('utf8')
+            out += struct.pack('!B', len(label)) + label
+    return out + b'\0'
+
+
+def parse_question(data):
+    '''
+    Returns (id, flags, name, qtype, qclass, end of question), or raises ValueError
+    '''
+    if len(data) < 12:
+        raise ValueError('short packet')
+    qid, flags, qdcount = struct.unpack('!HHH', data[:6])
+    if qdcount != 1:
+        raise ValueError('qdcount is not 1')
+    labels = []
+    offset = 12
+    while True:
+        if offset >= len(data):
+            raise ValueError('truncated name')
+        length = data[offset]
+        offset += 1
+        if length == 0:
+            break
+        if length & 0xc0:
+            raise ValueError('compressed name in question')
+        labels.append(data[offset:offset+length].decode('utf8', errors='replace'))
+        offset += length
+    if offset + 4 > len(data):
+        raise ValueError('truncated question')
+    qtype, qclass = struct.unpack('!HH', data[offset:offset+4])
+    return qid, flags, '.'.join(labels), qtype, qclass, offset + 4
+
+
+def build_response(qid, flags, question, rcode, answers=(), authority=()):
+    '''
+    answers and authority are lists of (type, ttl, rdata) for the question's name
+    '''
+    flags = 0x8000 | (flags & 0x7900) | 0x0400 | 0x0080 | rcode  # QR, opcode+RD copied, AA, RA
+    header = struct.pack('!HHHHHH', qid, flags, 1, len(answers), len(authority), 0)
+    out = header + question
+    for rtype, ttl, rdata in list(answers) + list(authority):
+        out += struct.pack('!HHHIH', 0xc00c, rtype, QCLASS_IN, ttl, len(rdata)) + rdata
+    return out
+
+
+class StubDNSServer(asyncio.DatagramProtocol):
+    def __init__(self, latency=0., ttl=3600, negative_ttl=300, nxdomain_rate=0., servfail_rate=0., seed=None):
+        self.latency = latency
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.nxdomain_rate = nxdomain_rate
+        self.servfail_rate = servfail_rate
+        self.random = random.Random(seed)
+        self.transport = None
+        self.port = None
+        self.queries = 0
+        self.answers = {'noerror': 0, 'nxdomain': 0, 'servfail': 0, 'other': 0}
+        self.cpu = 0.  # process time spent in here, so benchmarks can subtract it
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.port = transport.get_extra_info('sockname')[1]
+        sock = transport.get_extra_info('socket')
+        # at high concurrency, queries arrive in bursts bigger than the default buffer
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+
+    def is_nxdomain(self, name):
+        # stable per name, like a real zone
+        return int.from_bytes(_hash(name, b'nx')[:4], 'big') < self.nxdomain_rate * 2**32
+
+    def soa_rdata(self, name):
+        return (encode_name('ns.' + name) + encode_name('hostmaster.' + name) +
+                struct.pack('!IIIII', 1, 3600, 600, 86400, self.negative_ttl))
+
+    def answer(self, data):
+        try:
+            qid, flags, name, qtype, qclass, end = parse_question(data)
+        except ValueError as e:
+            LOGGER.debug('stub dns ignoring bad query: %s', e)
+            return
+        question = data[12:end]
+
+        if self.servfail_rate and self.random.random() < self.servfail_rate:
+            self.answers['servfail'] += 1
+            return build_response(qid, flags, question, RCODE_SERVFAIL)
+        if qclass != QCLASS_IN:
+            self.answers['other'] += 1
+            return build_response(qid, flags, question, RCODE_NOTIMP)
+
+        soa = (QTYPE_SOA, self.negative_ttl, self.soa_rdata(name))
+        if qtype == QTYPE_SOA:
+            # every name is the apex of its own zone
+            self.answers['noerror'] += 1
+            return build_response(qid, flags, question, RCODE_NOERROR, answers=[soa])
+        if self.is_nxdomain(name):
+            self.answers['nxdomain'] += 1
+            return build_response(qid, flags, question, RCODE_NXDOMAIN, authority=[soa])
+
+        self.answers['noerror'] += 1
+        if qtype == QTYPE_A:
+            rdata = ipaddress.IPv4Address(address_for(name)).packed
+            return build_response(qid, flags, question, RCODE_NOERROR, answers=[(QTYPE_A, self.ttl, rdata)])
+        # AAAA and everything else: the name exists, but there's no data
+        return build_response(qid, flags, question, RCODE_NOERROR, authority=[soa])
+
+    def datagram_received(self, data, addr):
+        c0 = time.process_time()
+        self.queries += 1
+        response = self.answer(data)
+        if response is not None:
+            if self.latency:
+                asyncio.get_event_loop().call_later(self.latency, self._send, response, addr)
+            else:
+                self._send(response, addr)
+        self.cpu += time.process_time() - c0
+
+    def _send(self, response, addr):
+        if not self.transport.is_closing():
+            self.transport.sendto(response, addr)
+
+    def close(self):
+        self.transport.close()
+
+
+async def start(host='127.0.0.1', port=0, **kwargs):
+    '''
+    Start a StubDNSServer on the running loop. port=0 picks a free port,
+    see server.port.
+    '''
+    loop = asyncio.get_event_loop()
+    _, server = await loop.create_datagram_endpoint(lambda: StubDNSServer(**kwargs), local_addr=(host, port))
+    return server
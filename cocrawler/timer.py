@@ -50,7 +50,7 @@ fast_stats = [
     {'name': 'await burner thread parser'},
     {'name': 'fetcher fetching'},
     {'name': 'robots fetcher fetching'},
-    {'name': 'robots collision sleep'},
+    {'name': 'robots fetch coalesced wait'},
     {'name': 'DNS prefetch'},
 ]
 
@@ -0,0 +1,113 @@
+'''
+TLS session resumption.
+
+Every https connection normally does a full tls handshake, which for a
+crawl that keeps coming back to the same hosts is a big share of both
+main-thread cpu and latency. SessionCacheContext is an SSLContext that
+remembers the most recent session for each server in a bounded LRU and
+offers it when opening a new connection to the same server, so that the
+server can resume it with an abbreviated handshake.
+
+asyncio creates the SSLObject with wrap_bio() and server_hostname, and
+never tells the context what port it is connecting to, so the cache is
+keyed by server hostname.
+'''
+
+import ssl
+import time
+import logging
+
+import cachetools
+
+from . import stats
+from . import memory
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CachingSSLObject(ssl.SSLObject):
+    def do_handshake(self):
+        c0 = time.process_time()
+        try:
+            super().do_handshake()
+        finally:
+            self._cc_handshake_cpu = getattr(self, '_cc_handshake_cpu', 0.) + time.process_time() - c0
+
+        # only get here when the handshake is complete
+        stats.update_cpu_burn('tls handshake', 1, self._cc_handshake_cpu, None)
+        if self.session_reused:
+            stats.stats_sum('tls session resumed', 1)
+        self._cc_save_session()
+
+    def read(self, *args, **kwargs):
+        ret = super().read(*args, **kwargs)
+        if not self._cc_saved_ticket:
+            # tls 1.3 session tickets arrive after the handshake
+            self._cc_save_session()
+        return ret
+
+    def _cc_save_session(self):
+        context = self.context
+        key = getattr(self, '_cc_key', None)
+        if key is None or not isinstance(context, SessionCacheContext):
+            self._cc_saved_ticket = True
+            return
+        session = self.session
+        if session is None:
+            return
+        if session.has_ticket or session.id:
+            context.sessions[key] = session
+        self._cc_saved_ticket = session.has_ticket
+
+
+class SessionCacheContext(ssl.SSLContext):
+    sslobject_class = CachingSSLObject
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT, size=10000):
+        super().__init__()
+        self.sessions = cachetools.LRUCache(size)
+        memory.register_debug(self.memory)
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, size=10000):
+        return super().__new__(cls, protocol)
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        key = None
+        if not server_side and server_hostname and session is None:
+            key = server_hostname
+            session = self.sessions.get(key)
+            if session is not None:
+                stats.stats_sum('tls session cache hit', 1)
+            else:
+                stats.stats_sum('tls session cache miss', 1)
+        try:
+            sslobj = super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                      server_hostname=server_hostname, session=session)
+        except ValueError:
+            # e.g. 'Session refers to a different SSLContext'
+            stats.stats_sum('tls session cache unusable', 1)
+            self.sessions.pop(key, None)
+            sslobj = super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                      server_hostname=server_hostname)
+        sslobj._cc_key = key
+        sslobj._cc_saved_ticket = key is None
+        return sslobj
+
+    def memory(self):
+        sessions = {}
+        sessions['bytes'] = memory.total_size(self.sessions)
+        sessions['len'] = len(self.sessions)
+        return {'tls sessions': sessions}
+
+
+def create_default_context(cafile=None, size=10000):
+    '''
+    Like ssl.create_default_context(ssl.Purpose.SERVER_AUTH), with a session cache
+    '''
+    context = SessionCacheContext(size=size)
+    # PROTOCOL_TLS_CLIENT already turns on CERT_REQUIRED and check_hostname
+    if cafile:
+        context.load_verify_locations(cafile=cafile)
+    else:
+        context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    return context
@@ -1,21 +1,33 @@
 import os
 import socket
 import logging
+import hashlib
+import base64
+import struct
 from collections import OrderedDict
 from io import BytesIO
 
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
 from . import config
 
 from warcio.statusandheaders import StatusAndHeaders
 from warcio.warcwriter import WARCWriter
-from warcio.timeutils import timestamp_now
+from warcio.timeutils import timestamp_now, iso_date_to_timestamp
 
 from . import stats
+from . import surt
+from . import cdxj
+from . import spool
 
 LOGGER = logging.getLogger(__name__)
 
 
 valid_truncations = (('length', 'time', 'disconnect', 'unspecified'))
+# 'policy' truncations (see fetcher.header_policy) are not warced
 
 
 '''
@@ -68,13 +80,50 @@ json-metadata: {"created_at": 1488772924, "type": "recording", "updated_at": 148
 '''
 
 
+ZSTD_SKIPPABLE_FRAME_DICTIONARY = 0x184D2A5D
+
+
+class ZstdRecordWrapper:
+    '''
+    warcio calls flush() at the end of every record, so each record
+    becomes its own zstd frame, like gzip members in a .warc.gz
+    '''
+    def __init__(self, f, compressor, prefix=''):
+        self.f = f
+        self.compressor = compressor
+        self.prefix = prefix
+        self.blocks = []
+
+    def write(self, block):
+        self.blocks.append(block)
+
+    def flush(self):
+        if self.blocks:
+            with stats.record_burn('warc zstd compress'+p(self.prefix)):
+                self.f.write(self.compressor.compress(b''.join(self.blocks)))
+            self.blocks = []
+        self.f.flush()
+
+
 class CCWARCWriter:
-    def __init__(self, prefix, max_size, subprefix=None, gzip=True, get_serial=None):
+    def __init__(self, prefix, max_size, subprefix=None, gzip=True, get_serial=None, cdxj=False,
+                 zstd=False, zstd_level=3, zstd_dict=None):
         self.writer = None
+        self.cdxj = cdxj
+        self.cdxjf = None
         self.prefix = prefix
         self.subprefix = subprefix
         self.max_size = max_size
-        self.gzip = gzip
+        self.gzip = gzip and not zstd
+        self.zstd = zstd
+        if zstd:
+            if zstandard is None:
+                raise ValueError('zstd warc output requires the zstandard package')
+            self.zstd_dict = zstd_dict
+            kwargs = {'level': zstd_level, 'write_content_size': True}
+            if zstd_dict is not None:
+                kwargs['dict_data'] = zstandard.ZstdCompressionDict(zstd_dict)
+            self.compressor = zstandard.ZstdCompressor(**kwargs)
         self.hostname = socket.gethostname()
         if get_serial is not None:
             self.external_get_serial = get_serial
@@ -84,7 +133,7 @@ class CCWARCWriter:
 
     def __del__(self):
         if self.writer is not None:
-            self.f.close()
+            self.close()
 
     def create_default_info(self, version, warcheader_version, ip, description=None, creator=None, operator=None):
         '''
@@ -116,9 +165,21 @@ class CCWARCWriter:
         filename += '-' + serial + '-' + self.hostname + '.warc'
         if self.gzip:
             filename += '.gz'
+        elif self.zstd:
+            filename += '.zst'
         self.filename = filename
         self.f = open(filename, 'wb')
-        self.writer = WARCWriter(self.f, gzip=self.gzip)
+        if self.zstd:
+            if self.zstd_dict is not None:
+                # the dictionary goes in a skippable frame at the start of every file
+                self.f.write(struct.pack('<II', ZSTD_SKIPPABLE_FRAME_DICTIONARY, len(self.zstd_dict)))
+                self.f.write(self.zstd_dict)
+            self.writer = WARCWriter(ZstdRecordWrapper(self.f, self.compressor, prefix=self.prefix), gzip=False)
+        else:
+            self.writer = WARCWriter(self.f, gzip=self.gzip)
+        if self.cdxj:
+            # unsorted as we write, sorted when the warc is closed
+            self.cdxjf = open(filename + '.cdxj.unsorted', 'w')
         record = self.writer.create_warcinfo_record(self.filename, self.info)
         self.warcinfo_id = record.rec_headers.get_header('WARC-Record-ID')
         self.writer.write_record(record)
@@ -135,8 +196,55 @@ class CCWARCWriter:
         '''
         fsize = os.fstat(self.f.fileno()).st_size
         if fsize > self.max_size:
-            self.f.close()
-            self.writer = None
+            self.close()
+
+    def close(self):
+        self.f.close()
+        self.writer = None
+        if self.cdxjf is not None:
+            self.cdxjf.close()
+            self.cdxjf = None
+            unsorted = self.filename + '.cdxj.unsorted'
+            count = cdxj.sort_file(unsorted, self.filename + '.cdxj')
+            os.unlink(unsorted)
+            LOGGER.debug('wrote %d cdxj lines for %s', count, self.filename)
+
+    def _index_record(self, record, offset, length, mime):
+        headers = record.rec_headers
+        url = headers.get_header('WARC-Target-URI')
+        timestamp = iso_date_to_timestamp(headers.get_header('WARC-Date'))
+
+        fields = {'url': url, 'offset': str(offset), 'length': str(length),
+                  'filename': os.path.basename(self.filename)}
+        if record.rec_type == 'revisit':
+            fields['mime'] = 'warc/revisit'
+        elif mime:
+            fields['mime'] = mime
+        if record.http_headers:
+            fields['status'] = record.http_headers.get_statuscode()
+        digest = headers.get_header('WARC-Payload-Digest')
+        if digest:
+            fields['digest'] = digest
+
+        self.cdxjf.write(cdxj.cdxj_line(surt.surt(url), timestamp, fields))
+        stats.stats_sum('warc cdxj lines'+p(self.prefix), 1)
+
+    def _write_pair(self, request, response, mime):
+        if self.cdxjf is None:
+            self.writer.write_request_response_pair(request, response)
+            return
+
+        # same as warcio's write_request_response_pair, but we need the offset of the response
+        url = response.rec_headers.get_header('WARC-Target-URI')
+        date = response.rec_headers.get_header('WARC-Date')
+        request.rec_headers.replace_header('WARC-Target-URI', url)
+        request.rec_headers.replace_header('WARC-Date', date)
+        request.rec_headers.add_header('WARC-Concurrent-To', response.rec_headers.get_header('WARC-Record-ID'))
+
+        offset = self.f.tell()
+        self.writer.write_record(response)
+        self._index_record(response, offset, self.f.tell() - offset, mime)
+        self.writer.write_record(request)
 
     def write_dns(self, dns, ttl, url):
         # write it out even if empty
@@ -199,17 +307,23 @@ class CCWARCWriter:
                 ret.append((h, v))
         return ret
 
-    def write_request_response_pair(self, url, ip, req_headers, resp_headers, is_truncated, payload, digest=None, decompressed=False):
-        if self.writer is None:
-            self.open()
-
+    def _request_record(self, req_headers):
         req_http_headers = StatusAndHeaders('GET / HTTP/1.1', req_headers)
 
         warc_headers_dict = OrderedDict()
         warc_headers_dict['WARC-Warcinfo-ID'] = self.warcinfo_id
-        request = self.writer.create_warc_record('http://example.com/', 'request',
-                                                 warc_headers_dict=warc_headers_dict,
-                                                 http_headers=req_http_headers)
+        return self.writer.create_warc_record('http://example.com/', 'request',
+                                              warc_headers_dict=warc_headers_dict,
+                                              http_headers=req_http_headers)
+
+    def write_request_response_pair(self, url, ip, req_headers, resp_headers, is_truncated, payload, digest=None, decompressed=False):
+        '''
+        Returns the WARC-Date of the response record, for use in later revisit records.
+        '''
+        if self.writer is None:
+            self.open()
+
+        request = self._request_record(req_headers)
 
         fake_resp_headers = self._fake_resp_headers(resp_headers, len(payload), decompressed=decompressed)
         resp_http_headers = StatusAndHeaders('200 OK', fake_resp_headers, protocol='HTTP/1.1')
@@ -230,15 +344,60 @@ class CCWARCWriter:
                 warc_headers_dict['WARC-Truncated'] = 'unspecified'
 
         response = self.writer.create_warc_record(url, 'response',
-                                                  payload=BytesIO(payload),
+                                                  payload=spool.BufferReader(payload),
                                                   length=len(payload),
                                                   warc_headers_dict=warc_headers_dict,
                                                   http_headers=resp_http_headers)
 
-        self.writer.write_request_response_pair(request, response)
+        self._write_pair(request, response, mime_type(resp_headers))
         self.maybe_close()
         LOGGER.debug('wrote warc request-response pair%s for url %s', p(self.prefix), url)
         stats.stats_sum('warc r/r'+p(self.prefix), 1)
+        return response.rec_headers.get_header('WARC-Date')
+
+    def write_request_revisit_pair(self, url, ip, req_headers, resp_headers, payload_len, digest,
+                                   refers_to_url, refers_to_date, decompressed=False):
+        '''
+        Write a request and an identical-payload-digest revisit record, instead of
+        writing the payload a second time.
+        '''
+        if self.writer is None:
+            self.open()
+
+        request = self._request_record(req_headers)
+
+        fake_resp_headers = self._fake_resp_headers(resp_headers, payload_len, decompressed=decompressed)
+        resp_http_headers = StatusAndHeaders('200 OK', fake_resp_headers, protocol='HTTP/1.1')
+
+        warc_headers_dict = OrderedDict()
+        warc_headers_dict['WARC-Warcinfo-ID'] = self.warcinfo_id
+        if ip is not None:
+            if not isinstance(ip, str):
+                ip = ip[0]
+            warc_headers_dict['WARC-IP-Address'] = ip
+
+        revisit = self.writer.create_revisit_record(url, digest, refers_to_url, refers_to_date,
+                                                    http_headers=resp_http_headers,
+                                                    warc_headers_dict=warc_headers_dict)
+
+        self._write_pair(request, revisit, None)
+        self.maybe_close()
+        LOGGER.debug('wrote warc request-revisit pair%s for url %s', p(self.prefix), url)
+        stats.stats_sum('warc revisit'+p(self.prefix), 1)
+        stats.stats_sum('warc revisit bytes saved'+p(self.prefix), payload_len)
+
+
+def mime_type(resp_headers):
+    for h, v in resp_headers:
+        if h.lower() == b'content-type':
+            return v.decode('latin-1').partition(';')[0].strip().lower()
+
+
+def payload_digest(payload):
+    '''
+    WARC-Payload-Digest in the same base32 format that warcio computes
+    '''
+    return 'sha1:' + base64.b32encode(hashlib.sha1(payload).digest()).decode('ascii')
 
 
 def p(prefix):
@@ -248,6 +407,9 @@ def p(prefix):
         return ''
 
 
+valid_compressions = set(('gzip', 'zstd', 'none'))
+
+
 def setup(version, warcheader_version, local_addr):
     warcall = config.read('WARC', 'WARCAll')
     if warcall is not None and warcall:
@@ -257,7 +419,21 @@ def setup(version, warcheader_version, local_addr):
         description = config.read('WARC', 'WARCDescription')
         creator = config.read('WARC', 'WARCCreator')
         operator = config.read('WARC', 'WARCOperator')
-        warcwriter = CCWARCWriter(prefix, max_size, subprefix=subprefix)  # XXX get_serial lacks a default
+        index = config.read('WARC', 'WARCIndex')
+
+        compression = config.read('WARC', 'WARCCompression') or 'gzip'
+        if compression not in valid_compressions:
+            raise ValueError('unknown WARCCompression of ' + str(compression))
+        kwargs = {'gzip': compression == 'gzip'}
+        if compression == 'zstd':
+            kwargs['zstd'] = True
+            kwargs['zstd_level'] = int(config.read('WARC', 'WARCZstdLevel') or 3)
+            dictionary = config.read('WARC', 'WARCZstdDictionary')
+            if dictionary:
+                with open(os.path.expanduser(dictionary), 'rb') as f:
+                    kwargs['zstd_dict'] = f.read()
+
+        warcwriter = CCWARCWriter(prefix, max_size, subprefix=subprefix, cdxj=index, **kwargs)  # XXX get_serial lacks a default
         warcwriter.create_default_info(version, warcheader_version, local_addr,
                                        description=description, creator=creator, operator=operator)
     else:
@@ -7,7 +7,7 @@ from . import config
 LOGGER = logging.getLogger(__name__)
 
 
-def make_app():
+def make_app(crawler=None):
     loop = asyncio.get_event_loop()
     # TODO switch this to socket.getaddrinfo() -- see https://docs.python.org/3/library/socket.html
     serverip = config.read('REST', 'ServerIP')
@@ -45,6 +45,7 @@ def make_app():
     LOGGER.info('REST serving on %s', srv.sockets[0].getsockname())
 
     app['cocrawler'] = handler, srv
+    app['crawler'] = crawler
     return app
 
 
@@ -64,7 +65,13 @@ async def frontpage(request):
     return web.Response(text='Hello, world!')
 
 
+apis = {'workers': lambda crawler: crawler.worker_status()}
+
+
 async def api(request):
     name = request.match_info['name']
+    crawler = request.app['crawler']
+    if name in apis and crawler is not None:
+        return web.json_response(apis[name](crawler))
     data = {'name': name}
     return web.json_response(data)
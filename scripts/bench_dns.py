@@ -3,6 +3,10 @@ Benchmark the configured DNS service.
 
 Verify that DNS more-or-less works. Measure its speed to see if it'll
 be a bottleneck.
+
+With --stub, instead benchmark our caching resolver against a local
+stub DNS server, to measure its overhead offline: queries/sec, cache
+hit rate, coalescing savings, and cpu per lookup.
 '''
 
 import sys
@@ -15,17 +19,26 @@ import os
 from cocrawler.urls import URL
 import cocrawler.dns as dns
 import cocrawler.config as config
+import cocrawler.stats as stats
+import cocrawler.stubdns as stubdns
 
 ARGS = argparse.ArgumentParser(description='CoCrawler dns benchmark')
 ARGS.add_argument('--config', action='append')
 ARGS.add_argument('--configfile', action='store')
 ARGS.add_argument('--count', type=int, default=1000)
 ARGS.add_argument('--expect-not-suitable', action='store_true')
+ARGS.add_argument('--stub', action='store_true', help='use a local stub dns server')
+ARGS.add_argument('--hosts', type=int, default=1000, help='stub: number of distinct hostnames')
+ARGS.add_argument('--concurrency', type=int, help='default is Crawl.MaxWorkers')
+ARGS.add_argument('--latency', type=float, default=0.01, help='stub: seconds')
+ARGS.add_argument('--ttl', type=int, default=3600, help='stub: seconds')
+ARGS.add_argument('--nxdomain-rate', type=float, default=0.05, help='stub: fraction of hostnames')
+ARGS.add_argument('--servfail-rate', type=float, default=0.01, help='stub: fraction of answers')
 
 args = ARGS.parse_args()
 
 config.config(args.configfile, args.config)
-max_workers = config.read('Crawl', 'MaxWorkers')
+max_workers = args.concurrency or config.read('Crawl', 'MaxWorkers')
 ns = config.read('Fetcher', 'Nameservers')
 if isinstance(ns, str):
     ns = [ns]
@@ -33,7 +46,8 @@ if isinstance(ns, str):
 
 exit_value = 0
 
-resolver = dns.get_resolver()
+resolver = None if args.stub else dns.get_resolver()
+stub = None
 
 
 def create_queue():
@@ -67,6 +81,19 @@ def create_queue():
     return queue
 
 
+def create_stub_queue():
+    '''
+    A skewed mix of hostnames, so that there are cache hits, and
+    concurrent misses for the same host to coalesce
+    '''
+    queue = asyncio.Queue()
+    r = random.Random(1)
+    for _ in range(args.count):
+        host = 'host{}.bench-dns.example.com'.format(int(args.hosts * r.random() ** 2))
+        queue.put_nowait((URL('http://' + host), 'stub'))
+    return queue
+
+
 async def work():
     while True:
         sys.stdout.flush()
@@ -95,6 +122,13 @@ async def work():
 
 
 async def main():
+    if args.stub:
+        global stub, resolver
+        stub = await stubdns.start(latency=args.latency, ttl=args.ttl, nxdomain_rate=args.nxdomain_rate,
+                                   servfail_rate=args.servfail_rate, seed=1)
+        resolver = dns.CoCrawler_Caching_AsyncResolver(nameservers=['127.0.0.1'], udp_port=stub.port,
+                                                       tries=1, timeout=1.)
+
     workers = [asyncio.Task(work()) for _ in range(max_workers)]
 
     await queue.join()
@@ -103,14 +137,44 @@ async def main():
         if not w.done():
             w.cancel()
 
-queue = create_queue()
+    if stub:
+        await resolver.close()
+        stub.close()
+
+
+def stub_report(cpu):
+    def stat(name):
+        return stats.stat_value(name) or 0
+
+    hits = stat('prefetch DNS cache hit')
+    negative_hits = stat('prefetch DNS negative cache hit')
+    coalesced = stat('prefetch DNS lookup coalesced')
+    print('stub dns server saw {} queries: {}'.format(stub.queries, stub.answers))
+    print('cache hit rate {:.1f}%, negative cache hit rate {:.1f}%'.format(
+        100. * hits / qsize, 100. * negative_hits / qsize))
+    print('coalescing saved {} queries ({:.1f}% of lookups)'.format(coalesced, 100. * coalesced / qsize))
+    cpu -= stub.cpu
+    print('resolver cpu {:.1f} microseconds per lookup'.format(1e6 * cpu / qsize))
+    failures = dict((k, v) for k, v in stats.sums.items() if k.startswith('DNS failure '))
+    print('failures', failures)
+
+
+if args.stub:
+    queue = create_stub_queue()
+else:
+    queue = create_queue()
 qsize = queue.qsize()
 
 print('workers:', max_workers)
-print('configured nameservers:', ns)
+if args.stub:
+    print('stub nameserver: {} hosts, latency {}s, ttl {}s, nxdomain rate {}, servfail rate {}'.format(
+        args.hosts, args.latency, args.ttl, args.nxdomain_rate, args.servfail_rate))
+else:
+    print('configured nameservers:', ns)
 print('queries in queue', qsize)
 
 t0 = time.time()
+c0 = time.process_time()
 
 loop = asyncio.get_event_loop()
 try:
@@ -131,5 +195,7 @@ if not elapsed:
 qps = qsize / elapsed
 
 print('processed {} dns calls in {:.1f} seconds, qps = {:.1f}'.format(qsize, elapsed, qps))
+if args.stub:
+    stub_report(time.process_time() - c0)
 
 sys.exit(exit_value)
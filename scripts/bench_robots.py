@@ -0,0 +1,128 @@
+'''
+Benchmark the compiled robots matcher against reppy.
+
+Give it robots.txt files, or warcs from a crawl (the robots.txt
+responses in them are used.) For each robots.txt, urls are made up from
+its own patterns plus some common paths, and checked the way
+Robots._check does: our agent, and if that's denied, googlebot and '*'.
+Each url is checked --repeat times, because add_url and the scheduler
+both check every outlink.
+
+Reports parse and check times for both, and any disagreements.
+'''
+
+import sys
+import time
+import random
+import argparse
+
+from warcio.archiveiterator import ArchiveIterator
+import reppy.robots
+
+from cocrawler.robots import strip_bom
+import cocrawler.robots_matcher as robots_matcher
+
+ARGS = argparse.ArgumentParser(description='CoCrawler robots matcher benchmark')
+ARGS.add_argument('--agent', default='test-cocrawler')
+ARGS.add_argument('--urls', type=int, default=200, help='urls per robots.txt')
+ARGS.add_argument('--repeat', type=int, default=2, help='checks per url')
+ARGS.add_argument('--cache-size', type=int, default=32, help='compiled decision cache size, 0 for none')
+ARGS.add_argument('--show-disagreements', type=int, default=5)
+ARGS.add_argument('files', nargs='+', help='robots.txt files or warcs')
+
+common_paths = ['/', '/index.html', '/about/', '/search?q=foo', '/login', '/cgi-bin/foo.cgi',
+                '/wp-admin/admin-ajax.php', '/tag/foo/page/2/', '/products/123?sort=price&page=3',
+                '/images/logo.png', '/feed/', '/2019/05/some-article.html']
+
+
+def read_robots(filenames):
+    for filename in filenames:
+        if filename.endswith('.warc.gz') or filename.endswith('.warc'):
+            with open(filename, 'rb') as f:
+                for record in ArchiveIterator(f):
+                    uri = record.rec_headers.get_header('WARC-Target-URI') or ''
+                    if record.rec_type == 'response' and uri.endswith('/robots.txt'):
+                        yield uri, record.content_stream().read()
+        else:
+            with open(filename, 'rb') as f:
+                yield filename, f.read()
+
+
+def make_urls(text, count, r):
+    stems = []
+    for line in text.splitlines():
+        key, _, value = line.partition('#')[0].partition(':')
+        if key.strip().lower() in ('allow', 'disallow'):
+            value = value.strip().split('*')[0].rstrip('$')
+            if value:
+                stems.append(value)
+    stems.extend(common_paths)
+    suffixes = ['', 'x', '/', '/foo.html', '?id=1', '.php', '/a/b/c']
+    return [r.choice(stems) + r.choice(suffixes) for _ in range(count)]
+
+
+def check_all(allowed, agent, urls, repeat):
+    decisions = []
+    for url in urls:
+        for _ in range(repeat):
+            check = allowed(url, agent)
+            if not check:
+                allowed(url, 'googlebot')
+                allowed(url, '*')
+        decisions.append(check)
+    return decisions
+
+
+def main():
+    args = ARGS.parse_args()
+    r = random.Random(1)
+    agents = (args.agent, 'googlebot', '*')
+
+    files = 0
+    checks = 0
+    parse_t = {'reppy': 0., 'compiled': 0.}
+    check_t = {'reppy': 0., 'compiled': 0.}
+    disagreements = 0
+
+    for name, body in read_robots(args.files):
+        text = strip_bom(body).decode('utf8', errors='replace')
+        urls = make_urls(text, args.urls, r)
+        files += 1
+        checks += len(urls) * args.repeat
+
+        t0 = time.perf_counter()
+        rep = reppy.robots.Robots.parse('', text)
+        t1 = time.perf_counter()
+        compiled = robots_matcher.CompiledRobots(text, agents=agents, cache_size=args.cache_size)
+        t2 = time.perf_counter()
+        parse_t['reppy'] += t1 - t0
+        parse_t['compiled'] += t2 - t1
+
+        t0 = time.perf_counter()
+        rep_decisions = check_all(rep.allowed, args.agent, urls, args.repeat)
+        t1 = time.perf_counter()
+        compiled_decisions = check_all(compiled.allowed, args.agent, urls, args.repeat)
+        t2 = time.perf_counter()
+        check_t['reppy'] += t1 - t0
+        check_t['compiled'] += t2 - t1
+
+        for url, a, b in zip(urls, rep_decisions, compiled_decisions):
+            if a != b:
+                disagreements += 1
+                if disagreements <= args.show_disagreements:
+                    print('disagreement: {} {} reppy={} compiled={}'.format(name, url, a, b))
+
+    if not files:
+        print('no robots.txt found')
+        return 1
+
+    print('{} robots.txt, {} checks'.format(files, checks))
+    for which in ('reppy', 'compiled'):
+        print('{:>9}: parse {:7.1f} us/file, check {:6.2f} us/url'.format(
+            which, parse_t[which] / files * 1e6, check_t[which] / checks * 1e6))
+    print('disagreements: {} of {} urls'.format(disagreements, files * args.urls))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
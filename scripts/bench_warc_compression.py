@@ -0,0 +1,98 @@
+'''
+Benchmark WARC compression: gzip levels vs zstd levels, with and
+without a trained dictionary. Every record is compressed separately,
+the same way CCWARCWriter writes them.
+
+The corpus is one or more existing WARC files, e.g. from a WARCAll crawl.
+'''
+
+import time
+import zlib
+import argparse
+
+from warcio.archiveiterator import ArchiveIterator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def read_corpus(filenames, limit):
+    records = []
+    for name in filenames:
+        with open(name, 'rb') as f:
+            for record in ArchiveIterator(f):
+                block = record.rec_headers.to_bytes(encoding='utf-8') + record.raw_stream.read() + b'\r\n\r\n'
+                records.append(block)
+                if limit and len(records) >= limit:
+                    return records
+    return records
+
+
+def gzip_one(level):
+    def compress(block):
+        c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress(block) + c.flush()
+    return compress
+
+
+def zstd_one(level, dict_data=None):
+    kwargs = {'level': level, 'write_content_size': True}
+    if dict_data is not None:
+        kwargs['dict_data'] = dict_data
+    return zstandard.ZstdCompressor(**kwargs).compress
+
+
+def bench(name, compress, records, total):
+    c0 = time.process_time()
+    out = 0
+    for block in records:
+        out += len(compress(block))
+    elapsed = time.process_time() - c0
+    gigabytes = total / 1000000000.
+    print('{:>16}: {:6.1f} cpu-seconds/GB  ratio {:5.2f}  {:12d} bytes'.format(
+        name, elapsed / gigabytes if gigabytes else 0., total / out if out else 0., out))
+
+
+def main():
+    ARGS = argparse.ArgumentParser(description='WARC compression benchmark')
+    ARGS.add_argument('--gzip-levels', default='1,6,9')
+    ARGS.add_argument('--zstd-levels', default='1,3,9,19')
+    ARGS.add_argument('--limit', type=int, default=0, help='max records to read')
+    ARGS.add_argument('--train', type=int, default=0, help='train a zstd dictionary of this many bytes')
+    ARGS.add_argument('--dict-out', action='store', help='save the trained dictionary, for WARCZstdDictionary')
+    ARGS.add_argument('warcs', nargs='+')
+    args = ARGS.parse_args()
+
+    records = read_corpus(args.warcs, args.limit)
+    total = sum(len(r) for r in records)
+    print('corpus is {} records, {} bytes uncompressed'.format(len(records), total))
+
+    for level in args.gzip_levels.split(','):
+        bench('gzip -{}'.format(level), gzip_one(int(level)), records, total)
+
+    if zstandard is None:
+        print('zstandard is not installed, skipping zstd')
+        return
+
+    for level in args.zstd_levels.split(','):
+        bench('zstd -{}'.format(level), zstd_one(int(level)), records, total)
+
+    if args.train:
+        # note that training on the benchmark corpus flatters the dictionary
+        try:
+            dict_data = zstandard.train_dictionary(args.train, records)
+        except zstandard.ZstdError as e:
+            print('dictionary training failed, the corpus may be too small:', e)
+            return
+        print('trained a {} byte dictionary'.format(len(dict_data.as_bytes())))
+        if args.dict_out:
+            with open(args.dict_out, 'wb') as f:
+                f.write(dict_data.as_bytes())
+        for level in args.zstd_levels.split(','):
+            bench('zstd -{} dict'.format(level), zstd_one(int(level), dict_data=dict_data), records, total)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+'''
+Merge the per-warc .cdxj indexes written by WARC.WARCIndex into a
+single sorted crawl-wide index, using bounded memory.
+'''
+
+import sys
+import argparse
+import logging
+
+import cocrawler.cdxj as cdxj
+
+ARGS = argparse.ArgumentParser(description='CoCrawler cdxj index merge')
+ARGS.add_argument('--output', '-o', action='store', help='output file, default stdout')
+ARGS.add_argument('--unsorted', action='store_true', help='inputs are not sorted, e.g. .cdxj.unsorted files')
+ARGS.add_argument('--max-lines', type=int, default=1000000, help='lines held in memory when sorting')
+ARGS.add_argument('--max-open', type=int, default=500, help='files merged at once')
+ARGS.add_argument('--tmpdir', action='store', help='directory for temporary sorted runs')
+ARGS.add_argument('files', nargs='+')
+
+
+def main():
+    args = ARGS.parse_args()
+    logging.basicConfig(level='INFO')
+
+    if args.output:
+        out = open(args.output, 'w')
+    else:
+        out = sys.stdout
+
+    count = cdxj.merge_files(args.files, out, presorted=not args.unsorted,
+                             max_lines=args.max_lines, max_open=args.max_open, tmpdir=args.tmpdir)
+
+    if args.output:
+        out.close()
+    print('merged {} lines from {} files'.format(count, len(args.files)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
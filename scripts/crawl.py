@@ -93,7 +93,7 @@ def main():
         timer.start_carbon()
 
     if config.read('REST'):
-        app = webserver.make_app()
+        app = webserver.make_app(crawler)
     else:
         app = None
 
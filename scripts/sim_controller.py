@@ -0,0 +1,47 @@
+'''
+Run the concurrency controllers against a simulated crawler, to check
+that they converge, and how fast.
+'''
+
+import argparse
+
+import cocrawler.controller as controller
+
+
+def main():
+    ARGS = argparse.ArgumentParser(description='concurrency controller simulation')
+    ARGS.add_argument('--algorithm', action='append', help='default is all of them')
+    ARGS.add_argument('--steps', type=int, default=300, help='seconds of simulated crawl')
+    ARGS.add_argument('--start', type=int, default=5, help='starting limit')
+    ARGS.add_argument('--max-limit', type=int, default=10000)
+    ARGS.add_argument('--latency', type=float, default=0.5, help='seconds of network time per page')
+    ARGS.add_argument('--cpu-per-page', type=float, default=0.002, help='main thread cpu seconds per page')
+    ARGS.add_argument('--burner-pages-per-sec', type=float, default=1000.)
+    ARGS.add_argument('--rss-per-connection', type=int, default=0, help='bytes')
+    ARGS.add_argument('--rss-target-gigabytes', type=float, default=None)
+    args = ARGS.parse_args()
+
+    for name in args.algorithm or sorted(controller.controllers):
+        kwargs = {'max_limit': args.max_limit}
+        if name == 'pid' and args.rss_target_gigabytes:
+            kwargs['rss_target'] = args.rss_target_gigabytes * 1024 * 1024 * 1024
+        c = controller.controllers[name](args.start, **kwargs)
+        plant = controller.SimulatedCrawler(latency=args.latency, cpu_per_page=args.cpu_per_page,
+                                            burner_pages_per_sec=args.burner_pages_per_sec,
+                                            rss_per_connection=args.rss_per_connection)
+        limits = controller.simulate(c, plant, steps=args.steps)
+
+        tail = limits[-args.steps//5:]
+        final = tail[-1]
+        settled = next((i for i in range(len(limits)) if all(abs(l - final) <= 0.1 * final for l in limits[i:])),
+                       len(limits))
+        print('{}:'.format(name))
+        print('  limit every 10 seconds:', ' '.join(str(l) for l in limits[::10]))
+        print('  final limit {}, last {} seconds ranged {}-{}'.format(final, len(tail), min(tail), max(tail)))
+        print('  settled within 10% after {} seconds'.format(settled))
+        if getattr(c, 'bottleneck', None):
+            print('  bottleneck is', c.bottleneck)
+
+
+if __name__ == '__main__':
+    main()
@@ -51,11 +51,14 @@ scripts = [
     'scripts/aiohttp-fetch.py',
     'scripts/bench_burner.py',
     'scripts/bench_dns.py',
+    'scripts/bench_warc_compression.py',
+    'scripts/cdxj-merge.py',
     'scripts/crawl.py',
     'scripts/parse-html.py',
     'scripts/run_burner_bench.py',
     'scripts/run_burner.py',
     'scripts/run_parsers.py',
+    'scripts/sim_controller.py',
     'scripts/cocrawler-savefile-dump.py',
 ]
 
@@ -12,8 +12,11 @@ except ImportError:
 
 import os
 import random
-from bottle import hook, route, run, request, abort, redirect
+import gzip
+from bottle import hook, route, run, request, response, abort, redirect
 from urllib.parse import urlsplit
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
 import time
 
 
@@ -32,6 +35,8 @@ def generate_robots(host):
         redirect('http://127.0.0.1:8080/robots.txt.302')
     if host.startswith('pdfrobots'):
         return '%PDF-1.3\n'
+    if host.startswith('sitemap'):
+        return 'User-Agent: *\nDisallow: /denied/\nSitemap: /sitemap_index.xml\n'
     return 'User-Agent: *\nDisallow: /denied/\n'
 
 
@@ -58,6 +63,26 @@ def generate_sitemap(host):
     return siteheader + mylinks + sitefooter
 
 
+sitemapindex = '''<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+<sitemap><loc>/sitemap.xml</loc></sitemap>
+<sitemap><loc>/sitemap-more.xml.gz</loc><lastmod>2019-05-01</lastmod></sitemap>
+<sitemap><loc>/sitemap.txt</loc></sitemap>
+</sitemapindex>
+'''
+
+
+def generate_sitemap_gz(host):
+    mylinks = ''
+    for i in range(10, 20):
+        mylinks += '<url><loc>/ordinary/{}</loc><priority>0.{}</priority></url>\n'.format(i, i-10)
+    return gzip.compress((siteheader + mylinks + sitefooter).encode('utf8'))
+
+
+def generate_sitemap_txt(host):
+    return ''.join('http://{}/ordinary/{}\n'.format(host, i) for i in range(20, 30))
+
+
 header = '''
 <html><head><title>Title</title></head><body>
 '''
@@ -87,6 +112,15 @@ def generate_ordinary(name, host):
     return header + mylinks + trailer
 
 
+def generate_slow(name, host):
+    # a tarpit: slow to start, then trickles
+    time.sleep(0.5)
+    yield header
+    time.sleep(1.0)
+    yield links.format((name+1) % 5, (2*name) % 5)
+    yield trailer
+
+
 def generate_ordinary_503s(name, host):
     if random.randint(1, 9) < 2:  # 10% chance
         abort(503, 'Slow down, you move too fast. You got to make the morning last.\n')
@@ -151,12 +185,37 @@ def sitemap():
     return generate_sitemap(host)
 
 
+@route('/sitemap_index.xml')
+def sitemap_index():
+    return sitemapindex
+
+
+@route('/sitemap-more.xml.gz')
+def sitemap_gz():
+    host = request.get_header('Host')
+    response.content_type = 'application/x-gzip'
+    return generate_sitemap_gz(host)
+
+
+@route('/sitemap.txt')
+def sitemap_txt():
+    host = request.get_header('Host')
+    response.content_type = 'text/plain'
+    return generate_sitemap_txt(host)
+
+
 @route('/ordinary/<name:int>')
 def ordinary(name):
     host = request.get_header('Host')
     return generate_ordinary(name, host)
 
 
+@route('/slow/<name:int>')
+def slow(name):
+    host = request.get_header('Host')
+    return generate_slow(name, host)
+
+
 @route('/ordinary-with-503s/<name:int>')
 def ordinary503(name):
     host = request.get_header('Host')
@@ -181,5 +240,10 @@ def trap(name):
     return generate_trap(name, host)
 
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    # so that slow endpoints don't hold up everyone else
+    daemon_threads = True
+
+
 port = os.getenv('PORT') or 8080
-run(host='localhost', port=port)
+run(host='localhost', port=port, server_class=ThreadingWSGIServer)
@@ -43,7 +43,39 @@ if [ `warcio index Testing-000000-*.warc.gz | wc -l` != `warcio index testing.wa
     exit 1
 fi
 echo OK
-rm -f robotslog.jsonl crawllog.jsonl Testing-000000-*.warc.gz testing.warc.gz
+
+echo
+echo test-deep-replay
+echo
+
+# crawl again, out of the warc we just wrote
+rm -rf replay
+mkdir replay
+mv Testing-000000-*.warc.gz replay/
+rm -f robotslog.jsonl crawllog.jsonl frontierlog
+$COVERAGE ../scripts/crawl.py --configfile test-deep.yml --config WARC.WARCAll:True --config Fetcher.ReplayDirectory:replay
+rm -rf replay
+rm -f robotslog.jsonl crawllog.jsonl Testing-000000-*.warc.gz testing.warc.gz frontierlog
+
+echo
+echo test-deep-pipeline
+echo
+
+rm -f robotslog.jsonl crawllog.jsonl frontierlog
+$COVERAGE ../scripts/crawl.py --configfile test-deep.yml --config WARC.WARCAll:True --config Pipeline.Enabled:True
+rm -f robotslog.jsonl crawllog.jsonl Testing-000000-*.warc.gz frontierlog
+
+echo
+echo test-bandwidth
+echo
+$COVERAGE ../scripts/crawl.py --configfile test-bandwidth.yml
+rm -f robotslog.jsonl crawllog.jsonl
+
+echo
+echo test-slow
+echo
+$COVERAGE ../scripts/crawl.py --configfile test-slow.yml
+rm -f robotslog.jsonl crawllog.jsonl
 
 echo
 echo test-scheduler
@@ -51,6 +83,12 @@ echo
 $COVERAGE ../scripts/crawl.py --configfile test-scheduler.yml
 rm -f robotslog.jsonl crawllog.jsonl
 
+echo
+echo test-sitemap
+echo
+$COVERAGE ../scripts/crawl.py --configfile test-sitemap.yml
+rm -f robotslog.jsonl crawllog.jsonl
+
 echo
 echo test-wide
 echo
@@ -0,0 +1,28 @@
+import asyncio
+
+import cocrawler.bandwidth as bandwidth
+import cocrawler.stats as stats
+
+
+def test_token_bucket():
+    b = bandwidth.TokenBucket(1000)
+    now = b.last
+    assert b.charge(500, now=now) == 0.
+    assert b.charge(500, now=now) == 0.
+    assert b.charge(500, now=now) == 0.5
+    # paid off after 0.5 seconds, then a full second of refill is capped at burst
+    assert b.charge(0, now=now+0.5) == 0.
+    assert b.charge(1000, now=now+2.0) == 0.
+    assert b.charge(1, now=now+2.0) > 0.
+
+
+def test_shaper():
+    s = bandwidth.Shaper(rate=2000, host_rate=1000)
+    assert s.charge('example.com', 1000) == 0.
+    assert s.charge('example.com', 500) > 0.4
+    assert s.charge('example.org', 500) == 0.  # other hosts have their own budget
+    assert 0.2 < s.charge('example.net', 500) < 0.5  # but share the global one
+
+    stats.clear()
+    asyncio.run(s.shape('example.com', 10))
+    assert stats.stat_value('fetcher bandwidth shaping sum') > 0.
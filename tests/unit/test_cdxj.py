@@ -0,0 +1,60 @@
+import io
+import os
+import tempfile
+
+import pytest
+
+import cocrawler.cdxj as cdxj
+
+
+def write_lines(lines):
+    fd, name = tempfile.mkstemp(suffix='.cdxj')
+    with os.fdopen(fd, 'w') as f:
+        f.writelines(lines)
+    return name
+
+
+def test_cdxj_line():
+    line = cdxj.cdxj_line('com,example)/', '20190215073137', {'url': 'http://example.com/', 'offset': '0'})
+    assert line == 'com,example)/ 20190215073137 {"offset": "0", "url": "http://example.com/"}\n'
+    surt, timestamp, fields = cdxj.parse_line(line)
+    assert surt == 'com,example)/'
+    assert timestamp == '20190215073137'
+    assert fields['url'] == 'http://example.com/'
+
+
+def test_sort_file():
+    name = write_lines(['b 1 {}\n', 'a 2 {}\n', 'a 1 {}\n'])
+    out = name + '.sorted'
+    assert cdxj.sort_file(name, out) == 3
+    with open(out) as f:
+        assert f.readlines() == ['a 1 {}\n', 'a 2 {}\n', 'b 1 {}\n']
+    os.unlink(name)
+    os.unlink(out)
+
+
+def test_merge_files():
+    names = [write_lines(['a 1 {}\n', 'c 1 {}\n']),
+             write_lines(['b 1 {}\n', 'd 1 {}\n']),
+             write_lines(['a 2 {}\n'])]
+    expected = ['a 1 {}\n', 'a 2 {}\n', 'b 1 {}\n', 'c 1 {}\n', 'd 1 {}\n']
+
+    out = io.StringIO()
+    assert cdxj.merge_files(names, out) == 5
+    assert out.getvalue() == ''.join(expected)
+
+    # force multiple passes
+    out = io.StringIO()
+    assert cdxj.merge_files(names, out, max_open=2) == 5
+    assert out.getvalue() == ''.join(expected)
+
+    with pytest.raises(ValueError):
+        cdxj.merge_files(names, io.StringIO(), max_open=1)
+
+    unsorted = write_lines(['d 1 {}\n', 'a 1 {}\n', 'c 1 {}\n', 'b 1 {}\n', 'a 2 {}\n'])
+    out = io.StringIO()
+    assert cdxj.merge_files([unsorted], out, presorted=False, max_lines=2) == 5
+    assert out.getvalue() == ''.join(expected)
+
+    for name in names + [unsorted]:
+        os.unlink(name)
@@ -0,0 +1,65 @@
+import random
+from types import SimpleNamespace
+
+from cocrawler.urls import URL
+import cocrawler.content_model as content_model
+import cocrawler
+
+
+def test_keys():
+    assert content_model.keys(URL('http://www.example.com/')) == [('example.com', '/', ''),
+                                                                  ('example.com', '*', '')]
+    assert content_model.keys(URL('http://example.com/foo.PHP?a=1')) == [('example.com', '/', 'php'),
+                                                                         ('example.com', '*', 'php')]
+    assert content_model.keys(URL('http://example.com/dl/get.php')) == [('example.com', '/dl/', 'php'),
+                                                                        ('example.com', '*', 'php')]
+    assert content_model.keys(URL('http://example.com/dl/a/b')) == [('example.com', '/dl/', ''),
+                                                                    ('example.com', '*', '')]
+    assert content_model.keys(URL('http://example.com/v1.2.34567890'))[0] == ('example.com', '/', '')
+
+
+def test_model():
+    m = content_model.ContentTypeModel(size=100)
+    assert m.predict(URL('http://example.com/dl/get.php?id=1')) is None
+
+    for i in range(10):
+        m.update(URL('http://example.com/dl/get.php?id={}'.format(i)), 'application/pdf')
+        m.update(URL('http://example.com/page.php?id={}'.format(i)), 'text/html')
+
+    assert m.predict(URL('http://example.com/dl/get.php?id=100')) > 0.9
+    assert m.predict(URL('http://example.com/page.php?id=100')) < 0.1
+    # falls back to the per-host key
+    p = m.predict(URL('http://example.com/other/get.php'))
+    assert p is not None and 0.1 < p < 0.9
+    assert m.predict(URL('http://example.org/dl/get.php')) is None
+
+    # counts stay bounded and the model adapts
+    for i in range(200):
+        m.update(URL('http://example.com/dl/get.php?id={}'.format(i)), 'text/html')
+    html, non_html = m.counts[('example.com', '/dl/', 'php')]
+    assert html + non_html <= content_model.MAX_COUNT
+    assert m.predict(URL('http://example.com/dl/get.php?id=100')) < 0.1
+
+
+def test_bounded():
+    m = content_model.ContentTypeModel(size=10)
+    for i in range(100):
+        m.update(URL('http://example{}.com/'.format(i)), 'text/html')
+    assert len(m.counts) == 10
+
+
+def test_explore():
+    m = content_model.ContentTypeModel(size=100)
+    for i in range(20):
+        m.update(URL('http://example.com/dl/get.php?id={}'.format(i)), 'application/pdf')
+    crawler = SimpleNamespace(content_model=m, content_model_skip=0.9, content_model_demote=0.5,
+                              content_model_explore=0.1)
+    url = URL('http://example.com/dl/get.php?id=100')
+    random.seed(1)
+    says = [cocrawler.Crawler.content_model_says(crawler, url, {}) for _ in range(1000)]
+    assert set(says) == set(('skip', 'demote'))
+    assert 50 < says.count('demote') < 150
+    assert cocrawler.Crawler.content_model_says(crawler, url, {'seed': True}) is None
+
+    crawler.content_model_explore = 0.
+    assert cocrawler.Crawler.content_model_says(crawler, url, {}) == 'skip'
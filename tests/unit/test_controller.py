@@ -0,0 +1,49 @@
+import cocrawler.controller as controller
+
+
+def settles(limits, target, tolerance=0.1):
+    return all(abs(l - target) <= tolerance * target for l in limits)
+
+
+def test_pid_converges_on_cpu():
+    # cpu saturates at 500 pages/sec = a limit of 250; target is 90% of that
+    c = controller.PIDController(5, max_limit=10000)
+    limits = controller.simulate(c, controller.SimulatedCrawler(), steps=200)
+    assert settles(limits[-50:], 225)
+    assert c.bottleneck == 'cpu'
+
+
+def test_pid_converges_on_burner_backlog():
+    c = controller.PIDController(5, max_limit=10000)
+    plant = controller.SimulatedCrawler(burner_pages_per_sec=200)  # a limit of 100
+    limits = controller.simulate(c, plant, steps=300)
+    assert settles(limits[-50:], 100)
+    assert c.bottleneck == 'burner_backlog'
+
+
+def test_pid_converges_on_rss():
+    c = controller.PIDController(5, max_limit=10000, rss_target=2*1024*1024*1024)
+    plant = controller.SimulatedCrawler(rss_per_connection=10*1024*1024)  # 2 gigs at a limit of 194
+    limits = controller.simulate(c, plant, steps=300)
+    assert settles(limits[-50:], 194)
+    assert c.bottleneck == 'rss'
+
+
+def test_pid_max_limit():
+    c = controller.PIDController(5, max_limit=50)
+    limits = controller.simulate(c, controller.SimulatedCrawler(), steps=100)
+    assert limits[-1] == 50
+
+
+def test_pid_zero_signals():
+    c = controller.PIDController(5, max_limit=50)
+    assert c.update(controller.Signals(0., 0., 0, 0., 0)) > 5
+    assert c.bottleneck is None
+
+
+def test_domino():
+    c = controller.DominoController(10)
+    no_lag = controller.Signals(0., 0.5, 0, 100., 0)
+    assert [c.update(no_lag) for _ in range(3)] == [10, 10, 11]
+    big_lag = controller.Signals(5., 1.0, 0, 100., 0)
+    assert c.update(big_lag) == 10
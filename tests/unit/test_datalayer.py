@@ -1,5 +1,7 @@
 import tempfile
 import os
+import io
+import pickle
 import pytest
 
 from cocrawler.urls import URL
@@ -7,7 +9,8 @@ import cocrawler.datalayer as datalayer
 import cocrawler.config as config
 
 def test_seen():
-    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1}}
+    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1},
+         'WARC': {'WARCDigestCacheSize': 2}}
     config.set_config(c)
     dl = datalayer.Datalayer()
     assert not dl.seen(URL('http://example.com'))
@@ -16,7 +19,8 @@ def test_seen():
 
 
 def test_robotscache():
-    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1}}
+    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1},
+         'WARC': {'WARCDigestCacheSize': 2}}
     config.set_config(c)
     dl = datalayer.Datalayer()
     with pytest.raises(KeyError):
@@ -25,30 +29,69 @@ def test_robotscache():
     assert dl.read_robots_cache('http://example.com') == b'THIS IS A TEST'
 
 
+def test_digests():
+    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1},
+         'WARC': {'WARCDigestCacheSize': 2}}
+    config.set_config(c)
+    dl = datalayer.Datalayer()
+    assert dl.read_digest('sha1:AAAA') is None
+    dl.add_digest('sha1:AAAA', 'http://example.com/', '2019-02-15T07:31:37Z')
+    assert dl.read_digest('sha1:AAAA') == ('http://example.com/', '2019-02-15T07:31:37Z')
+    dl.add_digest('sha1:BBBB', 'http://example.com/b', '2019-02-15T07:31:38Z')
+    dl.add_digest('sha1:CCCC', 'http://example.com/c', '2019-02-15T07:31:39Z')
+    assert len(dl.digests) == 2  # bounded
+
+
 def test_saveload():
     tf = tempfile.NamedTemporaryFile(delete=False)
     name = tf.name
 
-    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1}}
+    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1},
+         'WARC': {'WARCDigestCacheSize': 2}}
     config.set_config(c)
     dl = datalayer.Datalayer()
     dl.add_seen(URL('http://example.com'))
     assert dl.seen(URL('http://example.com'))
+    dl.add_digest('sha1:AAAA', 'http://example.com', '2019-02-15T07:31:37Z')
 
     with open(name, 'wb') as f:
         dl.save(f)
     dl.add_seen(URL('http://example2.com'))
+    dl.add_digest('sha1:BBBB', 'http://example2.com', '2019-02-15T07:31:38Z')
     with open(name, 'rb') as f:
         dl.load(f)
 
     assert dl.seen(URL('http://example.com'))
     assert not dl.seen(URL('http://example2.com'))
+    assert dl.read_digest('sha1:AAAA') is not None
+    assert dl.read_digest('sha1:BBBB') is None
     os.unlink(name)
     assert not os.path.exists(name)
 
 
+def test_load_version1():
+    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1},
+         'WARC': {'WARCDigestCacheSize': 2}}
+    config.set_config(c)
+    dl = datalayer.Datalayer()
+    dl.add_digest('sha1:AAAA', 'http://example.com', '2019-02-15T07:31:37Z')
+
+    # a version 1 savefile, from before digests, followed by what the crawler saves next
+    f = io.BytesIO()
+    pickle.dump(datalayer.__NAME__, f)
+    pickle.dump(set([URL('http://example.com').surt]), f)
+    pickle.dump('next thing', f)
+    f.seek(0)
+
+    dl.load(f)
+    assert dl.seen(URL('http://example.com'))
+    assert dl.read_digest('sha1:AAAA') is None
+    assert pickle.load(f) == 'next thing'
+
+
 def test_summarize(capsys):
-    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1}}
+    c = {'Robots': {'RobotsCacheSize': 1, 'RobotsCacheTimeout': 1},
+         'WARC': {'WARCDigestCacheSize': 2}}
     config.set_config(c)
     dl = datalayer.Datalayer()
     dl.add_seen(URL('http://example.com'))
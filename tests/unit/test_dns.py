@@ -3,7 +3,12 @@ This test does talk to the network... that might be a little surprising
 for something that purports to be a unit test.
 '''
 
+import io
+import time
+import asyncio
+
 import pytest
+import aiodns
 
 import cocrawler.dns as dns
 from cocrawler.urls import URL
@@ -28,3 +33,213 @@ def test_entry_to_ip_key():
     result = '1.2.3.4,4.3.2.1,8.8.8.8'
     assert dns.entry_to_ip_key([addrs, None]) == result
     assert dns.entry_to_ip_key(None) is None
+
+
+class ScriptedResolver(dns.CoCrawler_Caching_AsyncResolver):
+    '''
+    Instead of talking to the network, answer from a list of results
+    '''
+    def __init__(self, results):
+        super().__init__()
+        self.results = results
+        self.lookups = 0
+        self.soa_minimum = None
+
+    async def actual_async_lookup(self, host, port=0, **kwargs):
+        self.lookups += 1
+        await asyncio.sleep(0.01)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        t = time.time()
+        return [{'host': result, 'port': port}], t + 100, t + 75, {}
+
+    async def actual_soa_lookup(self, domain):
+        return self.soa_minimum
+
+
+def force_refresh(resolver, host):
+    addrs, expires, refresh, host_geoip = resolver.get_cache_entry(host)
+    resolver._cache[host] = addrs, expires, time.time() - 1, host_geoip
+
+
+@pytest.mark.asyncio
+async def test_background_refresh():
+    config.config(None, None)
+    resolver = ScriptedResolver(['1.2.3.4', '5.6.7.8', OSError('refresh fails')])
+
+    addrs = await resolver.resolve('example.com', 80)
+    assert addrs[0]['host'] == '1.2.3.4'
+
+    # a refresh does not make us wait, and swaps in the new answer when it arrives
+    force_refresh(resolver, 'example.com')
+    addrs = await resolver.resolve('example.com', 80)
+    assert addrs[0]['host'] == '1.2.3.4'
+    addrs = await resolver.resolve('example.com', 80)
+    assert len(resolver._refresh_in_progress) == 1  # only one refresh at a time
+    await asyncio.sleep(0.05)
+    assert len(resolver._refresh_in_progress) == 0
+    assert resolver.lookups == 2
+    addrs = await resolver.resolve('example.com', 80)
+    assert addrs[0]['host'] == '5.6.7.8'
+
+    # a failed refresh keeps the stale entry
+    force_refresh(resolver, 'example.com')
+    await resolver.resolve('example.com', 80)
+    await asyncio.sleep(0.05)
+    addrs = await resolver.resolve('example.com', 80)
+    assert addrs[0]['host'] == '5.6.7.8'
+    assert resolver.lookups == 3
+    assert resolver.get_cache_entry('example.com')[2] > time.time()  # and waits before trying again
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_coalesce():
+    config.config(None, None)
+    resolver = ScriptedResolver(['1.2.3.4', OSError('Domain name not found')])
+
+    results = await asyncio.gather(*[resolver.resolve('example.com', 80) for _ in range(10)])
+    assert resolver.lookups == 1
+    assert all(addrs[0]['host'] == '1.2.3.4' for addrs in results)
+    assert len(resolver._lookups_in_flight) == 0
+
+    # failures are shared, too, and a cancelled waiter doesn't cancel the others
+    waiters = [asyncio.ensure_future(resolver.resolve('example.org', 80)) for _ in range(3)]
+    await asyncio.sleep(0)
+    waiters[0].cancel()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert all(isinstance(r, OSError) for r in results[1:])
+    assert resolver.lookups == 2
+    assert resolver.get_cache_entry('example.org') is None
+    await resolver.close()
+
+
+def dns_error(code, msg):
+    try:
+        raise aiodns.error.DNSError(code, msg)
+    except aiodns.error.DNSError as e:
+        try:
+            raise OSError(msg) from e
+        except OSError as oe:
+            return oe
+
+
+def test_failure_type():
+    assert dns.failure_type(dns_error(aiodns.error.ARES_ENOTFOUND, 'Domain name not found')) == 'nxdomain'
+    assert dns.failure_type(dns_error(aiodns.error.ARES_ESERVFAIL, 'Server failure')) == 'servfail'
+    assert dns.failure_type(dns_error(aiodns.error.ARES_ETIMEOUT, 'Timeout')) == 'timeout'
+    assert dns.failure_type(ValueError('no A records found')) == 'no A records'
+    assert dns.failure_type(dns.DNSFilteredError('no A records found after filtering')) == 'filtered-private'
+    assert dns.failure_type(OSError('DNS lookup failed')) == 'other'
+
+
+@pytest.mark.asyncio
+async def test_negative_cache():
+    config.config(None, None)
+    resolver = ScriptedResolver([dns_error(aiodns.error.ARES_ENOTFOUND, 'Domain name not found'),
+                                 dns_error(aiodns.error.ARES_ETIMEOUT, 'Timeout'),
+                                 '1.2.3.4'])
+    resolver.soa_minimum = 300
+
+    for _ in range(3):
+        with pytest.raises(OSError):
+            await resolver.resolve('dead.example.com', 80)
+    assert resolver.lookups == 1
+    expires, kind, _ = resolver.get_negative_entry('dead.example.com')
+    assert kind == 'nxdomain'
+    assert 290 < expires - time.time() <= 300  # SOA minimum, less than DNSNegativeTTL
+
+    assert await dns.prefetch(URL('http://dead.example.com/'), resolver) is None
+    assert resolver.lookups == 1
+
+    with pytest.raises(OSError):
+        await resolver.resolve('flaky.example.com', 80)
+    expires, kind, _ = resolver.get_negative_entry('flaky.example.com')
+    assert kind == 'timeout'
+    assert expires - time.time() <= 60
+
+    # once it expires, we look again
+    resolver._negative['flaky.example.com'] = (time.time() - 1, kind, (OSError, ('Timeout',)))
+    addrs = await resolver.resolve('flaky.example.com', 80)
+    assert addrs[0]['host'] == '1.2.3.4'
+    assert resolver.lookups == 3
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_negative_cache_retry():
+    config.config(None, None)
+    resolver = ScriptedResolver([dns_error(aiodns.error.ARES_ETIMEOUT, 'Timeout'),
+                                 dns_error(aiodns.error.ARES_ENOTFOUND, 'Domain name not found'),
+                                 '1.2.3.4'])
+    flaky = URL('http://flaky.example.com/')
+    dead = URL('http://dead.example.com/')
+
+    assert await dns.prefetch(flaky, resolver) is None
+    assert await dns.prefetch(flaky, resolver) is None
+    assert resolver.lookups == 1
+
+    # a permanent failure stays cached for retries
+    assert await dns.prefetch(dead, resolver) is None
+    assert await dns.prefetch(dead, resolver, retry=True) is None
+    assert resolver.lookups == 2
+
+    # a transient one is looked up again
+    entry = await dns.prefetch(flaky, resolver, retry=True)
+    assert entry[0][0]['host'] == '1.2.3.4'
+    assert resolver.lookups == 3
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_snapshot():
+    config.config(None, None)
+    resolver = ScriptedResolver(['1.2.3.4', '2001:db8::1', '5.6.7.8'])
+    for host in ('example.com', 'example.org', 'expired.example.com'):
+        await resolver.resolve(host, 80)
+    resolver.get_cache_entry('example.com')[3]['1.2.3.4'] = {'ip-asn': '15169', 'geoip-country': 'US'}
+    addrs, expires, refresh, host_geoip = resolver.get_cache_entry('expired.example.com')
+    resolver._cache['expired.example.com'] = addrs, time.time() - 1, refresh, host_geoip
+
+    f = io.BytesIO()
+    assert resolver.save(f) == 2
+    await resolver.close()
+
+    resolver2 = ScriptedResolver([])
+    f.seek(0)
+    assert resolver2.load(f) == 2
+    for host in ('example.com', 'example.org'):
+        entry, entry2 = resolver.get_cache_entry(host), resolver2.get_cache_entry(host)
+        assert dns.entry_to_as(entry2) == dns.entry_to_as(entry)
+        assert entry2[1:] == entry[1:]  # expires, refresh, host_geoip
+    assert resolver2.get_cache_entry('expired.example.com') is None
+    addrs = await resolver2.resolve('example.org', 443)
+    assert addrs[0]['host'] == '2001:db8::1' and addrs[0]['port'] == 443
+    assert resolver2.lookups == 0
+    await resolver2.close()
+
+    with pytest.raises(ValueError):
+        resolver2.load(io.BytesIO(b'not a snapshot'))
+
+
+@pytest.mark.asyncio
+async def test_expire():
+    config.config(None, None)
+    resolver = ScriptedResolver([])
+    t = time.time()
+    for i, host in enumerate(('a.example.com', 'b.example.com', 'c.example.com', 'd.example.com')):
+        resolver._set_entry(host, ([{'host': '1.2.3.4'}], t + 10 * i, t + 5 * i, {}))
+    # a newer answer for a: its old heap item is stale
+    resolver._set_entry('a.example.com', ([{'host': '1.2.3.4'}], t + 100, t + 75, {}))
+
+    assert resolver.expire(t + 25) == 2  # b and c
+    assert resolver.expire(t + 25) == 0
+    assert resolver.size() == 2
+    host, entry = resolver._cache.popitem()
+    assert host == 'd.example.com'  # LRU order is untouched
+    resolver._set_entry(host, entry)
+    assert resolver.expire(t + 1000) == 2
+    assert resolver._expiry_heap == []
+    await resolver.close()
@@ -0,0 +1,75 @@
+import asyncio
+
+import aiohttp
+import aiohttp.web
+import aiohttp.test_utils
+from multidict import CIMultiDict
+
+import cocrawler.fetcher as fetcher
+
+
+class FakeResponse:
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = CIMultiDict(headers)
+
+
+def test_header_policy():
+    hp = fetcher.header_policy
+    assert hp(FakeResponse(200, {'Content-Type': 'text/html; charset=utf-8'})) is None
+    assert hp(FakeResponse(200, {})) is None
+    assert hp(FakeResponse(200, {'Content-Type': 'image/jpeg'})) == 'content type'
+    assert hp(FakeResponse(200, {'Content-Type': 'application/pdf\r\n'})) == 'content type'
+
+    # redirs and errors are never aborted
+    assert hp(FakeResponse(301, {'Content-Type': 'image/jpeg'})) is None
+    assert hp(FakeResponse(404, {'Content-Type': 'image/jpeg'})) is None
+
+    big = FakeResponse(200, {'Content-Type': 'text/html', 'Content-Length': '2000'})
+    assert hp(big) is None
+    assert hp(big, max_content_length=1000) == 'content length'
+    assert hp(big, max_content_length=3000) is None
+    assert hp(FakeResponse(200, {'Content-Length': 'junk'}), max_content_length=1000) is None
+
+
+def test_trace_phases():
+    class Params:
+        class url:
+            scheme = 'https'
+
+    async def run(timings):
+        ctx = fetcher._TraceContext(trace_request_ctx=timings)
+        await fetcher._trace_request_start(None, ctx, Params)
+        for name, start_or_end in (('pool wait', 'start'), ('pool wait', 'end'),
+                                   ('connect', 'start'), ('dns', 'start'), ('dns', 'end'), ('connect', 'end'),
+                                   ('first byte', 'start'), ('first byte', 'end'),
+                                   ('dns', 'end')):  # an end without a start is ignored
+            await fetcher._trace_phase(name, start_or_end)(None, ctx, Params)
+
+    timings = {}
+    asyncio.run(run(timings))
+    assert sorted(timings.keys()) == ['connect tls', 'dns', 'first byte', 'pool wait']
+    assert all(v >= 0. for v in timings.values())
+
+
+def test_trace_redirects():
+    async def redirect(request):
+        await asyncio.sleep(0.1)
+        raise aiohttp.web.HTTPFound('/final')
+
+    async def final(request):
+        await asyncio.sleep(0.1)
+        return aiohttp.web.Response(text='hello')
+
+    async def run(timings):
+        app = aiohttp.web.Application()
+        app.router.add_get('/redirect', redirect)
+        app.router.add_get('/final', final)
+        async with aiohttp.test_utils.TestServer(app) as server:
+            async with aiohttp.ClientSession(trace_configs=[fetcher.trace_config()]) as session:
+                async with session.get(server.make_url('/redirect'), trace_request_ctx=timings) as response:
+                    assert await response.text() == 'hello'
+
+    timings = {}
+    asyncio.run(run(timings))
+    assert timings['first byte'] >= 0.2  # both hops
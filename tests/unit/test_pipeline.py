@@ -0,0 +1,54 @@
+import asyncio
+
+import cocrawler.config as config
+import cocrawler.pipeline as pipeline
+
+
+def make_job(n):
+    return pipeline.Job((n, 0., 'com,example)/{}'.format(n)))
+
+
+def make_handlers(seen):
+    async def double(job):
+        n = job.work[0]
+        seen.append(('double', n))
+        job.parsed = n * 2
+        return n != 3  # 3 stops here
+
+    async def check(job):
+        n = job.work[0]
+        seen.append(('check', n))
+        if n == 4:
+            raise ValueError('buggy stage')
+        return True
+
+    return [('dns', double), ('robots', check)]
+
+
+def test_run_sequentially():
+    seen = []
+    handlers = make_handlers(seen)
+    for n in (1, 3):
+        asyncio.run(pipeline.run_sequentially(make_job(n), handlers))
+    assert seen == [('double', 1), ('check', 1), ('double', 3)]
+
+
+def test_pipeline():
+    config.set_config({'Pipeline': {'QueueSize': 1, 'Concurrency': {'dns': 2, 'robots': 1}}})
+    seen = []
+    finished = []
+
+    async def main():
+        p = pipeline.Pipeline(make_handlers(seen), lambda job: finished.append((job.work[0], job.parsed)))
+        p.start()
+        for n in range(1, 6):
+            await p.feed(make_job(n))
+        await asyncio.wait_for(p.join(), 5)
+        assert p.in_flight == 0
+        p.cancel()
+
+    asyncio.run(main())
+    # every job is finished exactly once, whatever stage it ended at
+    assert sorted(finished) == [(n, n*2) for n in range(1, 6)]
+    assert ('check', 3) not in seen
+    assert len([s for s in seen if s[0] == 'check']) == 4
@@ -0,0 +1,52 @@
+import asyncio
+
+from aiohttp.client_reqrep import ConnectionKey
+
+import cocrawler.pool as pool
+import cocrawler.config as config
+
+
+def test_key_to_surt_host():
+    assert pool.key_to_surt_host('www.example.com', 80, False) == 'com,example'
+    assert pool.key_to_surt_host('example.com', 443, True) == 'com,example'
+    assert pool.key_to_surt_host('example.com', 8080, False) == 'com,example,:8080'
+
+
+def test_connector_kwargs():
+    config.set_config({'Crawl': {'MaxHostQPS': 2.5}, 'Fetcher': {'KeepAliveTimeout': 15.}})
+    assert pool.connector_kwargs() == {'limit_per_host': 3, 'keepalive_timeout': 15.}
+    config.set_config({'Crawl': {'MaxHostQPS': 0.1},
+                       'Fetcher': {'KeepAliveTimeout': 5., 'MaxHostConnections': 4}})
+    assert pool.connector_kwargs() == {'limit_per_host': 4, 'keepalive_timeout': 5.}
+
+
+class FakeProtocol:
+    should_close = False
+    transport = None
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def is_connected(self):
+        return not self.closed
+
+
+def test_release_policy():
+    def key(host):
+        return ConnectionKey(host, 80, False, None, None, None, None)
+
+    async def run():
+        conn = pool.PolicyConnector(host_has_work=lambda surt_host: surt_host == 'com,busy')
+        busy, idle = FakeProtocol(), FakeProtocol()
+        conn._release(key('busy.com'), busy)
+        conn._release(key('idle.com'), idle)
+        assert not busy.closed
+        assert idle.closed
+        assert key('busy.com') in conn._conns
+        assert key('idle.com') not in conn._conns
+        await conn.close()
+
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+import gzip
+from types import SimpleNamespace
+
+from multidict import CIMultiDict
+
+import cocrawler.post_fetch as post_fetch
+import cocrawler.stats as stats
+from cocrawler.urls import URL
+
+
+def fetcher_response(body_bytes, is_truncated=False, **headers):
+    response = SimpleNamespace(headers=CIMultiDict(headers))
+    return SimpleNamespace(response=response, body_bytes=body_bytes, is_truncated=is_truncated)
+
+
+crawler = SimpleNamespace(content_model=None, warcwriter=None, warc_non_html=False)
+
+
+def test_post_2xx_decode():
+    url = URL('http://example.com/')
+    body = b'<html><body>hello</body></html>'
+
+    json_log = {}
+    f = fetcher_response(gzip.compress(body), **{'Content-Type': 'text/html; charset=utf-8',
+                                                  'Content-Encoding': 'gzip'})
+    decoded, decoded_bytes = post_fetch.post_2xx_decode(f, url, json_log, crawler)
+    assert decoded == body.decode()
+    assert decoded_bytes == body
+
+
+def test_post_2xx_decode_policy_abort():
+    url = URL('http://example.com/')
+    json_log = {}
+    f = fetcher_response(b'', is_truncated='policy', **{'Content-Type': 'text/html',
+                                                        'Content-Encoding': 'gzip'})
+    failures = stats.stat_value('content-encoding gzip fail') or 0
+    assert post_fetch.post_2xx_decode(f, url, json_log, crawler) is None
+    assert json_log['comment'] == 'body not fetched by header policy'
+    assert (stats.stat_value('content-encoding gzip fail') or 0) == failures
@@ -0,0 +1,50 @@
+import pytest
+
+from cocrawler.warc import CCWARCWriter
+import cocrawler.replay as replay
+from cocrawler.urls import URL
+import cocrawler.fetcher as fetcher
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+needs_zstd = pytest.mark.skipif(zstandard is None, reason='zstandard is not installed')
+
+
+def write_warc(directory, **kwargs):
+    writer = CCWARCWriter(str(directory.join('REPLAY-TEST')), 1000000, **kwargs)
+    writer.create_default_info('1.0', '0.99', '127.0.0.1')
+    req_headers = [('Host', 'example.com')]
+    resp_headers = [(b'Content-Type', b'text/html'), (b'Transfer-Encoding', b'chunked')]
+    date = writer.write_request_response_pair('http://example.com/', '1.2.3.4', req_headers,
+                                              resp_headers, False, b'<html>Hello</html>')
+    writer.write_request_revisit_pair('http://example.com/copy', '1.2.3.4', req_headers,
+                                      resp_headers, 18, 'sha1:UNUSED', 'http://example.com/', date)
+    writer.close()
+    return writer.filename
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('kwargs', [{}, {'gzip': False}, {'cdxj': True},
+                                    pytest.param({'zstd': True}, marks=needs_zstd)])
+async def test_replay(tmpdir, kwargs):
+    write_warc(tmpdir, **kwargs)
+    session = replay.ReplaySession(str(tmpdir))
+
+    f = await fetcher.fetch(URL('http://example.com/'), session, max_page_size=1000)
+    assert f.response.status == 200
+    assert f.body_bytes == b'<html>Hello</html>'
+    assert f.response.headers['content-type'] == 'text/html'
+    assert 'transfer-encoding' not in f.response.headers
+
+    f = await fetcher.fetch(URL('http://example.com/copy'), session, max_page_size=1000)
+    assert f.body_bytes == b'<html>Hello</html>'
+
+    f = await fetcher.fetch(URL('http://example.com/'), session, max_page_size=5)
+    assert f.body_bytes == b'<html'
+    assert f.is_truncated == 'length'
+
+    f = await fetcher.fetch(URL('http://example.com/missing'), session, max_page_size=1000)
+    assert f.response.status == 404
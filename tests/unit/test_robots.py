@@ -1,7 +1,12 @@
+import asyncio
+
 import pytest
 
 import cocrawler.robots as robots
 from cocrawler.robots import is_plausible_robots, robots_facets
+import cocrawler.config as config
+import cocrawler.stats as stats
+from cocrawler.urls import URL
 
 
 def test_robots_facets():
@@ -52,3 +57,85 @@ def test_magic():
     # magic is 3 milliseconds of cpu burn/call so this is currently comented out in robots.py
     robots_txt = b'%PDF-1.3\n'
     assert not is_plausible_robots(robots_txt)
+
+
+class CountingRobots(robots.Robots):
+    def __init__(self, result):
+        super().__init__('cocrawler', None, None)
+        self.result = result
+        self.fetches = 0
+
+    async def _fetch_robots(self, schemenetloc, dns_entry, crawler, seed_host=None, get_kwargs={}):
+        self.fetches += 1
+        await asyncio.sleep(0.1)
+        return self.result
+
+
+def test_fetch_robots_coalesced():
+    config.config(None, None)
+
+    async def main(result):
+        r = CountingRobots(result)
+        results = await asyncio.gather(*[r.fetch_robots('http://example.com', None, None) for _ in range(10)])
+        assert r.fetches == 1
+        assert results == [result] * 10
+        assert r.in_progress == {}
+
+        # a cancelled waiter doesn't cancel the fetch for the others
+        tasks = [asyncio.ensure_future(r.fetch_robots('http://example.com', None, None)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        tasks[0].cancel()
+        assert await asyncio.gather(*tasks[1:]) == [result] * 2
+        assert r.fetches == 2
+
+    c0 = stats.stat_value('robots fetch coalesced') or 0
+    f0 = stats.stat_value('robots fetch coalesced then failed') or 0
+    asyncio.run(main('parsed robots'))
+    assert stats.stat_value('robots fetch coalesced') == c0 + 11
+    asyncio.run(main(None))
+    assert stats.stat_value('robots fetch coalesced then failed') == f0 + 11
+
+
+class FakeDatalayer:
+    def __init__(self):
+        self.robots = {}
+
+    def cache_robots(self, schemenetloc, parsed):
+        self.robots[schemenetloc] = parsed
+
+    def read_robots_cache(self, schemenetloc):
+        return self.robots[schemenetloc]
+
+
+def test_robots_prefetcher():
+    config.config(None, None)
+
+    async def main():
+        r = robots.Robots('cocrawler', None, FakeDatalayer())
+        fetched = []
+
+        async def fetch(url, seed_host):
+            fetched.append((url.url, seed_host))
+            await asyncio.sleep(0.05)
+            if 'bad' not in url.url:
+                r.datalayer.cache_robots(url.urlsplit.scheme + '://' + url.urlsplit.netloc, 'parsed robots')
+
+        p = robots.RobotsPrefetcher(r, fetch, concurrency=2, queue_size=2)
+        assert p.want(URL('http://example.com/a'), seed_host='example.com')
+        assert p.want(URL('http://example.com/b'))  # pending
+        assert p.want(URL('http://bad.example.com/'))
+        assert not p.want(URL('http://full.example.com/'))  # queue full
+        notified = []
+        p.notify('http://example.com', lambda: notified.append(p.pending('http://example.com')))
+        p.start()
+        await asyncio.sleep(0.2)
+        assert notified == [False]
+
+        assert sorted(fetched) == [('http://bad.example.com/', None),
+                                   ('http://example.com/a', 'example.com')]
+        assert not p.want(URL('http://example.com/c'))  # known
+        assert not p.want(URL('http://bad.example.com/'))  # tried once, workers fetch it now
+        assert p.want(URL('http://full.example.com/'))
+        p.cancel()
+
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+from cocrawler.robots_matcher import CompiledRobots, normalize
+
+
+def allowed(text, path, agent='foo'):
+    return CompiledRobots(text, agents=('foo', 'googlebot', '*')).allowed(path, agent)
+
+
+def test_normalize():
+    assert normalize('/a/b?c=d') == '/a/b?c=d'
+    assert normalize('/%7e') == normalize('/%7E') == normalize('/~') == '/~'
+    assert normalize('/é') == normalize('/%c3%a9') == '/%C3%A9'
+    assert normalize('/a b') == normalize('/a%20b')
+    assert normalize('/%zz') == '/%25zz'
+
+
+def test_groups():
+    text = 'User-Agent: foo\nAllow: /\n# comment\nDisallow: /\nDisallow: /disallowed\n'
+    assert allowed(text, '/')
+    assert not allowed(text, '/disallowed')
+    assert allowed(text, '/disallowed', 'bar')  # no * group
+    assert allowed(text, '/disallowed', 'foobar')  # exact agent match only
+    assert not allowed(text, '/disallowed', 'FOO')
+
+    # blank lines don't end a group, and groups for the same agent are merged
+    text = 'User-agent: *\nDisallow: /a\n\nUser-agent: foo\nDisallow: /b\n\nUser-agent: foo\nDisallow: /c\n'
+    assert allowed(text, '/a')
+    assert not allowed(text, '/b')
+    assert not allowed(text, '/c')
+    assert not allowed(text, '/a', 'bar')
+
+    # several agents in one group, directives before any agent are for *
+    text = 'Disallow: /x\nUser-agent: a\nUser-agent: b\nDisallow: /y\nUser-agent: c\n'
+    assert not allowed(text, '/y', 'a')
+    assert not allowed(text, '/y', 'b')
+    assert allowed(text, '/x', 'b')
+    assert allowed(text, '/y', 'c')  # a group with no rules allows everything
+    assert not allowed(text, '/x', 'd')
+
+    # any other line ends a run of user-agents
+    text = 'User-agent: foo\nCrawl-delay: 5\nUser-agent: bar\nDisallow: /a\n'
+    assert allowed(text, '/a', 'foo')
+    assert not allowed(text, '/a', 'bar')
+
+
+def test_precedence():
+    assert not allowed('User-agent: *\nDisallow: /a\nAllow: /ab\n', '/a')
+    assert allowed('User-agent: *\nDisallow: /a\nAllow: /ab\n', '/abc')
+    # same length: first one listed wins, like reppy
+    assert not allowed('User-agent: *\nDisallow: /a\nAllow: /a\n', '/a')
+    assert allowed('User-agent: *\nAllow: /a\nDisallow: /a\n', '/a')
+    # empty Disallow: is ignored
+    assert not allowed('User-agent: *\nDisallow: /a\nDisallow:\n', '/a')
+    assert allowed('User-agent: *\nDisallow:\n', '/a')
+    # trailing *s don't count
+    assert allowed('User-agent: *\nDisallow: /a*\nAllow: /a/\n', '/a/x')
+    assert not allowed('User-agent: *\nDisallow: /a*\nAllow: /a/\n', '/ab')
+    assert not allowed('User-agent: *\nDisallow: /a**b\nAllow: /a*\n', '/aXb')
+
+
+def test_wildcards():
+    text = 'User-agent: *\nDisallow: /*.php$\nAllow: /x\nDisallow: /*?*sort=\n'
+    assert not allowed(text, '/a.php')
+    assert allowed(text, '/a.php?x=1')
+    assert allowed(text, '/a.phpx')
+    assert not allowed(text, '/x.php')
+    assert not allowed(text, '/list?page=2&sort=price')
+    assert allowed(text, '/list?page=2')
+    assert allowed(text, '/xsort=')
+
+    assert not allowed('User-agent: *\nDisallow: /$\n', '/')
+    assert allowed('User-agent: *\nDisallow: /$\n', '/a')
+    assert not allowed('User-agent: *\nDisallow: *x\n', '/ax')
+    assert not allowed('User-agent: *\nDisallow: /*\n', '/')
+
+
+def test_paths():
+    text = 'User-agent: *\nDisallow: /\n'
+    assert allowed(text, '/robots.txt')
+    assert not allowed(text, '')
+    assert not allowed(text, '/?a=b')
+
+    text = 'User-agent: *\nDisallow: /a%2fb\nDisallow: /c%7e\nDisallow: /é\nDisallow: /A\n'
+    for path in ('/a%2Fb', '/a/b', '/c~', '/c%7E', '/%C3%A9', '/é', '/A'):
+        assert not allowed(text, path), path
+    assert allowed(text, '/a')
+    assert allowed(text, '/a/./b')  # no dot-segment normalization
+
+
+def test_sitemaps():
+    c = CompiledRobots('User-agent: *\nDisallow: /a\nSitemap: http://x/s.xml\nsitemap: http://x/t.xml\n')
+    assert c.sitemaps == ['http://x/s.xml', 'http://x/t.xml']
+
+
+def test_shared_rulesets():
+    c = CompiledRobots('User-agent: *\nDisallow: /a\nUser-agent: foo\nDisallow: /b\n', agents=('Foo', 'googlebot', '*'))
+    assert c.ruleset('googlebot') is c.ruleset('*')
+    assert c.ruleset('Foo') is c.ruleset('foo')
+    assert c.ruleset('foo') is not c.ruleset('*')
+
+
+def test_decision_cache():
+    text = 'User-agent: *\nDisallow: /ab\nAllow: /abc\n'
+    c = CompiledRobots(text, cache_size=2)
+    ruleset = c.ruleset('*')
+    assert c.allowed('/abcdef', '*')
+    assert not c.allowed('/abx', '*')
+    assert list(ruleset.cache) == ['/abc', '/abx']  # keyed by the prefix, as long as the longest rule
+    assert c.allowed('/abcxyz', '*')  # a hit
+    assert list(ruleset.cache) == ['/abx', '/abc']
+    assert c.allowed('/b', '*')
+    assert list(ruleset.cache) == ['/abc', '/b']
+
+    # a %-escape in the prefix can decode to something shorter, so those are cached by the whole path
+    assert not c.allowed('/%61b', '*')
+    assert c.allowed('/%61bc', '*')
+    assert ('/%61bc',) in ruleset.cache
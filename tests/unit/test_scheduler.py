@@ -0,0 +1,74 @@
+import asyncio
+
+import cocrawler.config as config
+import cocrawler.scheduler as scheduler
+import cocrawler.slowhost as slowhost
+from cocrawler.urls import URL
+
+
+class FakeRobots:
+    def check_cached(self, url, quiet=False):
+        if '/denied' in url.url:
+            return 'denied'
+
+
+def make_scheduler(urls, lane_size=1):
+    config.config(None, None)
+    slowhosts = slowhost.SlowHosts(lane_size=lane_size, last_byte=1.0)
+    s = scheduler.Scheduler(FakeRobots(), None, slowhosts=slowhosts)
+    s.use_ip_key = False
+    s.delta_t = 0.
+    for i, u in enumerate(urls):
+        url = URL(u)
+        s.set_ridealong(url.surt, {'url': url})
+        s.queue_work((1, i/10, url.surt))
+    return s, slowhosts
+
+
+async def get_work(s):
+    try:
+        work = await asyncio.wait_for(s.get_work(), 0.1)
+    except asyncio.TimeoutError:
+        return
+    s.work_done()
+    return work[2]
+
+
+def test_slow_lane_parked_behind_robots_denied():
+    async def main():
+        s, slowhosts = make_scheduler(['http://slow.com/a', 'http://slow.com/denied', 'http://slow.com/c'])
+        slowhosts.record('com,slow', 0.5, 1.5)
+
+        assert await get_work(s) == 'com,slow)/a'
+        assert await get_work(s) is None  # the other two are parked
+        assert s.parked_count == 2
+
+        slowhosts.release('com,slow)/a')
+        # denied never takes a slot, so c has to be unparked without a release
+        assert await get_work(s) == 'com,slow)/denied'
+        assert await get_work(s) == 'com,slow)/c'
+        assert s.parked_count == 0
+        assert s.done(0)
+
+    asyncio.run(main())
+
+
+def test_slow_lane_parked_behind_reclassified():
+    async def main():
+        s, slowhosts = make_scheduler(['http://slow.com/a', 'http://slow.com/b', 'http://slow.com/c'])
+        slowhosts.record('com,slow', 0.5, 1.5)
+
+        assert await get_work(s) == 'com,slow)/a'
+        assert await get_work(s) is None
+        assert s.parked_count == 2
+
+        # the host is fast now, so b and c go in the fast lane
+        slowhosts.alpha = 1.0
+        slowhosts.record('com,slow', 0.1, 0.1)
+        slowhosts.release('com,slow)/a')
+        assert await get_work(s) == 'com,slow)/b'
+        assert await get_work(s) == 'com,slow)/c'
+        assert s.parked_count == 0
+        assert slowhosts.occupancy == {'fast': 2, 'slow': 0}
+
+    asyncio.run(main())
@@ -0,0 +1,186 @@
+import gzip
+import zlib
+import asyncio
+import calendar
+from types import SimpleNamespace
+
+import cocrawler.sitemap as sitemap
+from cocrawler.sitemap import SitemapParser, parse_lastmod, parse_priority, hints_to_rand
+import cocrawler.config as config
+from cocrawler.urls import URL
+
+urlset = b'''<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+<url><loc>http://example.com/a</loc><lastmod>2019-05-01</lastmod><priority>0.8</priority></url>
+<url><loc>/b</loc></url>
+<url><loc>ftp://example.com/c</loc></url>
+<url><loc> http://example.com/d </loc><priority>high</priority></url>
+</urlset>
+'''
+
+index = b'''\xef\xbb\xbf<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+<sitemap><loc>http://example.com/s1.xml.gz</loc></sitemap>
+<sitemap><loc>http://example.com/s2.txt</loc></sitemap>
+</sitemapindex>
+'''
+
+
+def parse_all(data, block=None, **kwargs):
+    p = SitemapParser(base_url='http://example.com/sitemap.xml', **kwargs)
+    entries = []
+    block = block or len(data) or 1
+    for i in range(0, len(data), block):
+        entries.extend(p.feed(data[i:i+block]))
+    entries.extend(p.close())
+    return p, entries
+
+
+def test_urlset():
+    for block in (None, 1, 7):
+        p, entries = parse_all(urlset, block=block)
+        assert p.kind == 'xml'
+        assert [(e.kind, e.loc.url) for e in entries] == [('url', 'http://example.com/a'),
+                                                          ('url', 'http://example.com/b'),
+                                                          ('url', 'http://example.com/d')]
+        assert entries[0].lastmod == calendar.timegm((2019, 5, 1, 0, 0, 0))
+        assert entries[0].priority == 0.8
+        assert entries[1].lastmod is None and entries[1].priority is None
+        assert entries[2].priority is None
+
+
+def test_index_and_bom():
+    p, entries = parse_all(index, block=5)
+    assert [(e.kind, e.loc.url) for e in entries] == [('sitemap', 'http://example.com/s1.xml.gz'),
+                                                      ('sitemap', 'http://example.com/s2.txt')]
+
+
+def test_text():
+    text = b'http://example.com/a\r\n\nnot a url\nhttps://example.com/b'
+    p, entries = parse_all(text, block=3)
+    assert p.kind == 'text'
+    assert [e.loc.url for e in entries] == ['http://example.com/a', 'https://example.com/b']
+
+
+def test_compressed():
+    expected = ['http://example.com/a', 'http://example.com/b', 'http://example.com/d']
+
+    # a .xml.gz file, noticed by the magic number
+    p, entries = parse_all(gzip.compress(urlset), block=10)
+    assert [e.loc.url for e in entries] == expected
+
+    # http content-encoding, with and without a .gz inside
+    p, entries = parse_all(gzip.compress(urlset), content_encoding='gzip')
+    assert [e.loc.url for e in entries] == expected
+    p, entries = parse_all(gzip.compress(gzip.compress(urlset)), block=3, content_encoding='gzip')
+    assert [e.loc.url for e in entries] == expected
+    p, entries = parse_all(zlib.compress(urlset), content_encoding='deflate')
+    assert [e.loc.url for e in entries] == expected
+
+    p, entries = parse_all(b'\x1f\x8bnot really gzip')
+    assert p.error and not entries
+
+
+def test_bounded():
+    url = b'<url><loc>http://example.com/%d</loc></url>\n'
+    body = b'<urlset>' + b''.join(url % i for i in range(20000)) + b'</urlset>'
+    p = SitemapParser()
+    count = 0
+    for i in range(0, len(body), 65536):
+        count += len(p.feed(body[i:i+65536]))
+        assert len(p.root) <= 1  # finished elements are thrown away
+    count += len(p.close())
+    assert count == 20000
+
+    # a gzip bomb stops at max_size
+    p, entries = parse_all(gzip.compress(b'<urlset>' + b' ' * 10000000), max_size=100000)
+    assert p.truncated
+    assert p.size <= 100000 + 65536
+
+
+def test_empty_hints():
+    p, entries = parse_all(b'<urlset><url><loc>/a</loc><lastmod/><priority></priority></url></urlset>')
+    assert len(entries) == 1
+    assert entries[0].lastmod is None and entries[0].priority is None
+    hints_to_rand(entries[0].priority, entries[0].lastmod)
+
+
+def test_parse_errors():
+    p, entries = parse_all(urlset[:200] + b'<<<' + urlset[200:])
+    assert p.error
+    assert [e.loc.url for e in entries] == ['http://example.com/a']
+
+    p, entries = parse_all(b'')
+    assert not entries and not p.error
+
+
+def test_hints():
+    assert parse_lastmod('2019') == calendar.timegm((2019, 1, 1, 0, 0, 0))
+    assert parse_lastmod('2019-05-01T12:30:15Z') == calendar.timegm((2019, 5, 1, 12, 30, 15))
+    assert parse_lastmod('2019-05-01T12:30:15.5+02:00') == calendar.timegm((2019, 5, 1, 10, 30, 15))
+    assert parse_lastmod('2019-05-01T12:30-05:00') == calendar.timegm((2019, 5, 1, 17, 30, 0))
+    assert parse_lastmod('yesterday') is None
+    assert parse_lastmod('2019-13-45') is None
+
+    assert parse_priority('0.3') == 0.3
+    assert parse_priority('7') == 1.0
+    assert parse_priority('') is None
+
+    now = calendar.timegm((2020, 1, 1, 0, 0, 0))
+    assert hints_to_rand() == 0.5
+    assert hints_to_rand(priority=1.0, lastmod=now, now=now) == 0.
+    assert hints_to_rand(priority=0., lastmod=0, now=now) == 0.99999
+    assert hints_to_rand(priority=0.9) < hints_to_rand(priority=0.1)
+    assert hints_to_rand(lastmod=now - 86400, now=now) < hints_to_rand(lastmod=now - 300 * 86400, now=now)
+
+
+class FakeCrawler:
+    ua = 'cocrawler-test'
+    prevent_compression = False
+    upgrade_insecure_requests = False
+    session = None
+    resolver = None
+    spool_size = None
+
+    def __init__(self):
+        self.added = []
+
+    def add_urls(self, priority, batch):
+        self.added.append((priority, [ridealong['url'].url for ridealong, rand in batch]))
+        return len(batch)
+
+
+def test_ingest(monkeypatch):
+    config.config(None, None)
+    bodies = {'http://example.com/s.txt': b'http://example.com/a\nhttp://example.com/b\nhttp://other.example.com/c',
+              'http://example.com/s.xml': urlset,
+              'http://example.com/index.xml': index}
+
+    async def fetch(url, session, **kwargs):
+        response = SimpleNamespace(status=200, url=url.url, headers={})
+        return SimpleNamespace(response=response, body_bytes=bodies[url.url], last_exception=None)
+
+    async def prefetch(url, resolver):
+        return True
+
+    monkeypatch.setattr(sitemap.fetcher, 'fetch', fetch)
+    monkeypatch.setattr(sitemap.dns, 'prefetch', prefetch)
+
+    async def main():
+        crawler = FakeCrawler()
+        s = sitemap.Sitemaps(crawler, max_urls_per_host=2)
+
+        # a short body with no trailing newline, smaller than a batch
+        await s.ingest(URL('http://example.com/s.txt'), None, 0)
+        assert crawler.added == [(2, ['http://example.com/a', 'http://example.com/b', 'http://other.example.com/c'])]
+
+        # example.com is already at the host cap
+        crawler.added = []
+        await s.ingest(URL('http://example.com/s.xml'), None, 0)
+        assert crawler.added == []
+
+        await s.ingest(URL('http://example.com/index.xml'), 'example.com', 0)
+        assert s.q.qsize() == 2
+        url, seed_host, depth = s.q.get_nowait()
+        assert (url.url, seed_host, depth) == ('http://example.com/s1.xml.gz', 'example.com', 1)
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+import cocrawler.fetcher as fetcher
+import cocrawler.slowhost as slowhost
+import cocrawler.stats as stats
+
+
+def response(t_first_byte, t_last_byte, last_exception=None):
+    return fetcher.FetcherResponse(None, b'x', None, None, t_first_byte, t_last_byte,
+                                   False, last_exception, {})
+
+
+def test_classify():
+    s = slowhost.SlowHosts(first_byte=2.0, last_byte=10.0, alpha=0.5)
+    s.record('com,example', 0.1, 0.2)
+    assert not s.is_slow('com,example')
+    s.record('com,example', 0.1, 30.)
+    assert s.is_slow('com,example')  # average last byte is 15
+    s.record('com,example', 0.1, 0.2)
+    s.record('com,example', 0.1, 0.2)
+    assert not s.is_slow('com,example')
+
+    s.record('com,tarpit', 3.0, 3.0)
+    assert s.is_slow('com,tarpit')
+
+    s.record('com,timeout', 0.1, 0.2)
+    s.record('com,timeout', 1., 1., timeout=True)
+    assert not s.is_slow('com,timeout')
+    s.record('com,timeout', 1., 1., timeout=True)
+    assert s.is_slow('com,timeout')  # timeout rate 0.75
+
+
+def test_lane():
+    s = slowhost.SlowHosts(lane_size=2, last_byte=1.0)
+    s.record('com,slow', 0.5, 1.5)
+
+    assert s.has_room('com,fast')
+    for i in range(2):
+        assert s.has_room('com,slow')
+        s.admit('com,slow)/{}'.format(i), 'com,slow')
+    assert not s.has_room('com,slow')
+    s.admit('com,fast)/', 'com,fast')
+    assert s.has_room('com,fast')
+    assert s.occupancy == {'fast': 1, 'slow': 2}
+
+    released = []
+    s.released = lambda: released.append(1)
+    assert s.fetched('com,slow)/0', 'com,slow', response('0.5', '1.5'), 1.5) == 'slow'
+    assert released == [1]
+    assert s.has_room('com,slow')
+    assert s.release('com,slow)/0') is None  # already released
+    assert s.release('com,slow)/1') == 'slow'
+    assert s.fetched('com,fast)/', 'com,fast', response(None, None, 'TimeoutError'), 30.) == 'fast'
+    assert s.is_slow('com,fast')
+    assert s.occupancy == {'fast': 0, 'slow': 0}
+    assert stats.stat_value('slow host lane fetches') == 1
+    assert stats.stat_value('slow host lane max occupancy') == 2
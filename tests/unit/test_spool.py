@@ -0,0 +1,51 @@
+import hashlib
+import pickle
+
+import pytest
+
+import cocrawler.spool as spool
+
+
+def test_in_memory():
+    s = spool.SpooledBody(spool_size=100)
+    s.write(b'hello, ')
+    s.write(b'world')
+    assert len(s) == 12
+    buf = s.getbuffer()
+    assert isinstance(buf, bytes)
+    assert buf == b'hello, world'
+
+
+def test_spooled():
+    s = spool.SpooledBody(spool_size=10)
+    s.write(b'x' * 8)
+    assert s.f is None
+    s.write(b'y' * 8)
+    s.write(b'z' * 8)
+    assert s.f is not None
+    buf = s.getbuffer()
+    assert isinstance(buf, memoryview)
+    assert len(buf) == 24
+    assert buf == b'x' * 8 + b'y' * 8 + b'z' * 8
+    assert hashlib.sha1(buf).hexdigest() == hashlib.sha1(b'x' * 8 + b'y' * 8 + b'z' * 8).hexdigest()
+    assert str(buf[:8], 'utf-8') == 'x' * 8
+
+    with pytest.raises(TypeError):
+        pickle.dumps(buf)
+    assert pickle.loads(pickle.dumps(spool.tobytes(buf))) == b'x' * 8 + b'y' * 8 + b'z' * 8
+
+
+def test_never_spool():
+    s = spool.SpooledBody()
+    s.write(b'x' * 100000)
+    assert s.f is None
+
+
+def test_buffer_reader():
+    r = spool.BufferReader(memoryview(b'abcdefg'))
+    assert r.read(3) == b'abc'
+    assert r.tell() == 3
+    assert r.read() == b'defg'
+    assert r.read(3) == b''
+    r.seek(1)
+    assert r.read(2) == b'bc'
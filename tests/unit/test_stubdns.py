@@ -0,0 +1,53 @@
+import pytest
+
+import cocrawler.config as config
+import cocrawler.dns as dns
+import cocrawler.stubdns as stubdns
+
+
+def find(nxdomain, server, count=100):
+    for i in range(count):
+        name = 'host{}.example.com'.format(i)
+        if server.is_nxdomain(name) == nxdomain:
+            return name
+
+
+@pytest.mark.asyncio
+async def test_stubdns():
+    config.config(None, None)
+    server = await stubdns.start(ttl=7200, negative_ttl=120, nxdomain_rate=0.5)
+    resolver = dns.CoCrawler_Caching_AsyncResolver(nameservers=['127.0.0.1'], udp_port=server.port,
+                                                   tries=1, timeout=1.)
+
+    good = find(False, server)
+    addrs = await resolver.resolve(good, 80)
+    assert [a['host'] for a in addrs] == [stubdns.address_for(good)]
+    await resolver.resolve(good, 80)
+    assert server.queries == 1
+
+    bad = find(True, server)
+    with pytest.raises(OSError):
+        await resolver.resolve(bad, 80)
+    _, kind, _ = resolver.get_negative_entry(bad)
+    assert kind == 'nxdomain'
+
+    assert await resolver.actual_soa_lookup('example.com') == 120
+    assert server.answers['nxdomain'] >= 1
+
+    server.servfail_rate = 1.0
+    with pytest.raises(OSError):
+        await resolver.resolve('servfail.example.com', 80)
+    _, kind, _ = resolver.get_negative_entry('servfail.example.com')
+    assert kind == 'servfail'
+
+    await resolver.close()
+    server.close()
+
+
+def test_parse_question():
+    question = stubdns.encode_name('www.Example.com') + b'\0\1\0\1'
+    data = b'\x12\x34\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00' + question
+    qid, flags, name, qtype, qclass, end = stubdns.parse_question(data)
+    assert (qid, name, qtype, qclass, end) == (0x1234, 'www.Example.com', 1, 1, len(data))
+    with pytest.raises(ValueError):
+        stubdns.parse_question(data[:20])
@@ -0,0 +1,61 @@
+import asyncio
+import shutil
+import ssl
+import subprocess
+
+import pytest
+
+import cocrawler.tls as tls
+import cocrawler.stats as stats
+
+
+@pytest.fixture
+def cert(tmp_path):
+    if shutil.which('openssl') is None:
+        pytest.skip('needs the openssl command')
+    certfile = str(tmp_path / 'cert.pem')
+    keyfile = str(tmp_path / 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost',
+                    '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def test_session_resumption(cert):
+    certfile, keyfile = cert
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(certfile, keyfile)
+    client_context = tls.create_default_context(cafile=certfile, size=10)
+
+    async def handle(reader, writer):
+        writer.write(b'hello\n')
+        await writer.drain()
+        writer.close()
+
+    async def fetch(port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, ssl=client_context,
+                                                       server_hostname='localhost')
+        line = await reader.readline()
+        resumed = writer.get_extra_info('ssl_object').session_reused
+        writer.close()
+        return line, resumed
+
+    async def run():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0, ssl=server_context)
+        port = server.sockets[0].getsockname()[1]
+        results = [await fetch(port) for _ in range(3)]
+        server.close()
+        await server.wait_closed()
+        return results
+
+    stats.clear()
+    results = asyncio.run(run())
+    assert [line for line, _ in results] == [b'hello\n'] * 3
+    assert [resumed for _, resumed in results] == [False, True, True]
+    assert stats.stat_value('tls session cache miss') == 1
+    assert stats.stat_value('tls session cache hit') == 2
+    assert stats.stat_value('tls session resumed') == 2
+    _, count = stats.burn_values('tls handshake')
+    assert count == 3
+    assert 'localhost' in client_context.sessions
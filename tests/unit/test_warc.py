@@ -0,0 +1,127 @@
+import os
+import gzip
+import struct
+
+import pytest
+
+from cocrawler.warc import CCWARCWriter, payload_digest
+import cocrawler.cdxj as cdxj
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+needs_zstd = pytest.mark.skipif(zstandard is None, reason='zstandard is not installed')
+
+
+def write_some(writer):
+    writer.create_default_info('1.0', '0.99', '127.0.0.1')
+    resp_headers = [(b'Content-Type', b'text/html; charset=UTF-8')]
+    for i in range(3):
+        writer.write_request_response_pair('http://example.com/{}'.format(i), '1.2.3.4', [('Host', 'example.com')],
+                                           resp_headers, False, b'<html>Hello, world!</html>')
+    writer.close()
+
+
+def test_payload_digest(tmpdir, monkeypatch):
+    assert payload_digest(b'') == 'sha1:3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ'
+
+    # the writer uses the digest we hand it, and it matches what warcio would compute
+    monkeypatch.chdir(tmpdir)
+    writer = CCWARCWriter('DIGEST-TEST', 1000000, cdxj=True, gzip=False)
+    writer.create_default_info('1.0', '0.99', '127.0.0.1')
+    payload = b'<html>Hello, world!</html>'
+    writer.write_request_response_pair('http://example.com/', '1.2.3.4', [('Host', 'example.com')],
+                                       [(b'Content-Type', b'text/html')], False, payload,
+                                       digest=payload_digest(payload))
+    writer.close()
+    with open(writer.filename, 'rb') as f:
+        assert b'WARC-Payload-Digest: ' + payload_digest(payload).encode() + b'\r\n' in f.read()
+    with open(writer.filename + '.cdxj') as f:
+        assert cdxj.parse_line(f.readline())[2]['digest'] == payload_digest(payload)
+
+
+def read_frames(data):
+    dctx = zstandard.ZstdDecompressor()
+    records = []
+    while data:
+        # each record is a separate frame
+        frame_size = zstandard.frame_content_size(data)
+        assert frame_size > 0
+        obj = dctx.decompressobj()
+        records.append(obj.decompress(data))
+        data = obj.unused_data
+    return records
+
+
+@needs_zstd
+def test_zstd(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    writer = CCWARCWriter('ZSTD-TEST', 1000000, zstd=True)
+    write_some(writer)
+    assert writer.filename.endswith('.warc.zst')
+
+    with open(writer.filename, 'rb') as f:
+        records = read_frames(f.read())
+    assert len(records) == 7  # warcinfo and 3 pairs
+    assert records[0].startswith(b'WARC/1.0\r\n')
+    assert b'WARC-Type: warcinfo' in records[0]
+    assert b'Hello, world!' in records[1]
+
+
+@needs_zstd
+def test_zstd_dictionary(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    samples = [b'WARC/1.0\r\nWARC-Type: response\r\n' + os.urandom(8) * i for i in range(200)]
+    dict_data = zstandard.train_dictionary(1024, samples).as_bytes()
+
+    writer = CCWARCWriter('ZSTD-DICT-TEST', 1000000, zstd=True, zstd_dict=dict_data)
+    write_some(writer)
+
+    with open(writer.filename, 'rb') as f:
+        data = f.read()
+    magic, length = struct.unpack('<II', data[:8])
+    assert magic == 0x184D2A5D
+    assert data[8:8+length] == dict_data
+
+    dctx = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(dict_data))
+    obj = dctx.decompressobj()
+    assert obj.decompress(data[8+length:]).startswith(b'WARC/1.0\r\n')
+
+
+def check_cdxj(filename, decompress):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    with open(filename + '.cdxj') as f:
+        lines = [cdxj.parse_line(line) for line in f]
+    assert len(lines) == 3
+    for surt, timestamp, fields in lines:
+        assert fields['filename'] == os.path.basename(filename)
+        offset, length = int(fields['offset']), int(fields['length'])
+        record = decompress(data[offset:offset+length])
+        assert record.startswith(b'WARC/1.0\r\n')
+        assert b'\r\nWARC-Type: response\r\n' in record
+        assert b'WARC-Target-URI: ' + fields['url'].encode() + b'\r\n' in record
+        assert record.endswith(b'Hello, world!</html>\r\n\r\n')  # exactly one record
+
+
+def test_cdxj_offsets(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    writer = CCWARCWriter('CDXJ-GZIP-TEST', 1000000, cdxj=True)
+    write_some(writer)
+    assert writer.filename.endswith('.warc.gz')
+    check_cdxj(writer.filename, gzip.decompress)
+
+    writer = CCWARCWriter('CDXJ-PLAIN-TEST', 1000000, cdxj=True, gzip=False)
+    write_some(writer)
+    assert writer.filename.endswith('.warc')
+    check_cdxj(writer.filename, lambda b: b)
+
+
+@needs_zstd
+def test_cdxj_offsets_zstd(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    writer = CCWARCWriter('CDXJ-ZSTD-TEST', 1000000, cdxj=True, zstd=True)
+    write_some(writer)
+    check_cdxj(writer.filename, lambda b: zstandard.ZstdDecompressor().decompress(b))